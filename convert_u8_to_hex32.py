@@ -12,47 +12,39 @@ import argparse
 import re
 from pathlib import Path
 from typing import List, Optional
+import sys
 
+import numpy as np
 
-def parse_u8_numbers(text: str) -> List[int]:
+sys.path.insert(0, str(Path(__file__).resolve().parent / "data"))
+from hex_codec import encode_hex32  # noqa: E402
+
+
+def parse_u8_numbers(text: str) -> np.ndarray:
     """从文本中提取所有十进制数字，限制到 0..255。"""
-    nums: List[int] = []
-    for tok in re.findall(r"[-+]?\d+", text):
-        try:
-            v = int(tok)
-        except ValueError:
-            continue
-        # 允许负数？若出现，按 uint8 处理
-        if v < 0:
-            v = v % 256
-        if 0 <= v <= 255:
-            nums.append(v)
-    return nums
-
-
-def to_hex32_lines(u8s: List[int], lines: Optional[int]) -> List[str]:
+    nums = np.array([int(tok) for tok in re.findall(r"[-+]?\d+", text)], dtype=object)
+    # 允许负数？若出现，按 uint8 处理
+    nums = np.where(nums < 0, nums % 256, nums)
+    # 先按数值过滤再转换，超出 int64 的大数也直接跳过
+    return nums[(nums <= 255).astype(bool)].astype(np.uint8)
+
+
+def to_hex32_lines(u8s, lines: Optional[int]) -> List[str]:
     """将 u8 序列转为 32-bit 小端 hex 行。
     - 若 lines 为 None：输出覆盖所有输入（按 4 字节一组），末尾不足 4 字节用 0 补齐；
     - 若 lines 为整数：输出固定行数，不足补 0，多余裁剪。
     """
+    u8s = np.asarray(u8s, dtype=np.uint8)
     if lines is None:
         # 需要的总字节向上取整到 4 的倍数
         needed = ((len(u8s) + 3) // 4) * 4
-        data = u8s[:needed]
-        if len(data) < needed:
-            data = data + [0] * (needed - len(data))
     else:
         needed = lines * 4
-        data = u8s[:needed]
-        if len(data) < needed:
-            data = data + [0] * (needed - len(data))
-
-    out: List[str] = []
-    for i in range(0, needed, 4):
-        b0, b1, b2, b3 = data[i : i + 4]
-        # 小端：第一个数放低位 -> 输出字节顺序 b3 b2 b1 b0
-        out.append(f"{b3:02X}{b2:02X}{b1:02X}{b0:02X}")
-    return out
+    data = np.zeros(needed, dtype=np.uint8)
+    data[: min(needed, len(u8s))] = u8s[:needed]
+
+    # 小端：第一个数放低位 -> 输出字节顺序 b3 b2 b1 b0
+    return encode_hex32(data).splitlines()
 
 
 def main():
@@ -0,0 +1,192 @@
+"""
+Dataset-scale accumulator range profiler, to size the PE / partial-sum
+datapath from data.
+
+Runs the NumPy golden model over every image of one or more hex files, in
+chunks, and collects per layer and per channel the values each register of
+rtl_4pe/_npu.sv actually holds:
+
+  conv1.acc  conv_unit output per output channel (3x3 sum + bias)
+  conv2.pe   conv_unit output per input channel (one 3x3 partial sum)
+  conv2.sum  running sum over input channels, as write_npu.S accumulates it;
+             the last one is the conv2 accumulator
+  fc1.pe     pe_unit_fcn running sums over the inputs, per neuron
+  fc2.pe     likewise for fc2
+
+For each of them it builds a histogram of the signed two's complement width
+the value needs, the min/max, and the number of values a signed 24-bit
+register (logic signed [23:0]) could not hold. For the final accumulators
+mac_24bit sees (conv1.acc, conv2.acc, fc1.acc, fc2.acc) it also counts the
+values clamped to 0 by relu, clamped at 2**23-1, and changed by the `& 0xFF`
+truncation (wrapped).
+
+Usage:
+  python acc_profile.py -i input_32bit.hex
+  python acc_profile.py -i vectors.hex --count 100000 --json ranges.json --coverage 0.9999
+"""
+
+from __future__ import annotations
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import quant_np as Q
+
+MAX_BITS = 33          # int32 accumulators need at most 32 signed bits
+PE_BITS = 24
+ACC_MAX = 2**23 - 1
+
+
+def signed_width(v: np.ndarray) -> np.ndarray:
+    """Bits of the narrowest two's complement register that holds each value (0 needs 1 bit)."""
+    v = v.astype(np.int64)
+    mag = np.where(v >= 0, v, ~v)
+    return np.frexp(mag.astype(np.float64))[1] + 1
+
+
+class RangeStats:
+    """Width histogram and min/max per channel of one datapath quantity."""
+
+    def __init__(self, name: str, channels: int):
+        self.name = name
+        self.hist = np.zeros((channels, MAX_BITS + 1), dtype=np.int64)
+        self.min = np.full(channels, np.iinfo(np.int64).max)
+        self.max = np.full(channels, np.iinfo(np.int64).min)
+        self.over_pe = np.zeros(channels, dtype=np.int64)
+
+    def add(self, v: np.ndarray):
+        # v: (N, C, ...) with the channel on axis 1
+        v = np.moveaxis(v, 1, 0).reshape(v.shape[1], -1)
+        c = v.shape[0]
+        width = signed_width(v)
+        idx = np.arange(c)[:, None] * (MAX_BITS + 1) + width
+        self.hist += np.bincount(idx.ravel(), minlength=c * (MAX_BITS + 1)).reshape(c, -1)
+        self.min = np.minimum(self.min, v.min(axis=1))
+        self.max = np.maximum(self.max, v.max(axis=1))
+        self.over_pe += np.count_nonzero(width > PE_BITS, axis=1)
+
+    def width_for(self, coverage: float = 1.0) -> np.ndarray:
+        """Per channel, the narrowest width that holds the given fraction of values."""
+        cum = np.cumsum(self.hist, axis=1)
+        total = cum[:, -1:]
+        return np.argmax(cum >= np.ceil(total * coverage), axis=1)
+
+    def to_dict(self, coverage: float) -> Dict:
+        return {"channels": [{"channel": c, "min": int(self.min[c]), "max": int(self.max[c]),
+                              "bits": int(self.width_for()[c]), f"bits@{coverage}": int(self.width_for(coverage)[c]),
+                              "over_24b": int(self.over_pe[c]), "width_hist": self.hist[c].tolist()}
+                             for c in range(self.hist.shape[0])]}
+
+
+class Events:
+    """mac_24bit clamp/truncation counts per channel of a final accumulator."""
+
+    def __init__(self, channels: int):
+        self.count = np.zeros(channels, dtype=np.int64)
+        self.relu = np.zeros(channels, dtype=np.int64)
+        self.sat = np.zeros(channels, dtype=np.int64)
+        self.wrap = np.zeros(channels, dtype=np.int64)
+
+    def add(self, acc: np.ndarray):
+        a = np.moveaxis(acc, 1, 0).reshape(acc.shape[1], -1)
+        self.count += a.shape[1]
+        self.relu += np.count_nonzero(a < 0, axis=1)
+        self.sat += np.count_nonzero(a > ACC_MAX, axis=1)
+        self.wrap += np.count_nonzero(a > 255, axis=1)
+
+    def to_dict(self) -> Dict:
+        return {k: getattr(self, k).tolist() for k in ("count", "relu", "sat", "wrap")}
+
+
+def fc_running_sums(x: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """(N, Out, In) running sums of a PE that adds x[i] * w[o, i] one input at a time."""
+    return np.cumsum(x.astype(np.int32)[:, None, :] * w.astype(np.int32)[None, :, :], axis=2, dtype=np.int64)
+
+
+class AccProfiler:
+    def __init__(self, model: Q.QuantizedCNN):
+        self.m = model
+        c1 = model.q_conv1_w.shape[0]
+        cin2 = model.q_conv2_w.shape[1]
+        self.ranges = {
+            "conv1.acc": RangeStats("conv1.acc", c1),
+            "conv2.pe": RangeStats("conv2.pe", cin2),
+            "conv2.sum": RangeStats("conv2.sum", cin2),
+            "fc1.pe": RangeStats("fc1.pe", model.q_fc1_w.shape[0]),
+            "fc2.pe": RangeStats("fc2.pe", model.q_fc2_w.shape[0]),
+        }
+        self.events = {"conv1.acc": Events(c1), "conv2.acc": Events(1),
+                       "fc1.acc": Events(model.q_fc1_w.shape[0]), "fc2.acc": Events(model.q_fc2_w.shape[0])}
+        self.images = 0
+
+    def add(self, x: np.ndarray):
+        m = self.m
+        acc1 = Q.conv2d_acc(x, m.q_conv1_w, m.q_conv1_b)
+        conv1 = Q.acc_to_u8(acc1)
+        self.ranges["conv1.acc"].add(acc1)
+        self.events["conv1.acc"].add(acc1)
+
+        # conv2 as the host runs it: one 3x3 conv per input channel, summed in memory
+        w2 = m.q_conv2_w[0]
+        kh, kw = w2.shape[1:]
+        win = sliding_window_view(conv1, (kh, kw), axis=(2, 3)).astype(np.float64)
+        pe = np.rint(np.einsum("ncijhw,chw->ncij", win, w2.astype(np.float64))).astype(np.int64)
+        running = np.cumsum(pe, axis=1)
+        acc2 = running[:, -1:] + int(m.q_conv2_b[0])
+        self.ranges["conv2.pe"].add(pe)
+        self.ranges["conv2.sum"].add(running)
+        self.events["conv2.acc"].add(acc2)
+
+        fc_in = Q.acc_to_u8(acc2).reshape(x.shape[0], -1)
+        for name, w, b in (("fc1", m.q_fc1_w, m.q_fc1_b), ("fc2", m.q_fc2_w, m.q_fc2_b)):
+            sums = fc_running_sums(fc_in, w)
+            acc = sums[:, :, -1] + b.astype(np.int64)
+            self.ranges[f"{name}.pe"].add(sums)
+            self.events[f"{name}.acc"].add(acc)
+            fc_in = Q.acc_to_u8(acc)
+        self.images += x.shape[0]
+
+    def report(self, coverage: float) -> Dict:
+        return {"images": self.images, "coverage": coverage,
+                "ranges": {k: r.to_dict(coverage) for k, r in self.ranges.items()},
+                "events": {k: e.to_dict() for k, e in self.events.items()}}
+
+
+def main():
+    from batch_run import iter_chunks, iter_images
+
+    ap = argparse.ArgumentParser(description="Accumulator width histograms and clamp/wrap counts per layer and channel")
+    ap.add_argument("-i", "--input", type=Path, nargs="+", required=True, help="32-bit/line hex files, 60 lines per image")
+    ap.add_argument("--count", type=int, default=None)
+    ap.add_argument("--chunk", type=int, default=2048)
+    ap.add_argument("--coverage", type=float, default=0.9999, help="also report the width holding this fraction of values")
+    ap.add_argument("--json", type=Path, default=None, help="full report with the width histograms")
+    args = ap.parse_args()
+
+    prof = AccProfiler(Q.load_model())
+    for _, _, x in iter_chunks(iter_images(args.input, 0, args.count), args.chunk):
+        prof.add(x)
+
+    print(f"{prof.images} images")
+    print(f"{'quantity':10} {'ch':>3} {'min':>10} {'max':>10} {'bits':>5} {'bits@' + str(args.coverage):>12} {'>24b':>8}")
+    need: List[int] = []
+    for r in prof.ranges.values():
+        full, cov = r.width_for(), r.width_for(args.coverage)
+        for c in range(r.hist.shape[0]):
+            print(f"{r.name:10} {c:3d} {r.min[c]:10d} {r.max[c]:10d} {full[c]:5d} {cov[c]:12d} {r.over_pe[c]:8d}")
+        need.append(int(full.max()))
+    print(f"{'acc':10} {'ch':>3} {'values':>10} {'relu':>10} {'sat':>8} {'wrap':>10}")
+    for name, e in prof.events.items():
+        for c in range(e.count.size):
+            print(f"{name:10} {c:3d} {e.count[c]:10d} {e.relu[c]:10d} {e.sat[c]:8d} {e.wrap[c]:10d}")
+    print(f"widest PE value seen: {max(need)} bits (RTL: {PE_BITS})")
+    if args.json:
+        args.json.write_text(json.dumps(prof.report(args.coverage), indent=1) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Golden model backend switch.
+
+Both backends provide the same functions (quantized_conv2d, quantized_conv3d,
+quantized_linear, mac_24bit, ..., QuantizedCNN, load_model) plus
+from_numpy()/to_numpy() for their array type:
+
+  numpy  quant_np.py, the default; never imports torch
+  torch  network_structure.py, imported only when selected
+
+The backend is picked by name, else by the NPU_BACKEND environment variable,
+else numpy.
+
+Usage:
+  from backend import get_backend
+  B = get_backend()                  # or get_backend("torch")
+  layers = B.load_model().forward_layers(B.from_numpy(x))
+"""
+
+import importlib
+import os
+
+BACKENDS = {"numpy": "quant_np", "torch": "network_structure"}
+DEFAULT_BACKEND = "numpy"
+# Version of the golden arithmetic both backends implement (int8 x uint8 MACs,
+# int32 sums, clamp to [0, 2**23-1], low byte). Bump it whenever a change
+# alters any layer output, so cached golden results are recomputed.
+SEMANTICS_VERSION = 1
+
+
+def backend_name(name=None):
+    name = name or os.environ.get("NPU_BACKEND") or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return name
+
+
+def get_backend(name=None):
+    return importlib.import_module(BACKENDS[backend_name(name)])
+
+
+def load_model(weight_dir=None, cache=True, backend=None):
+    return get_backend(backend).load_model(weight_dir, cache)
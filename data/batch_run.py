@@ -0,0 +1,147 @@
+"""
+Batch golden-model runner.
+
+Streams 16x15 images out of one or more 32-bit-per-line hex files (the
+input_32bit.hex / d_cache layout: 60 little-endian words per image), runs them
+through QuantizedCNN in chunks on a process pool and writes, per image, the
+res.hex-layout d_cache dump (conv1, conv2 accumulators, fc1, fc2) plus one
+summary line with the final output. Only a bounded number of chunks is in
+flight at any time, so memory stays flat for any input size. With --cache,
+results of images already seen with the same weights come from the golden
+cache (golden_cache.py) instead of being recomputed.
+
+Usage:
+  python batch_run.py -i input_all.hex --count 1 -o golden
+  python batch_run.py -i vec_a.hex vec_b.hex -o golden --chunk 512 --jobs 8
+  python batch_run.py -i input_all.hex --count 1 -o golden --backend torch
+  python batch_run.py -i vectors.hex -o golden --cache .golden_cache --cache-mb 512
+"""
+
+from __future__ import annotations
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backend import BACKENDS, backend_name
+from golden_cache import GoldenCache, forward_layers_cached
+from hex_codec import decode_hex32
+
+IMG_SHAPE = (1, 16, 15)
+IMG_BYTES = 16 * 15
+IMG_WORDS = IMG_BYTES // 4
+
+
+def iter_images(paths: Iterable[Path], skip: int = 0, count: Optional[int] = None) -> Iterator[Tuple[str, int, np.ndarray]]:
+    """Yield (file, frame, uint8 image) for every complete 60-line frame; a trailing partial frame is dropped."""
+    def frames():
+        for path in paths:
+            words: List[str] = []
+            frame = 0
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    words.append(line)
+                    if len(words) == IMG_WORDS:
+                        yield str(path), frame, decode_hex32("\n".join(words)).reshape(IMG_SHAPE)
+                        words = []
+                        frame += 1
+
+    stop = None if count is None else skip + count
+    return islice(frames(), skip, stop)
+
+
+def iter_chunks(images: Iterator[Tuple[str, int, np.ndarray]], chunk: int) -> Iterator[Tuple[int, List[Tuple[str, int]], np.ndarray]]:
+    """Group the image stream into (first index, sources, (n,1,16,15) array) batches."""
+    start = 0
+    while True:
+        group = list(islice(images, chunk))
+        if not group:
+            return
+        sources = [(src, frame) for src, frame, _ in group]
+        yield start, sources, np.stack([img for _, _, img in group])
+        start += len(group)
+
+
+def _init_worker(backend: Optional[str] = None):
+    if backend_name(backend) == "torch":
+        import torch
+        torch.set_num_threads(1)  # one process per core, no oversubscription
+
+
+@lru_cache(maxsize=None)
+def _open_cache(root: str, max_bytes: int) -> GoldenCache:
+    return GoldenCache(root, max_bytes)  # one per worker process
+
+
+def run_chunk(start: int, sources: List[Tuple[str, int]], x: np.ndarray, out_dir: Optional[str],
+              backend: Optional[str] = None, cache: Optional[Tuple[str, int]] = None) -> List[Tuple[int, str, int, int]]:
+    from cal_result import res_hex_lines
+
+    layers = forward_layers_cached(x, _open_cache(*cache) if cache else None, backend)
+    rows = []
+    for k, (src, frame) in enumerate(sources):
+        idx = start + k
+        if out_dir is not None:
+            lines = res_hex_lines(layers["conv1"][k], layers["conv2_acc"][k], layers["fc1"][k], layers["fc2"][k])
+            with open(os.path.join(out_dir, f"res_{idx:06d}.hex"), "w") as f:
+                f.write("\n".join(lines) + "\n")
+        rows.append((idx, src, frame, int(layers["fc2"][k, 0])))
+    return rows
+
+
+def run_batches(chunks: Iterable, out_dir: Optional[str], jobs: Optional[int] = None,
+                backend: Optional[str] = None, cache: Optional[Tuple[str, int]] = None) -> Iterator[Tuple[int, str, int, int]]:
+    """Run chunks on a process pool, yielding (index, file, frame, fc2) per image in input order."""
+    jobs = jobs or os.cpu_count() or 1
+    window = 2 * jobs  # chunks in flight
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(backend,)) as ex:
+        pending = deque()
+        for start, sources, x in chunks:
+            pending.append(ex.submit(run_chunk, start, sources, x, out_dir, backend, cache))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the golden QuantizedCNN over every image in one or more hex files")
+    ap.add_argument("-i", "--input", type=Path, nargs="+", required=True, help="32-bit/line hex files, 60 lines per image")
+    ap.add_argument("-o", "--output", type=Path, required=True, help="output directory")
+    ap.add_argument("--chunk", type=int, default=256, help="images per batch")
+    ap.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    ap.add_argument("--skip", type=int, default=0, help="skip the first N images")
+    ap.add_argument("--count", type=int, default=None, help="process at most N images")
+    ap.add_argument("--no-dump", action="store_true", help="only write the summary, no per-image res hex")
+    ap.add_argument("--backend", choices=sorted(BACKENDS), default=None, help="golden model backend (default: $NPU_BACKEND or numpy)")
+    ap.add_argument("--cache", default=None, help="golden result cache directory")
+    ap.add_argument("--cache-mb", type=float, default=256, help="cache size limit, least recently used entries go first")
+    args = ap.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    out_dir = None if args.no_dump else str(args.output)
+    chunks = iter_chunks(iter_images(args.input, args.skip, args.count), args.chunk)
+    cache = (os.path.abspath(args.cache), int(args.cache_mb * (1 << 20))) if args.cache else None
+
+    n = 0
+    with open(args.output / "summary.csv", "w") as f:
+        f.write("index,source,frame,fc2\n")
+        for idx, src, frame, out in run_batches(chunks, out_dir, args.jobs, args.backend, cache):
+            f.write(f"{idx},{src},{frame},{out}\n")
+            n += 1
+
+    print(f"Images: {n}")
+    print(f"Saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Benchmark suite for the golden model kernels and the hex tooling.
+
+Times, for batch sizes from 1 to 10k images and for several image sizes:
+
+  kernel  quantized_conv2d, quantized_conv3d, quantized_linear and the whole
+          forward_layers() of the selected backend
+  io      load_hex_weights, load_input, hex_codec encode/decode, cal_result
+          res_hex_lines, and the root scripts convert_u8_to_hex32.py,
+          format_hex8_continuous.py and fill_hex32_from_next.py
+
+Each benchmark runs once to warm up, then repeatedly until it has at least
+--repeat runs and --min-time seconds; the median and best run are
+recorded. Results go to a JSON file together with the machine they ran on
+(platform, CPU, core count, Python/NumPy/torch versions, git commit).
+
+Against a stored baseline (--baseline, default bench_baseline.json next to
+this file) every benchmark whose median is more than --threshold slower,
+and slower by at least --floor seconds (timer noise), is reported as a
+regression and the exit status is 1. Baselines from another machine are
+compared anyway, with a warning. --save-baseline stores the current run.
+No baseline is committed, since timings only compare on one machine: store
+one on the machine that runs the suite. With --ci a missing baseline is an
+error (exit status 2), so a CI job cannot pass without comparing.
+
+Usage:
+  python bench.py                                  # full suite, compare with bench_baseline.json
+  python bench.py --quick --save-baseline          # smaller batches, new baseline
+  python bench.py --quick --ci                     # nightly job: fail on regressions or no baseline
+  python bench.py -k conv2d -k load_input --threshold 0.5 -o nightly.json
+  python bench.py --backend torch --batches 1 100 1000
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backend import BACKENDS, backend_name, get_backend
+from hex_codec import decode_hex32, encode_hex32, encode_hex8
+from weights_io import DATA_DIR, WEIGHT_FILES, load_hex_weights, load_input
+
+ROOT = Path(DATA_DIR).parent
+DEFAULT_BASELINE = Path(DATA_DIR) / "bench_baseline.json"
+BATCHES = (1, 10, 100, 1000, 10000)
+QUICK_BATCHES = (1, 10, 100, 1000)
+IMAGE_SIZES = ((16, 15), (32, 30), (64, 60))
+MAX_PIXELS = 10000 * 16 * 15    # largest conv input per run: 10k frames of 16x15
+
+
+@dataclass
+class Result:
+    name: str
+    group: str
+    items: int              # images (or lines / files) per run
+    runs: int
+    median_s: float
+    min_s: float
+
+    @property
+    def per_item_us(self) -> float:
+        return self.median_s / self.items * 1e6
+
+
+@dataclass
+class Bench:
+    name: str
+    group: str
+    items: int
+    setup: Callable[[], Callable[[], object]]   # returns the timed callable
+
+
+def time_it(fn: Callable[[], object], repeat: int, min_time: float) -> Tuple[int, float, float]:
+    fn()  # warm up: imports, caches, first-touch allocations
+    times: List[float] = []
+    start = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - start < min_time and len(times) < 1000):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return len(times), float(np.median(times)), float(min(times))
+
+
+def _images(n: int, hw: Tuple[int, int], seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (n, 1) + hw, dtype=np.uint8)
+
+
+def kernel_benches(backend: Optional[str], batches: Tuple[int, ...]) -> Iterator[Bench]:
+    B = get_backend(backend)
+    model = B.load_model()
+    w1, b1, w2, b2 = model.q_conv1_w, model.q_conv1_b, model.q_conv2_w, model.q_conv2_b
+    c1 = B.to_numpy(w1).shape[0]
+
+    for hw in IMAGE_SIZES:
+        for n in batches:
+            if n * hw[0] * hw[1] > MAX_PIXELS:
+                continue
+            tag = f"n={n},{hw[0]}x{hw[1]}"
+
+            def conv2d(n=n, hw=hw):
+                x = B.from_numpy(_images(n, hw))
+                return lambda: B.quantized_conv2d(x, w1, b1)
+
+            def conv3d(n=n, hw=hw):
+                x = B.from_numpy(_images(n, (hw[0] - 2, hw[1] - 2)).repeat(c1, axis=1))
+                return lambda: B.quantized_conv3d(x, w2, b2)
+
+            yield Bench(f"conv2d[{tag}]", "kernel", n, conv2d)
+            yield Bench(f"conv3d[{tag}]", "kernel", n, conv3d)
+
+    n_in = B.to_numpy(model.q_fc1_w).shape[1]
+    for n in batches:
+        def linear(n=n):
+            x = B.from_numpy(np.random.default_rng(0).integers(0, 256, (n, n_in), dtype=np.uint8))
+            return lambda: B.quantized_linear(x, model.q_fc1_w, model.q_fc1_b)
+
+        def forward(n=n):
+            x = B.from_numpy(_images(n, (16, 15)))
+            return lambda: model.forward_layers(x)
+
+        yield Bench(f"linear[n={n}]", "kernel", n, linear)
+        yield Bench(f"forward_layers[n={n}]", "kernel", n, forward)
+
+
+def io_benches(batches: Tuple[int, ...], tmp: str) -> Iterator[Bench]:
+    sys.path.insert(0, str(ROOT))
+    import convert_u8_to_hex32
+    import fill_hex32_from_next
+    import format_hex8_continuous
+    from cal_result import res_hex_lines
+
+    for name, (fname, _) in WEIGHT_FILES.items():
+        path = os.path.join(DATA_DIR, fname)
+        yield Bench(f"load_hex_weights[{name}]", "io", 1, lambda path=path: lambda: load_hex_weights(path))
+
+    dcache_lines = [fill_hex32_from_next.normalize_hex(ln)
+                    for ln in (ROOT / "dcache_init_4bytes_perline.hex").read_text().splitlines()]
+    dcache_lines = [ln for ln in dcache_lines if ln]
+
+    for n in batches:
+        x = _images(n, (16, 15)).reshape(n, -1)
+        text = encode_hex32(x.reshape(-1))
+
+        def load(n=n, text=text):
+            path = os.path.join(tmp, f"input_{n}.hex")
+            Path(path).write_text(text)
+            return lambda: load_input(path)
+
+        yield Bench(f"load_input[n={n}]", "io", n, load)
+        yield Bench(f"encode_hex32[n={n}]", "io", n, lambda x=x: lambda: encode_hex32(x.reshape(-1)))
+        yield Bench(f"decode_hex32[n={n}]", "io", n, lambda text=text: lambda: decode_hex32(text))
+
+        if n <= 1000:   # per-image Python loops; 10k only repeats the same work
+            def res_hex(n=n):
+                B = get_backend()
+                layers = {k: B.to_numpy(v) for k, v in B.load_model().forward_layers(B.from_numpy(_images(n, (16, 15)))).items()}
+                return lambda: [res_hex_lines(layers["conv1"][k], layers["conv2_acc"][k], layers["fc1"][k],
+                                              layers["fc2"][k]) for k in range(n)]
+
+            printed = " ".join(str(list(img)) for img in x)
+            yield Bench(f"res_hex_lines[n={n}]", "io", n, res_hex)
+            yield Bench(f"convert_u8_to_hex32[n={n}]", "io", n, lambda printed=printed, n=n: lambda: (
+                convert_u8_to_hex32.to_hex32_lines(convert_u8_to_hex32.parse_u8_numbers(printed), 60 * n)))
+            hex8 = encode_hex8(x.reshape(-1))
+            yield Bench(f"format_hex8_continuous[n={n}]", "io", n, lambda hex8=hex8: lambda: (
+                encode_hex32(format_hex8_continuous.parse_hex_bytes(hex8), byteorder="big")))
+            lines = dcache_lines * n
+            yield Bench(f"fill_hex32_from_next[copies={n}]", "io", n,
+                        lambda lines=lines: lambda: fill_hex32_from_next.fill_to_32bit(lines))
+
+
+def machine_info(backend: Optional[str]) -> Dict[str, object]:
+    info: Dict[str, object] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "backend": backend_name(backend),
+    }
+    try:
+        with open("/proc/cpuinfo") as f:
+            m = re.search(r"model name\s*:\s*(.*)", f.read())
+        if m:
+            info["cpu"] = m.group(1).strip()
+    except OSError:
+        pass
+    if "torch" in sys.modules:
+        info["torch"] = sys.modules["torch"].__version__
+    try:
+        info["git"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DATA_DIR, capture_output=True,
+                                     text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return info
+
+
+def compare(results: List[Result], baseline: Dict, threshold: float, floor: float) -> List[Tuple[Result, float]]:
+    """(result, baseline median) of every benchmark slower than the baseline by more than the threshold."""
+    base = {r["name"]: r for r in baseline.get("results", [])}
+    slow = []
+    for r in results:
+        b = base.get(r.name)
+        if b is None:
+            continue
+        ref = b["median_s"]
+        if r.median_s > ref * (1 + threshold) and r.median_s - ref > floor:
+            slow.append((r, ref))
+    return slow
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Time the golden model kernels and hex tools, compare with a baseline")
+    ap.add_argument("-k", "--filter", action="append", default=[], help="regex on benchmark names (repeatable)")
+    ap.add_argument("--batches", type=int, nargs="+", default=None, help=f"batch sizes (default: {BATCHES})")
+    ap.add_argument("--quick", action="store_true", help=f"batch sizes {QUICK_BATCHES}")
+    ap.add_argument("--group", choices=("kernel", "io"), default=None)
+    ap.add_argument("--backend", choices=sorted(BACKENDS), default=None)
+    ap.add_argument("--repeat", type=int, default=5, help="minimum timed runs")
+    ap.add_argument("--min-time", type=float, default=0.2, help="minimum seconds of timed runs")
+    ap.add_argument("-o", "--output", type=Path, default=None, help="write the results as JSON")
+    ap.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25 %%")
+    ap.add_argument("--floor", type=float, default=50e-6, help="ignore slowdowns smaller than this many seconds")
+    ap.add_argument("--ci", action="store_true", help="a missing baseline is an error (exit status 2)")
+    args = ap.parse_args()
+
+    batches = tuple(args.batches or (QUICK_BATCHES if args.quick else BATCHES))
+    results: List[Result] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        benches = list(kernel_benches(args.backend, batches)) + list(io_benches(batches, tmp))
+        print(f"{'benchmark':40} {'runs':>5} {'median ms':>10} {'best ms':>10} {'us/item':>10}")
+        for b in benches:
+            if args.group and b.group != args.group:
+                continue
+            if args.filter and not any(re.search(p, b.name) for p in args.filter):
+                continue
+            runs, med, best = time_it(b.setup(), args.repeat, args.min_time)
+            r = Result(b.name, b.group, b.items, runs, med, best)
+            results.append(r)
+            print(f"{r.name:40} {r.runs:5d} {r.median_s * 1e3:10.3f} {r.min_s * 1e3:10.3f} {r.per_item_us:10.2f}")
+
+    report = {"machine": machine_info(args.backend), "results": [asdict(r) for r in results]}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=1) + "\n")
+
+    failed = False
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())
+        old, new = baseline.get("machine", {}), report["machine"]
+        differ = [k for k in ("cpu", "cpu_count", "python", "numpy", "backend") if old.get(k) != new.get(k)]
+        if differ:
+            print(f"warning: baseline machine differs in {', '.join(differ)}")
+        slow = compare(results, baseline, args.threshold, args.floor)
+        for r, ref in slow:
+            print(f"REGRESSION {r.name}: {r.median_s * 1e3:.3f} ms, baseline {ref * 1e3:.3f} ms "
+                  f"({r.median_s / ref - 1:+.0%})")
+        print(f"baseline {args.baseline} ({old.get('git', '?')}, {old.get('timestamp', '?')}): "
+              f"{len(slow)} of {len(results)} benchmarks slower than +{args.threshold:.0%}")
+        failed = bool(slow)
+    elif not args.save_baseline:
+        print(f"no baseline at {args.baseline}; run with --save-baseline to store one")
+        if args.ci:
+            raise SystemExit(2)
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=1) + "\n")
+        print(f"Saved baseline: {args.baseline}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
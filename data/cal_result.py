@@ -1,7 +1,28 @@
-from network_structure import *
+import os
+import sys
+
+from backend import get_backend
+from memory_map import DEFAULT_MAP, load_map
+from sram_image import SramImage
+from weights_io import DATA_DIR, load_input
+
+def res_hex_lines(conv1, conv2_acc, fc1, fc2, mem_map=DEFAULT_MAP):
+    # d_cache content from mem_map.golden_base on for one image, as res.hex lines
+    img = SramImage.from_map(mem_map)
+    img.write("conv1", conv1)
+    img.write("conv2", conv2_acc)  # raw 24-bit accumulators, one word each
+    img.write("fc1", fc1)
+    img.write("fc2", fc2)
+    # bytes between the layers were never written and come out as 'xx'
+    end = max(r.base + r.nbytes for r in mem_map.regions)
+    return img.to_hex32(mem_map.golden_base, end).splitlines()
 
 if __name__ == "__main__":
-    input = load_input("./input_32bit.hex")
+    # optional argument: address map from weight_placement.py (default: write_npu.S layout)
+    mem_map = load_map(sys.argv[1] if len(sys.argv) > 1 else None)
+    B = get_backend()  # $NPU_BACKEND, numpy by default
+    model = B.load_model()
+    input = load_input(os.path.join(DATA_DIR, "input_32bit.hex"))
     input = input.reshape(1, 1, 16, 15)
     print(input)
     for i in range(3):
@@ -9,81 +30,23 @@ if __name__ == "__main__":
             print(input[0, 0, 1+i, 5+j], end=' ')
         print()
 
-    x = torch.tensor(input, dtype=torch.uint8)
-
-    conv1_res_base = 2000
-    conv2_res_base = 4000
-    fc1_res_base = 4600
-    fc2_res_base = 4700
-    
-    sram_res = []
-    # conv1
-    x = quantized_conv2d(x, model.q_conv1_w, model.q_conv1_b)
-    # x = quantized_relu8(x)
-    print("conv1 out Shape :", x.shape)
-    # print(x)
-    _, chan, col, row = x.shape
-    for ch in range(chan):
-        for c in range(col):
-            for r in range(row):
-                val = x[0, ch, c, r]
-                # val = int(val) & 0xFF
-                str = format(val, '02X')
-                sram_res.append(str)
-    for i in range(4000-2000-1820):
-        sram_res.append('xx')
-    # conv2
-    y = quantized_conv3d_debug(x, model.q_conv2_w, model.q_conv2_b)  # for debugging
-    x = quantized_conv3d(x, model.q_conv2_w, model.q_conv2_b) # cal result
-    print("conv2 out Shape:", x.shape)
-    print(x.dtype) # uint32
-    chan, _, col, row = x.shape
-    for ch in range(chan):
-        for c in range(col):
-            for r in range(row):
-                val = y[ch, 0, c, r]
-                str = format(val, '08X')
-                sram_res.append(str)
-    for i in range(4600-4000-132*4):
-        sram_res.append('xx')
-    # fcn1
-    x = x.view(x.size(0), -1)  # Flatten for fully connected layers
-    # print(x)
-    print("conv2 out flattened Shape:", x.shape)
-    print(x.dtype) # uint32
-    x = quantized_linear(x, model.q_fc1_w, model.q_fc1_b)
-    print("fcn1 out Shape:", x.shape)
-    print(x.dtype)
-    # x = quantized_relu8(x)
-    chan, row = x.shape
-    for ch in range(chan):
-        for r in range(row):
-            val = x[ch, r]
-            # val = int(val) & 0xFF
-            str = format(val, '02X')
-            sram_res.append(str)
-    for i in range(4700-4600-10):
-        sram_res.append('xx')
+    x = B.from_numpy(input)
 
-    # fcn2
-    x = quantized_linear(x, model.q_fc2_w, model.q_fc2_b)
-    print("fcn2 out Shape:", x.shape)
-    val = x[0, 0]
-    print(val)
-    # val = int(val) & 0xFF
-    str = format(val, '02X')
-    sram_res.append(str)
+    # one pass: every layer's output plus its raw accumulator (<layer>_pre)
+    layers = model.forward_layers(x, trace=True)
+    print("conv1 out Shape :", layers["conv1"].shape)
+    print("conv2 out Shape:", layers["conv2"].shape)
+    print("conv2 out flattened Shape:", layers["conv2"].reshape(layers["conv2"].shape[0], -1).shape)
+    print("fcn1 out Shape:", layers["fc1"].shape)
+    print("fcn2 out Shape:", layers["fc2"].shape)
+    print(layers["fc2"][0, 0])
+    for name in ("conv1", "conv2", "fc1", "fc2"):
+        pre = B.to_numpy(layers[f"{name}_pre"])
+        print(f"{name} acc range: [{pre.min()}, {pre.max()}]")
 
-    file_name = "res.hex"
+    file_name = os.path.join(DATA_DIR, "res.hex")
     with open(file_name, "w") as f:
-        for i in range(0, len(sram_res), 4):
-            if (len(sram_res[i]) == 2):
-                group = sram_res[i:i+4]
-                group = group[::-1]  # 逆序
-                line = ''.join(group)
-                f.write(line + '\n')
-            else:
-                for k in range(4):
-                    f.write(sram_res[i+k] + '\n')
+        for line in res_hex_lines(*(B.to_numpy(layers[k][0]) for k in ("conv1", "conv2_acc", "fc1", "fc2")), mem_map):
+            f.write(line + '\n')
 
-    print(f"Calculation finished and d_cache content saved to {file_name}")
\ No newline at end of file
+    print(f"Calculation finished and d_cache content saved to {file_name}")
@@ -0,0 +1,276 @@
+"""
+Calibration: picks the int8 weight scale of every layer from float weights
+and a calibration set, and writes the four *_weight.txt files.
+
+The datapath has no requantization step: a layer's uint8 output is its
+int32 accumulator after relu, the 2**23-1 clamp and `& 0xFF`. So with
+weights q_l = quantize_int8(w_l * s_l) the integer network tracks the float
+one (relu after every layer, pixels 0..255 as inputs, no biases; the packed
+format has none) scaled by S_l = s_1 * ... * s_l, and a scale too large makes
+accumulators wrap past 255 while one too small rounds the weights away.
+
+Candidate scales are 2**shift with shift on a 1/--per-octave grid, from the
+one that rounds the largest weight to 1 up to the one that puts it at 127
+(--per-octave 1 gives plain power-of-two shifts). Layers are chosen in order,
+conv1 first: all candidates of a layer, with the layers before it at their
+chosen scale, form one multi_eval.WeightStack and are evaluated in a single
+batched bit-exact pass; calibration chunks run on a process pool with a
+bounded number in flight, as batch_run.py. The candidate with the smallest
+layer error wins. A final round evaluates every candidate of every layer
+with all other layers at their chosen scale for the report:
+
+  err      RMS(q_l / S_l - f_l) / RMS(f_l): layer output against the float
+           network, in float units
+  wrap     fraction of the layer's accumulators above 255 (changed by & 0xFF)
+  sat      fraction above 2**23-1 (clamped)
+  fc2_err  err of the network output
+  agree    fraction of images where fc2 / S_4 and the float output fall on
+           the same side of --threshold (default: the float median)
+  acc      with --labels, fraction of images where fc2 / S_4 > threshold
+           matches the label
+
+Float weights come from an .npz with load_weights() names (conv1_weight,
+...) or a torch state_dict (.pt/.pth, conv1.weight, ...; needs torch).
+
+Usage:
+  python calibrate.py -f float_weights.npz -i input_all.hex -o calibrated
+  python calibrate.py -f model.pt -i calib.hex --count 20000 --labels calib_labels.txt --jobs 8 --json cal.json
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import quant_np as Q
+from batch_run import _init_worker, iter_chunks, iter_images
+from hex_codec import encode_weights
+from multi_eval import PARAMS, WeightStack, forward_layers
+from weights_io import BIAS_SIZES, WEIGHT_FILES
+
+LAYERS = ("conv1", "conv2", "fc1", "fc2")
+ACC_MAX = 2**23 - 1
+PER_LINE = {"fc2_weight": 1}  # bytes per line of the weight files, 10 otherwise
+
+
+def load_float_weights(path) -> Dict[str, np.ndarray]:
+    """Float weights in load_weights() naming and WEIGHT_FILES shapes."""
+    path = Path(path)
+    if path.suffix in (".pt", ".pth"):
+        import torch
+        raw = {k: v.detach().cpu().numpy() for k, v in torch.load(path, map_location="cpu").items()}
+    else:
+        with np.load(path) as f:
+            raw = {k: f[k] for k in f.files}
+    raw = {k.replace(".", "_"): np.asarray(v, dtype=np.float64) for k, v in raw.items()}
+    weights = {}
+    for name, (_, shape) in WEIGHT_FILES.items():
+        if name not in raw:
+            raise ValueError(f"{path}: no {name}")
+        if raw[name].size != int(np.prod(shape)):
+            raise ValueError(f"{path}: {name} has shape {raw[name].shape}, the network needs {shape}")
+        weights[name] = raw[name].reshape(shape)
+    for name in BIAS_SIZES:
+        if name in raw and np.any(raw[name]):
+            raise ValueError(f"{path}: {name} is nonzero, but the packed weight format has no biases")
+    return weights
+
+
+def candidate_shifts(w: np.ndarray, per_octave: int) -> np.ndarray:
+    """log2 scales on the 1/per_octave grid from max|w| * s = 1 to max|w| * s = 127."""
+    top = np.log2(127 / np.abs(w).max())
+    lo, hi = np.ceil(-np.log2(np.abs(w).max()) * per_octave), np.floor(top * per_octave)
+    return np.arange(lo, hi + 1) / per_octave + 0.0  # no -0.0
+
+
+def quantize(fw: Dict[str, np.ndarray], shifts: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """int8 weight set (plus the zero biases) for one shift per layer."""
+    q = {f"{l}_weight": Q.quantize_int8(fw[f"{l}_weight"] * 2.0 ** shifts[l], is_weight=True) for l in LAYERS}
+    q.update({name: np.zeros(size, dtype=np.int8) for name, size in BIAS_SIZES.items()})
+    return q
+
+
+def float_forward(fw: Dict[str, np.ndarray], x: np.ndarray) -> Dict[str, np.ndarray]:
+    """The float network on raw pixels, relu after every layer, in forward_layers() shapes."""
+    x = x.astype(np.float64)
+    w1, w2 = fw["conv1_weight"], fw["conv2_weight"]
+    win = sliding_window_view(x, w1.shape[2:], axis=(2, 3))
+    conv1 = np.maximum(np.einsum("ncijhw,ochw->noij", win, w1), 0)
+    win = sliding_window_view(conv1, w2.shape[2:], axis=(2, 3))
+    conv2 = np.maximum(np.einsum("ncijhw,ochw->noij", win, w2), 0)
+    fc1 = np.maximum(conv2.reshape(x.shape[0], -1) @ fw["fc1_weight"].T, 0)
+    fc2 = np.maximum(fc1 @ fw["fc2_weight"].T, 0)
+    return {"conv1": conv1, "conv2": conv2, "fc1": fc1, "fc2": fc2}
+
+
+class Stats:
+    """Sums over the calibration set, per candidate weight set (axis 0) and layer."""
+    SUMS = ("sq_err", "sq_ref", "wrap", "sat", "values", "agree", "correct")
+
+    def __init__(self, m: int):
+        self.sq_err = np.zeros((m, len(LAYERS)))
+        self.sq_ref = np.zeros((m, len(LAYERS)))
+        self.wrap = np.zeros((m, len(LAYERS)), dtype=np.int64)
+        self.sat = np.zeros((m, len(LAYERS)), dtype=np.int64)
+        self.values = np.zeros((m, len(LAYERS)), dtype=np.int64)
+        self.agree = np.zeros(m, dtype=np.int64)
+        self.correct = np.zeros(m, dtype=np.int64)
+        self.images = 0
+        self.labelled = 0
+
+    def merge(self, o: "Stats"):
+        for name in self.SUMS:
+            setattr(self, name, getattr(self, name) + getattr(o, name))
+        self.images += o.images
+        self.labelled += o.labelled
+
+    def err(self) -> np.ndarray:
+        return np.sqrt(self.sq_err / np.maximum(self.sq_ref, 1e-300))
+
+
+def eval_chunk(params: Dict[str, np.ndarray], gains: np.ndarray, fw: Dict[str, np.ndarray], x: np.ndarray,
+               threshold: float, labels: Optional[np.ndarray] = None) -> Stats:
+    """Stats of M weight sets (params stacked on axis 0, gains (M, 4) = S_l) on one chunk."""
+    m = gains.shape[0]
+    layers = forward_layers(WeightStack([""] * m, params), x, trace=True)
+    ref = float_forward(fw, x)
+    st = Stats(m)
+    st.images = x.shape[0]
+    for j, name in enumerate(LAYERS):
+        # sum (q / g - f)**2 = sum q**2 / g**2 - 2 sum q f / g + sum f**2, as dot products
+        f = ref[name].ravel()
+        q = layers[name].reshape(m, -1).astype(np.float64)
+        g = gains[:, j]
+        ff = f @ f
+        st.sq_err[:, j] = np.maximum(np.einsum("ij,ij->i", q, q) / g**2 - 2 * (q @ f) / g + ff, 0)
+        st.sq_ref[:, j] = ff
+        pre = layers[f"{name}_pre"]
+        st.wrap[:, j] = (pre > 255).reshape(m, -1).sum(axis=1)
+        st.sat[:, j] = (pre > ACC_MAX).reshape(m, -1).sum(axis=1)
+        st.values[:, j] = pre[0].size
+    out = layers["fc2"][:, :, 0] / gains[:, -1:]
+    st.agree[:] = ((out > threshold) == (ref["fc2"][:, 0] > threshold)).sum(axis=1)
+    if labels is not None:
+        st.correct[:] = ((out > threshold) == labels.astype(bool)).sum(axis=1)
+        st.labelled = x.shape[0]
+    return st
+
+
+@dataclass
+class Calibrator:
+    fw: Dict[str, np.ndarray]
+    chunks: List[Tuple[np.ndarray, Optional[np.ndarray]]]   # (images, labels) per chunk
+    threshold: float
+    per_octave: int = 4
+    jobs: Optional[int] = None
+    candidates: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.candidates = {l: candidate_shifts(self.fw[f"{l}_weight"], self.per_octave) for l in LAYERS}
+
+    def evaluate(self, pool: ProcessPoolExecutor, sets: List[Dict[str, float]]) -> Stats:
+        """Stats of the weight sets given as one shift per layer, over the whole calibration set."""
+        qs = [quantize(self.fw, s) for s in sets]
+        params = {p: np.stack([q[p] for q in qs]) for p in PARAMS}
+        gains = 2.0 ** np.cumsum([[s[l] for l in LAYERS] for s in sets], axis=1)
+        total = Stats(len(sets))
+        window = 2 * (self.jobs or os.cpu_count() or 1)  # chunks in flight
+        pending = deque()
+        for x, labels in self.chunks:
+            pending.append(pool.submit(eval_chunk, params, gains, self.fw, x, self.threshold, labels))
+            if len(pending) >= window:
+                total.merge(pending.popleft().result())
+        while pending:
+            total.merge(pending.popleft().result())
+        return total
+
+    def sweep(self, pool, chosen: Dict[str, float], layer: str) -> Tuple[List[Dict[str, float]], Stats]:
+        sets = [{**chosen, layer: float(s)} for s in self.candidates[layer]]
+        return sets, self.evaluate(pool, sets)
+
+    def run(self) -> Tuple[Dict[str, float], List[Dict]]:
+        """Chosen shift per layer and the report rows of every candidate."""
+        # until a layer is chosen, the layers after it keep their largest scale
+        chosen = {l: float(self.candidates[l][-1]) for l in LAYERS}
+        rows = []
+        with ProcessPoolExecutor(self.jobs, initializer=_init_worker) as pool:
+            for j, layer in enumerate(LAYERS):
+                sets, st = self.sweep(pool, chosen, layer)
+                chosen[layer] = float(self.candidates[layer][int(np.argmin(st.err()[:, j]))])
+            last = (sets, st)  # the last layer was swept with every other layer at its final choice
+            for j, layer in enumerate(LAYERS):
+                sets, st = last if layer == LAYERS[-1] else self.sweep(pool, chosen, layer)
+                err = st.err()
+                for k, s in enumerate(sets):
+                    row = {"layer": layer, "shift": s[layer], "chosen": s[layer] == chosen[layer],
+                           "err": float(err[k, j]), "wrap": float(st.wrap[k, j] / max(st.values[k, j], 1)),
+                           "sat": float(st.sat[k, j] / max(st.values[k, j], 1)), "fc2_err": float(err[k, -1]),
+                           "agree": float(st.agree[k] / max(st.images, 1))}
+                    if st.labelled:
+                        row["acc"] = float(st.correct[k] / st.labelled)
+                    rows.append(row)
+        return chosen, rows
+
+
+def write_weights(q: Dict[str, np.ndarray], out_dir: Path):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, (fname, _) in WEIGHT_FILES.items():
+        (out_dir / fname).write_text(encode_weights(q[name].ravel(), PER_LINE.get(name, 10)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pick per-layer int8 weight scales on a calibration set and write the weight files")
+    ap.add_argument("-f", "--float-weights", type=Path, required=True, help=".npz or torch state_dict")
+    ap.add_argument("-i", "--input", type=Path, nargs="+", required=True, help="calibration images, 60 lines per image")
+    ap.add_argument("--count", type=int, default=None)
+    ap.add_argument("--labels", type=Path, default=None, help="one 0/1 label per line, in image order")
+    ap.add_argument("--threshold", type=float, default=None, help="decision threshold on the float output (default: median)")
+    ap.add_argument("--per-octave", type=int, default=4, help="candidate scales per factor of 2")
+    ap.add_argument("--chunk", type=int, default=256)
+    ap.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    ap.add_argument("-o", "--output", type=Path, default=Path("calibrated"), help="directory for the *_weight.txt files")
+    ap.add_argument("--json", type=Path, default=None, help="report with every candidate")
+    args = ap.parse_args()
+
+    fw = load_float_weights(args.float_weights)
+    labels = np.loadtxt(args.labels, dtype=np.int64, ndmin=1) if args.labels else None
+    chunks = []
+    for start, _, x in iter_chunks(iter_images(args.input, 0, args.count), args.chunk):
+        chunks.append((x, None if labels is None else labels[start:start + x.shape[0]]))
+    if not chunks:
+        raise SystemExit("no calibration images")
+    if labels is not None and labels.size < sum(x.shape[0] for x, _ in chunks):
+        raise SystemExit(f"{args.labels}: {labels.size} labels for {sum(x.shape[0] for x, _ in chunks)} images")
+    threshold = args.threshold
+    if threshold is None:
+        threshold = float(np.median(np.concatenate([float_forward(fw, x)["fc2"][:, 0] for x, _ in chunks])))
+
+    cal = Calibrator(fw, chunks, threshold, args.per_octave, args.jobs)
+    chosen, rows = cal.run()
+
+    images = sum(x.shape[0] for x, _ in chunks)
+    print(f"{images} calibration images, threshold {threshold:g}")
+    acc = "acc" in rows[0]
+    print(f"  {'layer':6} {'shift':>6} {'err':>8} {'wrap':>7} {'sat':>7} {'fc2_err':>8} {'agree':>7}" + (f" {'acc':>7}" if acc else ""))
+    for r in rows:
+        print(f"{'*' if r['chosen'] else ' '} {r['layer']:6} {r['shift']:6.2f} {r['err']:8.4f} {r['wrap']:7.2%} "
+              f"{r['sat']:7.2%} {r['fc2_err']:8.4f} {r['agree']:7.2%}" + (f" {r['acc']:7.2%}" if acc else ""))
+    q = quantize(fw, chosen)
+    write_weights(q, args.output)
+    print("chosen: " + ", ".join(f"{l} 2**{chosen[l]:g}" for l in LAYERS))
+    print(f"Saved: {args.output}/{{{','.join(f for f, _ in WEIGHT_FILES.values())}}}")
+    if args.json:
+        args.json.write_text(json.dumps({"images": images, "threshold": threshold, "shifts": chosen,
+                                         "candidates": rows}, indent=1) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,138 @@
-if __name__ == "__main__":
-    with open("./res.hex", "r") as f:
-        golden = f.read().splitlines()
-    with open("../dcache.hex", "r") as f:
-        res = f.read().splitlines()
-
-    # check conv1 result
-    conv1_golden = golden[:455]
-    print(conv1_golden[0])
-    conv1_res = res[500:500+455]
-    print(conv1_res[0])
-    err_addr = -1
-    for i in range(455):
-        if (conv1_golden[i].upper() != conv1_res[i].upper()):
-            err_addr = i
-            break
-    if err_addr == -1:
-        print("conv1 result all right!")
-    else:
-        print(f"find error in addr range {err_addr*4} - {err_addr*4+3}")
-    
-    # check conv2 result
-    conv2_golden = golden[500:500+132]
-    print(conv2_golden[0])
-    conv2_res = res[1000:1000+132]
-    print(conv2_res[0])
-    err_addr = -1
-    for i in range(132):
-        if (conv2_golden[i].upper() != conv2_res[i].upper()):
-            err_addr = i
-            break
-    if err_addr == -1:
-        print("conv2 result all right!")
+"""
+Check d_cache dumps from simulation against golden res.hex images.
+
+Every byte of every region in the memory map is compared in one vectorized
+pass; 'xx' bytes in the golden image are don't-care, 'xx' in the dump where
+the golden has data is a mismatch. Each mismatching 32-bit word is reported
+with its layer and element coordinates (channel, row, col for conv layers).
+
+Usage:
+  python check.py                                   # res.hex vs ../dcache.hex
+  python check.py -g res.hex -d ../dcache.hex --map map.json
+  python check.py --golden-dir golden --dump-dir dumps --jobs 8
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from hex_codec import decode_hex32, encode_hex32
+from memory_map import DEFAULT_MAP, MemoryMap, load_map
+
+DATA_DIR = Path(__file__).resolve().parent
+
+Mismatch = namedtuple("Mismatch", "layer addr golden dump coords")
+
+
+@lru_cache(maxsize=None)
+def compile_map(mem_map: MemoryMap) -> Tuple[np.ndarray, ...]:
+    """Byte gather indices (golden, dump), region id and element index of every checked byte."""
+    g_idx, d_idx, reg, elem = [], [], [], []
+    for k, r in enumerate(mem_map.regions):
+        off = np.arange(r.nbytes)
+        g_idx.append(r.base - mem_map.golden_base + off)
+        d_idx.append(r.base + off)
+        reg.append(np.full(r.nbytes, k))
+        elem.append(off // r.elem_bytes)
+    return tuple(np.concatenate(a) for a in (g_idx, d_idx, reg, elem))
+
+
+def _gather(data: np.ndarray, valid: np.ndarray, idx: np.ndarray):
+    inside = (idx >= 0) & (idx < data.size)  # bytes outside a short image count as 'xx'
+    out = np.zeros(idx.size, dtype=np.uint8)
+    ok = np.zeros(idx.size, dtype=bool)
+    out[inside] = data[idx[inside]]
+    ok[inside] = valid[idx[inside]]
+    return out, ok
+
+
+def _word_hex(data, valid, byte_addr) -> str:
+    b, ok = _gather(data, valid, np.arange(byte_addr, byte_addr + 4))
+    return encode_hex32(b, valid=ok).strip()
+
+
+def compare(golden, dump, mem_map: MemoryMap = DEFAULT_MAP, compiled=None) -> List[Mismatch]:
+    """Mismatching words between golden and dump, each given as (bytes, valid mask)."""
+    g, gv = golden
+    d, dv = dump
+    g_idx, d_idx, reg, elem = compiled or compile_map(mem_map)
+    gb, gok = _gather(g, gv, g_idx)
+    db, dok = _gather(d, dv, d_idx)
+    bad = gok & (~dok | (gb != db))
+    if not bad.any():
+        return []
+
+    out = []
+    words = d_idx[bad] // 4
+    for w in np.unique(words):
+        sel = np.flatnonzero(bad)[words == w]
+        r = mem_map.regions[reg[sel[0]]]
+        coords = [tuple(int(c) for c in np.unravel_index(e, r.shape)) for e in np.unique(elem[sel])]
+        out.append(Mismatch(r.name, int(w) * 4,
+                            _word_hex(g, gv, int(w) * 4 - mem_map.golden_base),
+                            _word_hex(d, dv, int(w) * 4), coords))
+    return out
+
+
+def load_image(path) -> Tuple[np.ndarray, np.ndarray]:
+    with open(path, "r") as f:
+        return decode_hex32(f.read(), dont_care=True)
+
+
+def check_pair(paths: Tuple[Path, Path], mem_map: MemoryMap = DEFAULT_MAP) -> Tuple[str, List[Mismatch]]:
+    golden_path, dump_path = paths
+    return str(dump_path), compare(load_image(golden_path), load_image(dump_path), mem_map)
+
+
+def format_mismatch(m: Mismatch) -> str:
+    coords = " ".join(f"{m.layer}[{','.join(map(str, c))}]" for c in m.coords)
+    return f"{m.layer}: addr {m.addr} (line {m.addr // 4}) golden {m.golden} dump {m.dump} at {coords}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare d_cache dumps against golden res.hex images")
+    ap.add_argument("-g", "--golden", type=Path, default=DATA_DIR / "res.hex")
+    ap.add_argument("-d", "--dump", type=Path, default=DATA_DIR.parent / "dcache.hex")
+    ap.add_argument("--map", type=Path, default=None, help="memory map JSON (default: write_npu.S layout)")
+    ap.add_argument("--golden-dir", type=Path, default=None, help="check every file name present in both dirs")
+    ap.add_argument("--dump-dir", type=Path, default=None)
+    ap.add_argument("--jobs", type=int, default=None)
+    ap.add_argument("--max-report", type=int, default=20, help="mismatching words printed per dump")
+    args = ap.parse_args()
+    if (args.golden_dir is None) != (args.dump_dir is None):
+        ap.error("--golden-dir and --dump-dir go together")
+
+    mem_map = load_map(args.map)
+    if args.golden_dir is not None:
+        names = sorted(set(os.listdir(args.golden_dir)) & set(os.listdir(args.dump_dir)))
+        pairs = [(args.golden_dir / n, args.dump_dir / n) for n in names]
+        with ProcessPoolExecutor(args.jobs) as ex:
+            results = list(ex.map(partial(check_pair, mem_map=mem_map), pairs, chunksize=16))
     else:
-        print(f"find error in addr range {err_addr*4} - {err_addr*4+3}")
\ No newline at end of file
+        results = [check_pair((args.golden, args.dump), mem_map)]
+
+    failed = 0
+    for name, mism in results:
+        if not mism:
+            continue
+        failed += 1
+        layers = sorted({m.layer for m in mism})
+        print(f"{name}: {len(mism)} mismatching words in {', '.join(layers)}")
+        for m in mism[:args.max_report]:
+            print("  " + format_mismatch(m))
+    for r in mem_map.regions:
+        bad = sum(1 for _, mism in results if any(m.layer == r.name for m in mism))
+        print(f"{r.name}: {len(results) - bad}/{len(results)} right")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
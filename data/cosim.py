@@ -0,0 +1,543 @@
+"""
+Streaming RTL co-simulation of the npu (rtl_4pe/).
+
+The design is compiled once with rtl_4pe/npu_stream_tb.sv as the top and
+every simulator instance is started once; frames are then streamed into it
+through a named pipe as bus transactions and the reads it prints come back
+on its stdout. Each frame is the transaction sequence of the generated
+driver (gen_driver.py) for one image:
+
+  conv1   per channel the 3 kernel columns, per output row 2 preload
+          columns, then per output column one image column and a trigger;
+          a pack register read every 4 results
+  conv2   NEXT, then per input channel the same with conv1 columns and one
+          result read (the channel's signed partial sum) per position
+  fc1     NEXT, PE_CLEAR; 3 neurons per S_FCN pass (one input, 3 weights
+          and a trigger per write, a read and PE_CLEAR per pass); fcn_in = 0
+          and NEXT; the remaining neurons in S_FCN_LAST (2 inputs per write)
+  fc2     in S_FCN_LAST, a read, NEXT to S_DONE and a read of the done flag
+
+The transaction template (command, address, constant bits, which table
+entry supplies the data and which one the read must return) is built once
+from the weights; for each chunk of images the batched golden model fills
+the per-image data and expected-read tables and the stream text of the
+whole chunk is formatted with numpy. Frames go to the instance with the
+fewest in flight; a reader thread per instance compares each frame's reads
+as soon as its end marker arrives, so checking runs while the simulators
+keep working.
+
+--sim emu runs npu_emu.py --stream in place of a simulator (same pipe
+protocol, no RTL), which checks the harness and the template itself.
+
+Usage:
+  python cosim.py -i input_all.hex --count 1000 --jobs 8
+  python cosim.py -i vectors.hex --sim verilator --jobs 16 --fail-log fails.jsonl
+  python cosim.py -i input_32bit.hex --sim emu
+"""
+
+from __future__ import annotations
+import argparse
+import errno
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import quant_np as Q
+from backend import BACKENDS, get_backend
+from batch_run import IMG_SHAPE, iter_chunks, iter_images
+from npu_emu import (CTRL_NEXT, CTRL_PACK_CLEAR, CTRL_PE_CLEAR, CTRL_TRIGGER, M32, SEL_CONV_W, SEL_CTRL, SEL_DONE,
+                     SEL_FCN_IN, SEL_IMG, SEL_RESULT)
+from weights_io import DATA_DIR
+
+RTL_DIR = Path(DATA_DIR).parent / "rtl_4pe"
+SOURCES = ("_package.sv", "_circular_reg.sv", "_conv_unit.sv", "_pe_unit_fcn.v", "_npu.sv", "npu_stream_tb.sv")
+TOP = "npu_stream_tb"
+SIMS = ("icarus", "verilator", "emu")
+KERNEL = 3
+LANES, LANES_LAST = 3, 2     # fc neurons per S_FCN write, inputs per S_FCN_LAST write
+PACK_BYTES = 4
+TAGS = ("conv1", "conv2", "fc1", "fc2", "done")
+LINE = 16                    # "C AAAA DDDDDDDD\n"
+_HEX = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def _port(sel: int) -> int:
+    return sel << 12
+
+
+class Schedule:
+    """Per-frame transaction template: data = const | V[src] (src -1: const only), reads must return E[exp]."""
+
+    def __init__(self, model: Q.QuantizedCNN, img_hw: Tuple[int, int] = IMG_SHAPE[1:]):
+        w1, w2 = np.asarray(model.q_conv1_w), np.asarray(model.q_conv2_w)
+        fc1, fc2 = np.asarray(model.q_fc1_w), np.asarray(model.q_fc2_w)
+        for name in ("q_conv1_b", "q_conv2_b", "q_fc1_b", "q_fc2_b"):
+            if np.any(np.asarray(getattr(model, name))):
+                raise ValueError(f"{name[2:]} is not zero; the npu has no bias path")
+        if w1.shape[1:] != (1, KERNEL, KERNEL) or w2.shape[2:] != (KERNEL, KERNEL) or w2.shape[:2] != (1, w1.shape[0]):
+            raise ValueError("the npu runs 3x3 conv1 kernels and a 3x3 conv2 over all conv1 channels")
+        self.c1 = w1.shape[0]
+        self.h, self.w = img_hw
+        self.h1, self.w1 = self.h - KERNEL + 1, self.w - KERNEL + 1
+        self.h2, self.w2 = self.h1 - KERNEL + 1, self.w1 - KERNEL + 1
+        self.n_fc1, self.n_in = fc1.shape
+        self.n_fc2 = fc2.shape[0]
+        self.passes = self.n_fc1 // LANES
+        if self.n_in != self.h2 * self.w2 or fc2.shape[1] != self.n_fc1:
+            raise ValueError("fc weights do not chain with the conv layers")
+        if (self.c1 * self.h1 * self.w1) % PACK_BYTES:
+            raise ValueError(f"{self.c1 * self.h1 * self.w1} conv1 results are not whole pack reads")
+
+        # per-image data table V: image columns | conv1 columns | fc1 inputs | fc1.last pairs | fc2 pairs
+        self.v_img = 0
+        self.v_c1 = self.v_img + self.h1 * self.w
+        self.v_fc1 = self.v_c1 + self.c1 * self.h2 * self.w1
+        self.v_fc1_last = self.v_fc1 + self.n_in
+        self.v_fc2 = self.v_fc1_last + -(-self.n_in // LANES_LAST)
+        self.nv = self.v_fc2 + -(-self.n_fc1 // LANES_LAST)
+        # expected reads E: pack words | conv2 partials | fc1 pass words | fc1.last | fc2 | done
+        self.e_pack = 0
+        self.e_c2 = self.e_pack + self.c1 * self.h1 * self.w1 // PACK_BYTES
+        self.e_fc1 = self.e_c2 + self.c1 * self.h2 * self.w2
+        self.e_fc1_last = self.e_fc1 + self.passes
+        self.e_fc2 = self.e_fc1_last + self.n_fc1 - self.passes * LANES
+        self.e_done = self.e_fc2 + self.n_fc2
+        self.ne = self.e_done + 1
+
+        self._cmd: List[int] = []
+        self._addr: List[int] = []
+        self._const: List[int] = []
+        self._src: List[int] = []
+        self._exp: List[int] = []
+        self._tag: List[int] = []
+        self.k2 = w2[0].astype(np.int64)
+        self._build(w1, w2, fc1, fc2)
+        self.cmd = np.array(self._cmd, dtype=np.uint8)
+        self.addr = np.array(self._addr, dtype=np.uint32)
+        self.const = np.array(self._const, dtype=np.uint32)
+        self.src = np.array(self._src, dtype=np.int64)
+        self.exp = np.array(self._exp, dtype=np.int64)
+        self.tag = np.array(self._tag, dtype=np.int64)
+        self.reads = np.flatnonzero(self.cmd == ord("R"))
+        self.text = self._text_template()
+
+    def __len__(self) -> int:
+        return len(self._cmd)
+
+    # template
+    def _write(self, sel: int, const: int = 0, src: int = -1):
+        self._cmd.append(ord("W"))
+        self._addr.append(_port(sel))
+        self._const.append(const & M32)
+        self._src.append(src)
+
+    def _read(self, sel: int, exp: int, tag: str):
+        self._cmd.append(ord("R"))
+        self._addr.append(_port(sel))
+        self._const.append(0)
+        self._src.append(-1)
+        self._exp.append(exp)
+        self._tag.append(TAGS.index(tag))
+
+    def _kernel(self, k: np.ndarray):
+        for c in range(KERNEL):  # column c, row i in byte i
+            self._write(SEL_CONV_W, sum((int(k[i, c]) & 0xFF) << (8 * i) for i in range(KERNEL)))
+
+    def _fc_last(self, w: np.ndarray, v_base: int, exp: int, tag: str):
+        pad = np.zeros(-(-w.size // LANES_LAST) * LANES_LAST, dtype=np.int64)
+        pad[:w.size] = w
+        for p in range(pad.size // LANES_LAST):
+            self._write(SEL_FCN_IN, (int(pad[2 * p]) & 0xFF) | (int(pad[2 * p + 1]) & 0xFF) << 8, v_base + p)
+            self._write(SEL_CTRL, CTRL_TRIGGER)
+        self._read(SEL_RESULT, exp, tag)
+
+    def _build(self, w1, w2, fc1, fc2):
+        self._write(SEL_CTRL, CTRL_PACK_CLEAR)
+        n = 0
+        for c in range(self.c1):
+            self._kernel(w1[c, 0])
+            for r in range(self.h1):
+                for j in range(self.w):
+                    self._write(SEL_IMG, 0, self.v_img + r * self.w + j)
+                    if j >= KERNEL - 1:
+                        self._write(SEL_CTRL, CTRL_TRIGGER)
+                        n += 1
+                        if n % PACK_BYTES == 0:
+                            self._read(SEL_RESULT, self.e_pack + n // PACK_BYTES - 1, "conv1")
+        self._write(SEL_CTRL, CTRL_NEXT)
+        for c in range(self.c1):
+            self._kernel(w2[0, c])
+            for i in range(self.h2):
+                for j in range(self.w1):
+                    self._write(SEL_IMG, 0, self.v_c1 + (c * self.h2 + i) * self.w1 + j)
+                    if j >= KERNEL - 1:
+                        self._write(SEL_CTRL, CTRL_TRIGGER)
+                        self._read(SEL_RESULT, self.e_c2 + (c * self.h2 + i) * self.w2 + j - KERNEL + 1, "conv2")
+        self._write(SEL_CTRL, CTRL_NEXT)
+        self._write(SEL_CTRL, CTRL_PE_CLEAR)
+        for p in range(self.passes):
+            ws = fc1[LANES * p:LANES * (p + 1)]
+            for i in range(self.n_in):
+                self._write(SEL_FCN_IN, sum((int(ws[l, i]) & 0xFF) << (8 * l) for l in range(LANES)), self.v_fc1 + i)
+                self._write(SEL_CTRL, CTRL_TRIGGER)
+            self._read(SEL_RESULT, self.e_fc1 + p, "fc1")
+            self._write(SEL_CTRL, CTRL_PE_CLEAR)
+        self._write(SEL_FCN_IN, 0)  # PE2 keeps its last S_FCN operands in S_FCN_LAST
+        self._write(SEL_CTRL, CTRL_NEXT)
+        for k in range(self.passes * LANES, self.n_fc1):
+            self._fc_last(fc1[k], self.v_fc1_last, self.e_fc1_last + k - self.passes * LANES, "fc1")
+            self._write(SEL_CTRL, CTRL_PE_CLEAR)
+        for k in range(self.n_fc2):
+            self._fc_last(fc2[k], self.v_fc2, self.e_fc2 + k, "fc2")
+            if k + 1 < self.n_fc2:
+                self._write(SEL_CTRL, CTRL_PE_CLEAR)
+        self._write(SEL_CTRL, CTRL_NEXT)
+        self._read(SEL_DONE, self.e_done, "done")
+
+    def _text_template(self) -> np.ndarray:
+        """(len, LINE) bytes of every line, data digits zero."""
+        t = np.full((len(self), LINE), ord("0"), dtype=np.uint8)
+        t[:, 0] = self.cmd
+        t[:, 1] = t[:, 6] = ord(" ")
+        t[:, 15] = ord("\n")
+        t[:, 2:6] = _HEX[(self.addr[:, None] >> np.arange(12, -1, -4, dtype=np.uint32)) & 0xF]
+        return t
+
+    # per-chunk tables
+    @staticmethod
+    def _columns(x: np.ndarray, rows: int) -> np.ndarray:
+        """(..., H, W) bytes -> (..., rows, W) words of KERNEL vertically adjacent bytes, row i in byte i."""
+        x = x.astype(np.uint32)
+        return sum(x[..., i:i + rows, :] << (8 * i) for i in range(KERNEL))
+
+    @staticmethod
+    def _pairs(x: np.ndarray) -> np.ndarray:
+        """(N, K) inputs -> (N, ceil(K/2)) S_FCN_LAST data bits x0 << 16 | x1 << 24."""
+        x = x.astype(np.uint32)
+        if x.shape[1] % 2:
+            x = np.pad(x, ((0, 0), (0, 1)))
+        return x[:, 0::2] << 16 | x[:, 1::2] << 24
+
+    def values(self, x: np.ndarray, layers: Dict[str, np.ndarray]) -> np.ndarray:
+        n = x.shape[0]
+        conv1, conv2, fc1 = layers["conv1"], layers["conv2"].reshape(n, -1), layers["fc1"]
+        return np.concatenate([self._columns(x[:, 0], self.h1).reshape(n, -1),
+                               self._columns(conv1, self.h2).reshape(n, -1),
+                               conv2.astype(np.uint32) << 24,
+                               self._pairs(conv2),
+                               self._pairs(fc1)], axis=1)
+
+    def expected(self, layers: Dict[str, np.ndarray]) -> np.ndarray:
+        conv1, fc1, fc2 = layers["conv1"], layers["fc1"].astype(np.uint32), layers["fc2"].astype(np.uint32)
+        n = conv1.shape[0]
+        pack = np.ascontiguousarray(conv1, dtype=np.uint8).reshape(n, -1).view("<u4")
+        win = sliding_window_view(conv1, (KERNEL, KERNEL), axis=(2, 3))
+        partial = np.einsum("ncijab,cab->ncij", win.astype(np.int64), self.k2)
+        passes = sum(fc1[:, l:LANES * self.passes:LANES] << (8 * l) for l in range(LANES))
+        return np.concatenate([pack.astype(np.uint32), (partial.reshape(n, -1) & M32).astype(np.uint32), passes,
+                               fc1[:, LANES * self.passes:], fc2, np.ones((n, 1), dtype=np.uint32)], axis=1)
+
+    def frame_data(self, v: np.ndarray) -> np.ndarray:
+        """(N, len) data word of every transaction."""
+        d = np.broadcast_to(self.const, (v.shape[0], len(self))).copy()
+        has = self.src >= 0
+        d[:, has] |= v[:, self.src[has]]
+        return d
+
+    def stream(self, data: np.ndarray, first: int) -> List[bytes]:
+        """Stream text of each frame: F line, transactions, E line; frames numbered from first."""
+        n = data.shape[0]
+        t = np.empty((n, len(self) + 2, LINE), dtype=np.uint8)
+        t[:, 1:-1] = self.text
+        t[:, 0] = t[:, -1] = self.text[0]
+        t[:, 0, 0], t[:, -1, 0] = ord("F"), ord("E")
+        t[:, [0, -1], 2:6] = ord("0")
+        ids = (first + np.arange(n, dtype=np.uint64)).astype(np.uint32)
+        words = np.concatenate([ids[:, None], data, ids[:, None]], axis=1)
+        t[:, :, 7:15] = _HEX[(words[..., None] >> np.arange(28, -1, -4, dtype=np.uint32)) & 0xF]
+        return [t[i].tobytes() for i in range(n)]
+
+
+@dataclass
+class Frame:
+    index: int
+    source: str
+    frame: int
+    expected: np.ndarray
+
+
+@dataclass
+class FrameResult:
+    index: int
+    source: str
+    frame: int
+    instance: int
+    cycles: int
+    bad: np.ndarray                                   # mismatching reads per TAGS entry
+    first: Optional[Tuple[int, str, int, int]]        # (read, tag, got, expected) of the first mismatch
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return not self.error and not self.bad.any()
+
+
+class SimInstance:
+    """One running simulator: a writer thread feeds its pipe, a reader thread checks its output frame by frame."""
+
+    def __init__(self, n: int, argv: List[str], fifo: Path, schedule: Schedule, results: "queue.Queue[FrameResult]",
+                 log: Optional[Path] = None):
+        self.n = n
+        self.schedule = schedule
+        self.results = results
+        self.pending: Deque[Frame] = deque()
+        self.todo: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self.alive = True
+        self.log = open(log, "w") if log else None
+        os.mkfifo(fifo)
+        self.proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        self.fd = self._open(fifo)
+        self.todo.put(b"X 0000 00000000\n")
+        self.writer = threading.Thread(target=self._write, daemon=True)
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.writer.start()
+        self.reader.start()
+
+    def _open(self, fifo: Path) -> int:
+        """Open the pipe for writing once the simulator has opened it for reading."""
+        while True:
+            try:
+                fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if self.proc.poll() is not None:
+                    out = self.proc.stdout.read() if self.proc.stdout else ""
+                    raise RuntimeError(f"simulator {self.n} exited with {self.proc.returncode} before opening "
+                                       f"the stream:\n{out}")
+                time.sleep(0.01)
+                continue
+            os.set_blocking(fd, True)
+            return fd
+
+    def send(self, frame: Frame, text: bytes):
+        self.pending.append(frame)
+        self.todo.put(text)
+
+    def close(self):
+        self.todo.put(b"Q 0000 00000000\n")
+        self.todo.put(None)
+
+    def _write(self):
+        try:
+            while True:
+                text = self.todo.get()
+                if text is None:
+                    break
+                view = memoryview(text)
+                while view:
+                    view = view[os.write(self.fd, view):]
+        except OSError:
+            pass  # the simulator went away; the reader reports its frames
+        finally:
+            os.close(self.fd)
+
+    def _read(self):
+        got: List[int] = []
+        for line in self.proc.stdout:
+            if self.log:
+                self.log.write(line)
+            if line.startswith("R "):
+                try:
+                    got.append(int(line[2:10], 16))
+                except ValueError:
+                    got.append(-1)     # x/z bits
+            elif line.startswith("E "):
+                fid, cycles = (int(v) for v in line.split()[1:3])
+                fr = self.pending.popleft()
+                self.results.put(self._check(fr, got, cycles, fid))
+                got = []
+        self.alive = False
+        self.proc.wait()
+        while self.pending:
+            fr = self.pending.popleft()
+            self.results.put(FrameResult(fr.index, fr.source, fr.frame, self.n, -1, np.zeros(len(TAGS), dtype=np.int64),
+                                         None, f"simulator exited with {self.proc.returncode}"))
+        if self.log:
+            self.log.close()
+
+    def _check(self, fr: Frame, got: List[int], cycles: int, fid: int) -> FrameResult:
+        s = self.schedule
+        bad = np.zeros(len(TAGS), dtype=np.int64)
+        error = ""
+        if fid != fr.index & M32:
+            error = f"frame {fid} came back, expected {fr.index}"
+        if len(got) != s.reads.size:
+            error = error or f"{len(got)} reads, expected {s.reads.size}"
+            return FrameResult(fr.index, fr.source, fr.frame, self.n, cycles, bad, None, error)
+        g = np.array(got, dtype=np.int64)
+        e = fr.expected[s.exp].astype(np.int64)
+        miss = np.flatnonzero(g != e)
+        first = None
+        if miss.size:
+            bad = np.bincount(s.tag[miss], minlength=len(TAGS))
+            k = int(miss[0])
+            first = (k, TAGS[int(s.tag[k])], int(g[k]), int(e[k]))
+        return FrameResult(fr.index, fr.source, fr.frame, self.n, cycles, bad, first, error)
+
+
+def build(sim: str, build_dir: Path, force: bool = False) -> List[str]:
+    """Compile the design once (again only when a source is newer); returns the command to start it."""
+    build_dir.mkdir(parents=True, exist_ok=True)  # also holds the --sim-log files
+    if sim == "emu":
+        return [sys.executable, str(Path(DATA_DIR) / "npu_emu.py")]
+    srcs = [RTL_DIR / s for s in SOURCES]
+    newest = max(p.stat().st_mtime for p in srcs)
+    if sim == "icarus":
+        exe = build_dir / "npu_stream.vvp"
+        cmd = ["iverilog", "-g2012", "-s", TOP, "-o", str(exe)] + [str(p) for p in srcs]
+        run = ["vvp", "-n", str(exe)]
+    else:
+        exe = build_dir / "obj_dir" / "npu_stream"
+        cmd = ["verilator", "--binary", "--timing", "-Wno-fatal", "-j", "0", "--top-module", TOP,
+               "--Mdir", str(build_dir / "obj_dir"), "-o", "npu_stream"] + [str(p) for p in srcs]
+        run = [str(exe)]
+    if force or not exe.exists() or exe.stat().st_mtime < newest:
+        t0 = time.time()
+        subprocess.run(cmd, check=True)
+        print(f"Compiled {TOP} with {sim} in {time.time() - t0:.1f} s: {exe}")
+    return run
+
+
+def sim_argv(sim: str, run: List[str], fifo: Path, idle: int) -> List[str]:
+    if sim == "emu":
+        return run + ["--stream", str(fifo), "--idle", str(idle)]
+    return run + [f"+stream={fifo}", f"+idle={idle}"]
+
+
+def default_sim() -> str:
+    for sim, exe in (("verilator", "verilator"), ("icarus", "iverilog")):
+        if shutil.which(exe):
+            return sim
+    return "emu"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Stream images through running npu simulators and check every read")
+    ap.add_argument("-i", "--input", type=Path, nargs="+", default=[Path(DATA_DIR) / "input_32bit.hex"],
+                    help="32-bit/line hex files, 60 lines per image")
+    ap.add_argument("--skip", type=int, default=0)
+    ap.add_argument("--count", type=int, default=None)
+    ap.add_argument("--chunk", type=int, default=256, help="images per golden-model batch")
+    ap.add_argument("--sim", choices=SIMS, default=None, help="default: verilator, else icarus, else emu")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="simulator instances")
+    ap.add_argument("--in-flight", type=int, default=4, help="frames queued per instance")
+    ap.add_argument("--idle", type=int, default=2, help="idle cycles after every transaction")
+    ap.add_argument("--build", type=Path, default=Path(DATA_DIR).parent / "build" / "cosim")
+    ap.add_argument("--rebuild", action="store_true")
+    ap.add_argument("--timeout", type=float, default=600.0, help="seconds without any finished frame before giving up")
+    ap.add_argument("--fail-log", type=Path, default=None, help="one JSON line per failing frame")
+    ap.add_argument("--sim-log", action="store_true", help="keep each instance's output in the build dir")
+    ap.add_argument("--weight-dir", default=None)
+    ap.add_argument("--backend", choices=sorted(BACKENDS), default=None)
+    args = ap.parse_args()
+
+    sim = args.sim or default_sim()
+    B = get_backend(args.backend)
+    model = B.load_model(args.weight_dir)
+    schedule = Schedule(Q.load_model(args.weight_dir))
+    print(f"{sim}: {len(schedule)} transactions, {schedule.reads.size} checked reads per frame, {args.jobs} instances")
+    run = build(sim, args.build, args.rebuild)
+
+    tmp = Path(tempfile.mkdtemp(prefix="cosim_"))
+    results: "queue.Queue[FrameResult]" = queue.Queue()
+    insts: List[SimInstance] = []
+    fail_log = None
+    sent = done = failed = cycles = 0
+    bad = np.zeros(len(TAGS), dtype=np.int64)
+    t0 = time.time()
+
+    def collect(block: bool) -> bool:
+        nonlocal done, failed, cycles, bad
+        try:
+            r = results.get(timeout=args.timeout) if block else results.get_nowait()
+        except queue.Empty:
+            if block:
+                raise SystemExit(f"no frame finished in {args.timeout:.0f} s, giving up")
+            return False
+        done += 1
+        cycles += max(r.cycles, 0)
+        bad += r.bad
+        if not r.ok:
+            failed += 1
+            why = r.error or f"{r.first[1]} read {r.first[0]}: got {r.first[2]:08x}, expected {r.first[3]:08x}"
+            print(f"FAIL {r.source}:{r.frame} (sim {r.instance}): {why}")
+            if fail_log:
+                fail_log.write(json.dumps({"index": r.index, "source": r.source, "frame": r.frame, "error": r.error,
+                                           "mismatches": dict(zip(TAGS, r.bad.tolist())), "first": r.first}) + "\n")
+        return True
+
+    try:
+        for k in range(args.jobs):
+            fifo = tmp / f"npu{k}.fifo"
+            insts.append(SimInstance(k, sim_argv(sim, run, fifo, args.idle), fifo, schedule, results,
+                                     args.build / f"sim{k}.log" if args.sim_log else None))
+        fail_log = open(args.fail_log, "w") if args.fail_log else None
+        for start, sources, x in iter_chunks(iter_images(args.input, args.skip, args.count), args.chunk):
+            layers = {k: B.to_numpy(v) for k, v in model.forward_layers(B.from_numpy(x)).items()}
+            exp = schedule.expected(layers)
+            texts = schedule.stream(schedule.frame_data(schedule.values(x, layers)), start)
+            for i, text in enumerate(texts):
+                while True:
+                    live = [s for s in insts if s.alive]
+                    if not live:
+                        raise SystemExit("every simulator instance has exited")
+                    inst = min(live, key=lambda s: len(s.pending))
+                    if len(inst.pending) < args.in_flight:
+                        break
+                    collect(True)
+                inst.send(Frame(start + i, *sources[i], exp[i]), text)
+                sent += 1
+            while collect(False):
+                pass
+        for inst in insts:
+            inst.close()
+        while done < sent:
+            collect(True)
+    finally:
+        for inst in insts:
+            if inst.proc.poll() is None:
+                inst.close()
+        for inst in insts:
+            try:
+                inst.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                inst.proc.kill()
+        shutil.rmtree(tmp, ignore_errors=True)
+        if fail_log:
+            fail_log.close()
+
+    dt = time.time() - t0
+    print(f"Frames: {done}, failed: {failed}")
+    print("Mismatching reads: " + ", ".join(f"{t} {int(n)}" for t, n in zip(TAGS, bad)))
+    print(f"Simulated: {cycles} cycles ({cycles / max(done, 1):.0f} per frame)")
+    print(f"Time: {dt:.1f} s, {done / dt * 60:.0f} frames/min" if dt > 0 else "Time: 0 s")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
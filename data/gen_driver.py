@@ -0,0 +1,510 @@
+"""
+Host driver generator: emits the RISC-V program that runs one inference on
+the npu (what write_npu.S does by hand) from the layer description in a
+memory map (weights_map.json from weight_placement.py) and the npu register
+map (npu_emu.SEL_* / CTRL_*). Channel counts, image and feature map sizes
+and every loop bound come from the shapes in the map, the d_cache addresses
+from its bases.
+
+Compared with write_npu.S the program makes fewer bus transactions:
+  - the 3-pixel image columns conv1 sends are gathered once with byte loads
+    into a scratch table and read back with one aligned lw per position for
+    every channel, instead of three misaligned loads per channel;
+  - conv weights are read as three aligned words per kernel, fc weights as
+    one aligned word per four inputs (S_FCN) or two writes (S_FCN_LAST),
+    then shifted into place, so no weight load is misaligned;
+  - the conv1 pack register is read every fourth result, straight across
+    rows and channels (the conv1 results are contiguous), so there are no
+    pack clears and no partial reads per row;
+  - no image/weight register clears (the preload shifts every column out)
+    and the k-1 preloads per row are unrolled;
+  - conv2 and fc inputs are fetched with lbu, one aligned transaction per
+    byte.
+The npu ports and the trigger word stay in registers. Every load/store is
+counted with its execution count while it is emitted, so the generator
+reports the bus transactions per inference of the program it wrote; --check
+runs the program in npu_emu.py, compares the d_cache with the golden model
+and the counts with the emulated ones and with write_npu.S.
+
+Usage:
+  python gen_driver.py                                    # ../write_npu_gen.S from weights_map.json, with counts
+  python gen_driver.py --check -i input_all.hex --count 4
+  python gen_driver.py --map build/map.json -o build/npu.S
+"""
+
+from __future__ import annotations
+import argparse
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from memory_map import MemoryMap, Region, load_map
+from npu_emu import (CTRL_NEXT, CTRL_PACK_CLEAR, CTRL_PE_CLEAR, DCACHE_BASE, LAYER_LABELS, NPU_BASE, SEL_CONV_W,
+                     SEL_CTRL, SEL_FCN_IN, SEL_IMG, SEL_RESULT)
+from sram_image import SramImage
+from weight_placement import SPILL
+from weights_io import DATA_DIR
+
+IMAGE_BASE = 0
+KERNEL = 3                  # cir_reg is 3x3 in rtl_4pe/_npu.sv
+PACK_BYTES = 4              # conv1 results per pack register read
+NPU_REGS = {"s0": SEL_IMG, "s1": SEL_CONV_W, "s6": SEL_FCN_IN, "s7": SEL_CTRL, "s8": SEL_RESULT}
+TRIGGER = "s9"              # holds 1, the trigger control word
+MEM_OPS = ("lw", "sw", "lbu")
+
+
+class Emitter:
+    """Assembly text plus the bus transactions each layer's code makes per inference."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.reps = 1
+        self.layer = "conv1"
+        self.counts: Dict[str, Counter] = {name: Counter() for name in LAYER_LABELS}
+
+    def __call__(self, op: str, *args, comment: str = "", reps: Optional[int] = None, split: int = 0):
+        text = f"    {op:5} {', '.join(str(a) for a in args)}"
+        self.lines.append(f"{text:34}# {comment}" if comment else text)
+        if op in MEM_OPS:
+            base = args[1].split("(")[1].rstrip(")")
+            kind = "npu" if base in NPU_REGS else "dcache"
+            self.counts[self.layer][f"{kind}_{op}"] += self.reps if reps is None else reps
+            self.counts[self.layer]["dcache_split"] += split  # misaligned words take a second transaction
+
+    def label(self, name: str):
+        self.lines.append(f"{name}:")
+
+    def blank(self):
+        self.lines.append("")
+
+    @contextmanager
+    def loop(self, n: int):
+        self.reps *= n
+        try:
+            yield
+        finally:
+            self.reps //= n
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def _weight_block(m: MemoryMap, name: str) -> Optional[Region]:
+    return next((r for r in m.weights if r.name == name), None)
+
+
+def _aligned(r: Region, what: str):
+    if r.base % 4:
+        raise ValueError(f"{what} at byte {r.base} is not word aligned")
+
+
+def _ctrl(e: Emitter, bits: int, comment: str):
+    e("li", "t6", bits)
+    e("sw", "t6", "0(s7)", comment=comment)
+
+
+def _load_kernel(e: Emitter, wptr: str):
+    """Send the 3 columns of the 3x3 kernel at byte address wptr (any alignment), with three aligned loads."""
+    e("andi", "t5", wptr, -4, comment="word holding the first weight")
+    e("andi", "t3", wptr, 3)
+    e("slli", "t3", "t3", 3, comment="sh = 8 * misalignment")
+    e("xori", "t1", "t3", 31, comment="31 - sh")
+    e("lw", "t2", "0(t5)")
+    e("lw", "t4", "4(t5)")
+    e("lw", "t6", "8(t5)")
+    for lo, hi in (("t2", "t4"), ("t4", "t6")):  # funnel shift: lo = lo >> sh | hi << (32 - sh)
+        e("srl", lo, lo, "t3")
+        e("sll", "a5", hi, 1)
+        e("sll", "a5", "a5", "t1")
+        e("add", lo, lo, "a5")
+    e("srl", "t6", "t6", "t3", comment="kernel bytes 0-3 | 4-7 | 8 in t2 | t4 | t6")
+    e("sw", "t2", "0(s1)", comment="column 0")
+    e("srl", "t2", "t2", 24)
+    e("sll", "a5", "t4", 8)
+    e("add", "t2", "t2", "a5")
+    e("sw", "t2", "0(s1)", comment="column 1")
+    e("srl", "t4", "t4", 16)
+    e("sll", "a5", "t6", 16)
+    e("add", "t4", "t4", "a5")
+    e("sw", "t4", "0(s1)", comment="column 2")
+    e("addi", wptr, wptr, KERNEL * KERNEL)
+
+
+def _gather_column(e: Emitter, ptr: str, off: int, stride: int, dst: str = "t2"):
+    """dst = the 3 bytes at ptr + off + i * stride, row i in byte i."""
+    e("lbu", dst, f"{off}({ptr})")
+    for i in range(1, KERNEL):
+        e("lbu", "t6", f"{off + i * stride}({ptr})")
+        e("sll", "t6", "t6", 8 * i)
+        e("add", dst, dst, "t6")
+
+
+def _extract(e: Emitter, words: List[str], m: int, lanes: int, dst: str = "t6"):
+    """dst = bytes [m * lanes, (m + 1) * lanes) of the little-endian words, zero extended."""
+    q, b = divmod(m * lanes, 4)
+    w = words[q]
+    if b + lanes < 4:
+        e("sll", dst, w, 8 * (4 - b - lanes))
+        e("srl", dst, dst, 8 * (4 - lanes))
+        return
+    if b:
+        e("srl", dst, w, 8 * b)
+    else:
+        e("addi", dst, w, 0)
+    if b + lanes > 4:
+        e("sll", "a5", words[q + 1], 8 * (8 - b - lanes))
+        e("srl", "a5", "a5", 8 * (4 - lanes))
+        e("add", dst, dst, "a5")
+
+
+def _fc_input(e: Emitter, src: Region, ptr: str, i: int, byte: int, dst: str):
+    """dst = input i of an fc layer (low byte of element i of src) placed in byte `byte`."""
+    if src.elem_bytes == 1:
+        e("lbu", dst, f"{i}({ptr})")
+        if byte:
+            e("sll", dst, dst, 8 * byte)
+    else:
+        e("lw", dst, f"{i * src.elem_bytes}({ptr})")
+        e("sll", dst, dst, 24)
+        if byte != 3:
+            e("srl", dst, dst, 8 * (3 - byte))
+
+
+def _fc_last(e: Emitter, name: str, block: Region, src: Region, out: Region, out_ptr: str, out_base: int,
+             clear_after: bool):
+    """S_FCN_LAST neurons (results stored from byte out_base on): two inputs and two weights per write,
+    one weight word per two writes."""
+    _aligned(block, f"{name}.last")
+    neurons, padded = block.shape
+    writes = padded // 2
+    if neurons > 1 and padded % 4:
+        raise ValueError(f"{name}.last rows of {padded} bytes are not word aligned")
+    e("li", "a4", DCACHE_BASE + block.base, comment=f"{name}.last weights")
+    e("li", "s4", neurons)
+    e.label(f"{name}_last_loop")
+    with e.loop(neurons):
+        e("li", "a0", DCACHE_BASE + src.base, comment=f"{name} inputs")
+        if writes >= 2:
+            e("li", "t0", writes // 2)
+            e.label(f"{name}_last_input_loop")
+            with e.loop(writes // 2):
+                e("lw", "t1", "0(a4)", comment="weights of two writes")
+                for h in range(2):
+                    _fc_input(e, src, "a0", 2 * h, 2, "t2")
+                    _fc_input(e, src, "a0", 2 * h + 1, 3, "t3")
+                    e("add", "t2", "t2", "t3")
+                    _extract(e, ["t1"], h, 2)
+                    e("add", "t2", "t2", "t6")
+                    e("sw", "t2", "0(s6)", comment="fcn_in = x1 | x0 | w1 | w0")
+                    e("sw", TRIGGER, "0(s7)", comment="trigger")
+                e("addi", "a4", "a4", 4)
+                e("addi", "a0", "a0", 4 * src.elem_bytes)
+                e("addi", "t0", "t0", -1)
+                e("bnez", "t0", f"{name}_last_input_loop")
+        if writes % 2:
+            e("lw", "t1", "0(a4)", comment="last write")
+            _fc_input(e, src, "a0", 0, 2, "t2")
+            _fc_input(e, src, "a0", 1, 3, "t3")
+            e("add", "t2", "t2", "t3")
+            _extract(e, ["t1"], 0, 2)
+            e("add", "t2", "t2", "t6")
+            e("sw", "t2", "0(s6)")
+            e("sw", TRIGGER, "0(s7)", comment="trigger")
+            e("addi", "a4", "a4", 2)
+        e("lw", "t6", "0(s8)", comment="relu(pe0 + pe1 + pe2)")
+        e("sw", "t6", f"0({out_ptr})", split=sum((out_base + j * out.elem_bytes) % 4 != 0 for j in range(neurons)))
+        e("addi", out_ptr, out_ptr, out.elem_bytes)
+        if clear_after or neurons > 1:
+            _ctrl(e, CTRL_PE_CLEAR, "clear pe")
+        e("addi", "s4", "s4", -1)
+        e("bnez", "s4", f"{name}_last_loop")
+
+
+def generate(m: MemoryMap, size: Optional[int] = None) -> Emitter:
+    """The host program for the network and d_cache layout described by m."""
+    conv1, conv2, fc1, fc2 = (m.region(n) for n in ("conv1", "conv2", "fc1", "fc2"))
+    w1, w2 = _weight_block(m, "conv1"), _weight_block(m, "conv2")
+    fc1_full, fc1_last = _weight_block(m, "fc1.full"), _weight_block(m, "fc1.last")
+    fc2_last = _weight_block(m, "fc2.last")
+    if w1 is None or w2 is None or fc2_last is None:
+        raise ValueError("the map has no weight blocks; write it with weight_placement.py")
+    if _weight_block(m, "fc2.full") is not None:
+        raise ValueError("fc2 must run in S_FCN_LAST (the npu cannot go back to S_FCN after fc1)")
+    c1, h1, w1_ = conv1.shape
+    _, h2, w2_ = conv2.shape
+    cin2 = w2.shape[0]
+    if w1.shape[1:] != (KERNEL, KERNEL) or w2.shape[1:] != (KERNEL, KERNEL):
+        raise ValueError(f"the npu only runs {KERNEL}x{KERNEL} kernels")
+    if w1.shape[0] != c1 or cin2 != c1 or (h2, w2_) != (h1 - KERNEL + 1, w1_ - KERNEL + 1):
+        raise ValueError("conv weight blocks and result regions do not chain")
+    h, w = h1 + KERNEL - 1, w1_ + KERNEL - 1
+    _aligned(conv1, "the conv1 result")
+    _aligned(conv2, "the conv2 result")
+
+    # scratch table of conv1 input columns, one word per (output row, image column)
+    sram = SramImage() if size is None else SramImage(size)
+    sram.add(Region("image", IMAGE_BASE, (h, w)))
+    for r in m.weights:
+        sram.add(r)
+    for r in m.regions:
+        sram.add(Region(f"{r.name}.out", r.base, (r.nbytes + SPILL,)))
+    cols = sram.alloc("conv1.cols", (h1, w), 4)
+
+    e = Emitter()
+    e.lines += [f"# generated by gen_driver.py: conv1 {c1}x{h1}x{w1_}, conv2 {h2}x{w2_} over {cin2} channels, "
+                f"fc1 {fc1.shape[0]}, fc2 {fc2.shape[0]}", ""]
+    for reg, sel in NPU_REGS.items():
+        e("li", reg, NPU_BASE + (sel << 12))
+    e("li", TRIGGER, 1)
+    _ctrl(e, CTRL_PACK_CLEAR, "pack_addr = 0")
+    e.blank()
+
+    # image columns: walk each image column down, shifting the newest pixel in
+    e("li", "a0", DCACHE_BASE + IMAGE_BASE, comment="image")
+    e("li", "a1", DCACHE_BASE + cols.base, comment="column table")
+    e("li", "t0", w)
+    e.label("img_col_loop")
+    with e.loop(w):
+        e("lbu", "t2", "0(a0)")
+        for i in range(1, KERNEL - 1):
+            e("lbu", "t6", f"{i * w}(a0)")
+            e("sll", "t6", "t6", 8 * i)
+            e("add", "t2", "t2", "t6")
+        e("addi", "a2", "a0", (KERNEL - 1) * w)
+        e("addi", "a3", "a1", 0)
+        e("li", "t4", h1)
+        e.label("img_row_loop")
+        with e.loop(h1):
+            e("lbu", "t6", "0(a2)", comment="newest row")
+            e("sll", "t6", "t6", 8 * (KERNEL - 1))
+            e("add", "t2", "t2", "t6")
+            e("sw", "t2", "0(a3)")
+            e("srl", "t2", "t2", 8, comment="drop the oldest row")
+            e("addi", "a2", "a2", w)
+            e("addi", "a3", "a3", 4 * w)
+            e("addi", "t4", "t4", -1)
+            e("bnez", "t4", "img_row_loop")
+        e("addi", "a0", "a0", 1)
+        e("addi", "a1", "a1", 4)
+        e("addi", "t0", "t0", -1)
+        e("bnez", "t0", "img_col_loop")
+    e.blank()
+
+    # conv1: results go through the pack register, read every PACK_BYTES triggers
+    total = c1 * h1 * w1_
+    e("li", "a4", DCACHE_BASE + w1.base, comment="conv1 kernels")
+    e("li", "s3", DCACHE_BASE + conv1.base, comment="conv1 results")
+    e("li", "s2", PACK_BYTES, comment="triggers until the next pack read")
+    e("li", "s4", c1)
+    e.label("conv1_chan_loop")
+    with e.loop(c1):
+        _load_kernel(e, "a4")
+        e("li", "a1", DCACHE_BASE + cols.base)
+        e("li", "s5", h1)
+        e.label("conv1_row_loop")
+        with e.loop(h1):
+            for j in range(KERNEL - 1):
+                e("lw", "t2", f"{4 * j}(a1)")
+                e("sw", "t2", "0(s0)", comment="preload")
+            e("addi", "a1", "a1", 4 * (KERNEL - 1))
+            e("li", "t4", w1_)
+            e.label("conv1_col_loop")
+            with e.loop(w1_):
+                e("lw", "t2", "0(a1)")
+                e("sw", "t2", "0(s0)")
+                e("sw", TRIGGER, "0(s7)", comment="trigger")
+                e("addi", "a1", "a1", 4)
+                e("addi", "s2", "s2", -1)
+                e("bnez", "s2", "conv1_next")
+                e("lw", "t6", "0(s8)", comment=f"{PACK_BYTES} results", reps=total // PACK_BYTES)
+                e("sw", "t6", "0(s3)", reps=total // PACK_BYTES)
+                e("addi", "s3", "s3", PACK_BYTES)
+                e("li", "s2", PACK_BYTES)
+                e.label("conv1_next")
+                e("addi", "t4", "t4", -1)
+                e("bnez", "t4", "conv1_col_loop")
+            e("addi", "s5", "s5", -1)
+            e("bnez", "s5", "conv1_row_loop")
+        e("addi", "s4", "s4", -1)
+        e("bnez", "s4", "conv1_chan_loop")
+    if total % PACK_BYTES:
+        e("lw", "t6", "0(s8)", comment="last partial pack")
+        e("sw", "t6", "0(s3)")
+    e.label(LAYER_LABELS["conv1"])
+    e.layer = "conv2"
+    _ctrl(e, CTRL_NEXT, "-> S_CONV2")
+    e.blank()
+
+    # conv2: one 3x3 conv per input channel, summed in d_cache, relu on the last one
+    plane = h1 * w1_
+    e("li", "a4", DCACHE_BASE + w2.base, comment="conv2 kernels")
+    e("li", "s3", DCACHE_BASE + conv1.base, comment="conv1 map of the channel")
+    e("li", "s10", cin2)
+    e("li", "s4", cin2)
+    e.label("conv2_chan_loop")
+    with e.loop(cin2):
+        _load_kernel(e, "a4")
+        e("li", "s5", DCACHE_BASE + conv2.base)
+        e("addi", "a0", "s3", 0)
+        e("li", "t0", h2)
+        e.label("conv2_row_loop")
+        with e.loop(h2):
+            for j in range(KERNEL - 1):
+                _gather_column(e, "a0", j, w1_)
+                e("sw", "t2", "0(s0)", comment="preload")
+            e("addi", "a1", "a0", KERNEL - 1)
+            e("li", "t4", w2_)
+            e.label("conv2_col_loop")
+            with e.loop(w2_):
+                _gather_column(e, "a1", 0, w1_)
+                e("sw", "t2", "0(s0)")
+                e("sw", TRIGGER, "0(s7)", comment="trigger")
+                e("addi", "a1", "a1", 1)
+                e("lw", "t6", "0(s8)", comment="partial sum of this channel")
+                e("beq", "s4", "s10", "conv2_first")
+                e("lw", "t5", "0(s5)", comment="sum so far", reps=(cin2 - 1) * h2 * w2_)
+                e("add", "t6", "t6", "t5")
+                e.label("conv2_first")
+                e("bne", "s4", TRIGGER, "conv2_store")
+                e("srl", "t5", "t6", 31)
+                e("beqz", "t5", "conv2_store")
+                e("li", "t6", 0, comment="relu")
+                e.label("conv2_store")
+                e("sw", "t6", "0(s5)")
+                e("addi", "s5", "s5", conv2.elem_bytes)
+                e("addi", "t4", "t4", -1)
+                e("bnez", "t4", "conv2_col_loop")
+            e("addi", "a0", "a0", w1_)
+            e("addi", "t0", "t0", -1)
+            e("bnez", "t0", "conv2_row_loop")
+        e("addi", "s3", "s3", plane)
+        e("addi", "s4", "s4", -1)
+        e("bnez", "s4", "conv2_chan_loop")
+    e.label(LAYER_LABELS["conv2"])
+    e.layer = "fc1"
+    _ctrl(e, CTRL_NEXT, "-> S_FCN")
+    _ctrl(e, CTRL_PE_CLEAR, "clear pe")
+    e.blank()
+
+    # fc1 in S_FCN: one input and `lanes` weights per write, four inputs per `lanes` weight words
+    e("li", "s3", DCACHE_BASE + fc1.base, comment="fc1 results")
+    if fc1_full is not None:
+        _aligned(fc1_full, "fc1.full")
+        passes, n_in, lanes = fc1_full.shape
+        if n_in % 4:
+            raise ValueError(f"fc1 has {n_in} inputs, not a multiple of 4")
+        words = ["t1", "t3", "t5"][:lanes]
+        e("li", "a4", DCACHE_BASE + fc1_full.base, comment="fc1.full weights")
+        e("li", "s4", passes)
+        e.label("fcn1_loop")
+        with e.loop(passes):
+            e("li", "a0", DCACHE_BASE + conv2.base, comment="fc1 inputs")
+            e("li", "t0", n_in // 4)
+            e.label("fcn1_input_loop")
+            with e.loop(n_in // 4):
+                for i, reg in enumerate(words):
+                    e("lw", reg, f"{4 * i}(a4)")
+                for i in range(4):
+                    _fc_input(e, conv2, "a0", i, 3, "t2")
+                    _extract(e, words, i, lanes)
+                    e("add", "t2", "t2", "t6")
+                    e("sw", "t2", "0(s6)", comment="fcn_in = x | w2 | w1 | w0")
+                    e("sw", TRIGGER, "0(s7)", comment="trigger")
+                e("addi", "a4", "a4", 4 * lanes)
+                e("addi", "a0", "a0", 4 * conv2.elem_bytes)
+                e("addi", "t0", "t0", -1)
+                e("bnez", "t0", "fcn1_input_loop")
+            e("lw", "t6", "0(s8)", comment=f"{lanes} neurons")
+            e("sw", "t6", "0(s3)", split=sum((fc1.base + lanes * g) % 4 != 0 for g in range(passes)))
+            e("addi", "s3", "s3", lanes)
+            _ctrl(e, CTRL_PE_CLEAR, "clear pe")
+            e("addi", "s4", "s4", -1)
+            e("bnez", "s4", "fcn1_loop")
+    e("sw", "zero", "0(s6)", comment="PE2 keeps its last S_FCN operands in S_FCN_LAST")
+    _ctrl(e, CTRL_NEXT, "-> S_FCN_LAST")
+    if fc1_last is not None:
+        _fc_last(e, "fcn1", fc1_last, conv2, fc1, "s3", fc1.base + fc1.shape[0] - fc1_last.shape[0], clear_after=True)
+    e.label(LAYER_LABELS["fc1"])
+    e.layer = "fc2"
+    e.blank()
+
+    e("li", "s3", DCACHE_BASE + fc2.base, comment="fc2 results")
+    _fc_last(e, "fcn2", fc2_last, fc1, fc2, "s3", fc2.base, clear_after=False)
+    _ctrl(e, CTRL_NEXT, "-> S_DONE, back to S_CONV1 for the next frame")
+    e.label(LAYER_LABELS["fc2"])
+    return e
+
+
+def bus_totals(counts: Counter) -> Counter:
+    """npu and d_cache transactions of a per-layer Emitter count."""
+    return Counter(npu=sum(v for k, v in counts.items() if k.startswith("npu_")),
+                   dcache=sum(v for k, v in counts.items() if k.startswith("dcache_")))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate the host program for the npu from the layer map")
+    ap.add_argument("--map", type=Path, default=Path(DATA_DIR) / "weights_map.json", help="weight_placement.py map")
+    ap.add_argument("-o", "--output", type=Path, default=Path(DATA_DIR).parent / "write_npu_gen.S")
+    ap.add_argument("--check", action="store_true", help="run it in npu_emu.py against the golden model")
+    ap.add_argument("-i", "--input", type=Path, default=Path(DATA_DIR) / "input_32bit.hex")
+    ap.add_argument("-w", "--weights", type=Path, default=Path(DATA_DIR) / "weights.hex")
+    ap.add_argument("--count", type=int, default=1, help="frames to check")
+    ap.add_argument("--baseline", type=Path, default=Path(DATA_DIR).parent / "write_npu.S")
+    args = ap.parse_args()
+
+    e = generate(load_map(args.map))
+    args.output.write_text(e.text())
+    emitted = {name: bus_totals(c) for name, c in e.counts.items()}
+    n_mem = sum(1 for line in e.lines if line.split()[:1] and line.split()[0] in MEM_OPS)
+    print(f"{args.output}: {len(e.lines)} lines, {n_mem} load/store instructions")
+    print(f"{'layer':6} {'npu ops':>8} {'d_cache':>8} {'total':>8}")
+    for name, c in emitted.items():
+        print(f"{name:6} {c['npu']:8d} {c['dcache']:8d} {c['npu'] + c['dcache']:8d}")
+    tot = sum(emitted.values(), Counter())
+    print(f"{'total':6} {tot['npu']:8d} {tot['dcache']:8d} {tot['npu'] + tot['dcache']:8d} bus transactions per inference")
+    if not args.check:
+        return
+
+    import numpy as np
+    from backend import get_backend
+    from cal_result import res_hex_lines
+    from check import compare, format_mismatch
+    from hex_codec import decode_hex32
+    from npu_emu import run_inference
+
+    frames = decode_hex32(args.input.read_text())
+    frames = frames[: frames.size // 240 * 240].reshape(-1, 240)[: args.count]
+    weights = decode_hex32(args.weights.read_text())
+    B = get_backend()
+    model = B.load_model()
+    base_asm = args.baseline.read_text()
+    failed = 0
+    for n, img in enumerate(frames):
+        bus, host = run_inference(img, weights, e.text())
+        _, ref = run_inference(img, weights, base_asm)
+        layers = {k: B.to_numpy(v) for k, v in model.forward_layers(B.from_numpy(img.reshape(1, 1, 16, 15))).items()}
+        golden = decode_hex32("\n".join(res_hex_lines(layers["conv1"][0], layers["conv2_acc"][0],
+                                                      layers["fc1"][0], layers["fc2"][0])), dont_care=True)
+        mism = compare(golden, (bus.sram.data, bus.sram.valid))
+        failed += bool(mism)
+        print(f"frame {n}: golden {'all right' if not mism else f'{len(mism)} mismatching words'}, "
+              f"{sum(host.hits)} instructions (write_npu.S {sum(ref.hits)})")
+        for mm in mism[:10]:
+            print("    " + format_mismatch(mm))
+        bounds = [0] + [host.labels[lab] for lab in LAYER_LABELS.values()]
+        rbounds = [0] + [ref.labels[lab] for lab in LAYER_LABELS.values()]
+        for name, a, b, ra, rb in zip(LAYER_LABELS, bounds, bounds[1:], rbounds, rbounds[1:]):
+            got, base = host.bus_ops(a, b), ref.bus_ops(ra, rb)
+            same = "" if got == emitted[name] else f"  (emitted count {emitted[name]['npu']}/{emitted[name]['dcache']})"
+            print(f"  {name:6} npu {got['npu']:6d} (was {base['npu']:6d})  d_cache {got['dcache']:6d} "
+                  f"(was {base['dcache']:6d}){same}")
+        got, base = host.bus_ops(), ref.bus_ops()
+        print(f"  total  npu {got['npu']:6d} (was {base['npu']:6d})  d_cache {got['dcache']:6d} (was {base['dcache']:6d})"
+              f"  -> {got['npu'] + got['dcache']} vs {base['npu'] + base['dcache']} bus transactions, "
+              f"{int(np.sum(host.hits))} vs {int(np.sum(ref.hits))} instructions")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Stress-vector generator: N test cases in one pass, each with its input
+image, the expected d_cache result and a ready-to-load d_cache image.
+
+Case kinds (--mix sets their proportions):
+  random  uniform 0..255 pixels
+  edge    saturating patterns: 0/255 noise, checkerboards, row/column
+          stripes, a single hot or cold pixel, a 255 frame, ramps, and
+          images built from the sign of a conv1 kernel so that its
+          accumulator reaches its largest or smallest value
+  zero    all 0
+  max     all 255
+
+Case i is generated from numpy's default_rng([seed, i]), so a case does not
+depend on --jobs or --chunk, and case 0 / 1 are the all-0 / all-255 images
+whenever those kinds are in the mix. Per case, under <out>/<i // 1000>/:
+
+  <i>_input.hex   60 lines, the input_32bit.hex layout
+  <i>_res.hex     golden conv1 / conv2 / fc1 / fc2 in the res.hex layout
+  <i>_dcache.hex  image + the weights packed by weight_placement.py (the
+                  weights.hex layout) as $readmemh words, what
+                  dcache_init_4bytes_perline_filled.hex holds
+
+The golden results and the packed weights both come from --weight-dir, so
+a case's res.hex always matches its dcache image.
+
+plus cases.csv (index, kind, fc2) and, with --combined, every input in one
+file for batch_run.py / npu_emu.py. Chunks run on a process pool with a
+bounded number in flight, like batch_run.py.
+
+Usage:
+  python gen_vectors.py -n 1000 -o vectors
+  python gen_vectors.py -n 100000 -o /scratch/regress --seed 7 --jobs 16 --combined
+  python gen_vectors.py -n 500 -o edge_only --mix edge:1,max:1
+  python gen_vectors.py -n 1000 -o other_vectors --weight-dir other_net
+"""
+
+from __future__ import annotations
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backend import BACKENDS, get_backend
+from batch_run import IMG_SHAPE, _init_worker
+from hex_codec import encode_hex32
+from npu_emu import WEIGHT_BASE
+from weight_placement import place
+from weights_io import load_weights
+
+KINDS = ("random", "edge", "zero", "max")
+DEFAULT_MIX = "random:70,edge:28,zero:1,max:1"
+EDGE_PATTERNS = ("noise", "checker", "rows", "cols", "hot", "cold", "frame", "ramp", "kernel_max", "kernel_min")
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition(":")
+        if kind not in KINDS:
+            raise ValueError(f"unknown case kind {kind!r}, expected one of {', '.join(KINDS)}")
+        mix[kind] = float(weight or 1)
+    total = sum(mix.values())
+    return {k: v / total for k, v in mix.items()}
+
+
+def _edge_image(rng: np.random.Generator, w1: np.ndarray) -> np.ndarray:
+    h, w = IMG_SHAPE[1:]
+    r, c = np.mgrid[:h, :w]
+    pattern = EDGE_PATTERNS[rng.integers(len(EDGE_PATTERNS))]
+    if pattern == "noise":
+        img = rng.integers(0, 2, (h, w)) * 255
+    elif pattern == "checker":
+        img = ((r + c + rng.integers(2)) % 2) * 255
+    elif pattern == "rows":
+        img = ((r // rng.integers(1, 4)) % 2) * 255
+    elif pattern == "cols":
+        img = ((c // rng.integers(1, 4)) % 2) * 255
+    elif pattern in ("hot", "cold"):
+        img = np.full((h, w), 0 if pattern == "hot" else 255)
+        img[rng.integers(h), rng.integers(w)] = 255 - img[0, 0]
+    elif pattern == "frame":
+        img = np.where((r == 0) | (c == 0) | (r == h - 1) | (c == w - 1), 255, 0)
+    elif pattern == "ramp":
+        img = (r * 255 // (h - 1)) if rng.integers(2) else (c * 255 // (w - 1))
+    else:
+        # tile the sign of one conv1 kernel: every window aligned with the tiling hits +-max
+        k = w1[rng.integers(w1.shape[0]), 0]
+        sign = k > 0 if pattern == "kernel_max" else k < 0
+        kh, kw = sign.shape
+        img = np.tile(sign, (-(-h // kh), -(-w // kw)))[:h, :w] * 255
+    return np.asarray(img, dtype=np.uint8)
+
+
+def make_case(index: int, seed: int, mix: Dict[str, float], w1: np.ndarray) -> Tuple[str, np.ndarray]:
+    """(kind, (16, 15) uint8 image) of case index."""
+    rng = np.random.default_rng([seed, index])
+    fixed = [k for k in ("zero", "max") if k in mix]
+    if index < len(fixed):
+        kind = fixed[index]
+    else:
+        kind = rng.choice(list(mix), p=list(mix.values()))
+    if kind == "zero":
+        img = np.zeros(IMG_SHAPE[1:], dtype=np.uint8)
+    elif kind == "max":
+        img = np.full(IMG_SHAPE[1:], 255, dtype=np.uint8)
+    elif kind == "edge":
+        img = _edge_image(rng, w1)
+    else:
+        img = rng.integers(0, 256, IMG_SHAPE[1:], dtype=np.uint8)
+    return str(kind), img
+
+
+@lru_cache(maxsize=None)
+def _packed_weights(weight_dir: Optional[str]) -> np.ndarray:
+    return place(load_weights(weight_dir))[0].view(np.uint8)
+
+
+def _write(path: str, text: str):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def run_chunk(start: int, count: int, seed: int, mix: Dict[str, float], out_dir: str,
+              weight_dir: Optional[str] = None, backend: Optional[str] = None) -> List[Tuple[int, str, int, np.ndarray]]:
+    from cal_result import res_hex_lines
+
+    B = get_backend(backend)
+    model = B.load_model(weight_dir)
+    w1 = B.to_numpy(model.q_conv1_w)
+    cases = [make_case(start + k, seed, mix, w1) for k in range(count)]
+    x = np.stack([img for _, img in cases])[:, None]
+    layers = {k: B.to_numpy(v) for k, v in model.forward_layers(B.from_numpy(x)).items()}
+
+    packed = _packed_weights(weight_dir)
+    end = -(-(WEIGHT_BASE + packed.size) // 4) * 4
+    init = np.zeros((count, end), dtype=np.uint8)
+    init[:, :x[0].size] = x.reshape(count, -1)
+    init[:, WEIGHT_BASE:WEIGHT_BASE + packed.size] = packed
+
+    rows = []
+    for k, (kind, img) in enumerate(cases):
+        idx = start + k
+        shard = os.path.join(out_dir, f"{idx // 1000:03d}")
+        os.makedirs(shard, exist_ok=True)
+        base = os.path.join(shard, f"{idx:06d}")
+        _write(f"{base}_input.hex", encode_hex32(img.reshape(-1)))
+        lines = res_hex_lines(layers["conv1"][k], layers["conv2_acc"][k], layers["fc1"][k], layers["fc2"][k])
+        _write(f"{base}_res.hex", "\n".join(lines) + "\n")
+        _write(f"{base}_dcache.hex", encode_hex32(init[k]))
+        rows.append((idx, kind, int(layers["fc2"][k, 0]), img))
+    return rows
+
+
+def generate(n: int, out_dir: str, seed: int = 0, mix: Optional[Dict[str, float]] = None, chunk: int = 512,
+             jobs: Optional[int] = None, weight_dir: Optional[str] = None,
+             backend: Optional[str] = None) -> Iterator[Tuple[int, str, int, np.ndarray]]:
+    """Write n cases, yielding (index, kind, fc2, image) in index order."""
+    mix = mix or parse_mix(DEFAULT_MIX)
+    jobs = jobs or os.cpu_count() or 1
+    window = 2 * jobs  # chunks in flight
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(backend,)) as ex:
+        pending = deque()
+        for start in range(0, n, chunk):
+            pending.append(ex.submit(run_chunk, start, min(chunk, n - start), seed, mix, out_dir, weight_dir, backend))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate stress vectors with golden results and d_cache init images")
+    ap.add_argument("-n", "--count", type=int, required=True, help="number of cases")
+    ap.add_argument("-o", "--output", type=Path, required=True, help="output directory")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="kind:weight,... of random, edge, zero, max")
+    ap.add_argument("--chunk", type=int, default=512, help="cases per batch")
+    ap.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    ap.add_argument("--weight-dir", default=None, help="directory with the *_weight.txt files (default: data/)")
+    ap.add_argument("--backend", choices=sorted(BACKENDS), default=None)
+    ap.add_argument("--combined", action="store_true", help="also write every input to inputs.hex")
+    args = ap.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    kinds: Dict[str, int] = {}
+    combined = open(args.output / "inputs.hex", "w") if args.combined else None
+    try:
+        with open(args.output / "cases.csv", "w") as f:
+            f.write("index,kind,fc2\n")
+            for idx, kind, fc2, img in generate(args.count, str(args.output), args.seed, parse_mix(args.mix),
+                                                args.chunk, args.jobs, args.weight_dir, args.backend):
+                f.write(f"{idx},{kind},{fc2}\n")
+                kinds[kind] = kinds.get(kind, 0) + 1
+                if combined is not None:
+                    combined.write(encode_hex32(img.reshape(-1)))
+    finally:
+        if combined is not None:
+            combined.close()
+
+    print(f"Cases: {sum(kinds.values())} ({', '.join(f'{k} {v}' for k, v in sorted(kinds.items()))})")
+    print(f"Saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Content-addressed on-disk cache of golden model results.
+
+An entry holds every tensor forward_layers() returns for one image (conv1,
+conv2_acc, conv2, fc1, fc2). Its key is the sha256 of the arithmetic version
+(backend.SEMANTICS_VERSION), the weight bytes and the input bytes, so editing
+weights, changing the arithmetic or feeding a new vector misses the cache,
+and nothing else does.
+
+Entries are single files under <root>/<key[:2]>/<key>.gc, written
+atomically, so several worker processes can share one cache directory.
+Reading an entry touches its mtime. When the cache grows past max_bytes the
+least recently used entries are deleted until it is back under 90 % of the
+limit.
+
+Usage:
+  python golden_cache.py                    # entries, size and age of the default cache
+  python golden_cache.py --root /tmp/gc --max-mb 64 --evict
+  python golden_cache.py --clear
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend import SEMANTICS_VERSION, get_backend
+from weights_io import DATA_DIR
+
+DEFAULT_ROOT = os.path.join(DATA_DIR, ".golden_cache")
+DEFAULT_MAX_BYTES = 256 << 20
+MAGIC = b"GCR1"
+WEIGHT_NAMES = ("q_conv1_w", "q_conv1_b", "q_conv2_w", "q_conv2_b", "q_fc1_w", "q_fc1_b", "q_fc2_w", "q_fc2_b")
+
+
+def model_digest(model, to_numpy=np.asarray) -> bytes:
+    """sha256 of the arithmetic version and every weight/bias tensor of a QuantizedCNN."""
+    h = hashlib.sha256(f"golden-v{SEMANTICS_VERSION}".encode())
+    for name in WEIGHT_NAMES:
+        a = np.ascontiguousarray(to_numpy(getattr(model, name)))
+        h.update(f"{name}:{a.dtype.str}:{a.shape}".encode())
+        h.update(a.tobytes())
+    return h.digest()
+
+
+def _pack(layers: Dict[str, np.ndarray]) -> bytes:
+    header = {k: [v.dtype.str, list(v.shape)] for k, v in layers.items()}
+    head = json.dumps(header).encode()
+    return b"".join([MAGIC, struct.pack("<I", len(head)), head] + [np.ascontiguousarray(v).tobytes() for v in layers.values()])
+
+
+def _unpack(blob: bytes) -> Dict[str, np.ndarray]:
+    if blob[:4] != MAGIC:
+        raise ValueError("not a golden cache entry")
+    n = struct.unpack_from("<I", blob, 4)[0]
+    header = json.loads(blob[8:8 + n])
+    out, off = {}, 8 + n
+    for name, (dtype, shape) in header.items():
+        dt = np.dtype(dtype)
+        count = int(np.prod(shape))
+        out[name] = np.frombuffer(blob, dtype=dt, count=count, offset=off).reshape(shape)
+        off += count * dt.itemsize
+    if off != len(blob):
+        raise ValueError("truncated golden cache entry")
+    return out
+
+
+class GoldenCache:
+    def __init__(self, root: str = DEFAULT_ROOT, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def key(self, digest: bytes, x: np.ndarray) -> str:
+        h = hashlib.sha256(digest)
+        x = np.ascontiguousarray(x)
+        h.update(f"{x.dtype.str}:{x.shape}".encode())
+        h.update(x.tobytes())
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".gc")
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                layers = _unpack(f.read())
+            os.utime(path)  # LRU order is mtime order
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return layers
+
+    def put(self, key: str, layers: Dict[str, np.ndarray]) -> None:
+        path = self.path(key)
+        blob = _pack(layers)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        try:
+            os.link(tmp, path)  # only the writer that creates the entry counts its size
+            self._size += len(blob)
+            os.remove(tmp)
+        except FileExistsError:
+            os.replace(tmp, path)  # stored by another writer (or unreadable): overwrite, already counted
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        out = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if e.name.endswith(".gc"):
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:  # evicted by another process
+                        continue
+                    out.append((e.path, st.st_size, st.st_mtime))
+        return out
+
+    def evict(self, target: Optional[int] = None) -> int:
+        """Delete least recently used entries until at most target bytes (default 90 % of max) remain."""
+        target = int(self.max_bytes * 0.9) if target is None else target
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        size = sum(s for _, s, _ in entries)
+        removed = 0
+        for path, s, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            size -= s
+        self._size = size
+        return removed
+
+    def clear(self) -> int:
+        return self.evict(0)
+
+    def stats(self) -> Dict[str, float]:
+        entries = self._entries()
+        now = time.time()
+        return {"entries": len(entries), "bytes": sum(s for _, s, _ in entries), "max_bytes": self.max_bytes,
+                "oldest_s": now - min((m for _, _, m in entries), default=now)}
+
+
+def forward_layers_cached(x: np.ndarray, cache: Optional[GoldenCache], backend: Optional[str] = None,
+                          weight_dir: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """forward_layers() of an (N, 1, H, W) uint8 batch as numpy arrays, computing only the images not in cache."""
+    B = get_backend(backend)
+    model = B.load_model(weight_dir)
+    if not len(x):  # the models reshape by batch size, so take the shapes from one blank image
+        blank = model.forward_layers(B.from_numpy(np.zeros((1,) + x.shape[1:], dtype=np.uint8)))
+        return {k: B.to_numpy(v)[:0] for k, v in blank.items()}
+    if cache is None:
+        return {k: B.to_numpy(v) for k, v in model.forward_layers(B.from_numpy(x)).items()}
+
+    digest = model_digest(model, B.to_numpy)
+    keys = [cache.key(digest, img) for img in x]
+    found = [cache.get(k) for k in keys]
+    miss = [i for i, layers in enumerate(found) if layers is None]
+    if miss:
+        computed = model.forward_layers(B.from_numpy(x[miss]))
+        computed = {k: B.to_numpy(v) for k, v in computed.items()}
+        for j, i in enumerate(miss):
+            found[i] = {k: v[j] for k, v in computed.items()}
+            cache.put(keys[i], found[i])
+    return {k: np.stack([layers[k] for layers in found]) for k in found[0]}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect, trim or clear the golden result cache")
+    ap.add_argument("--root", default=DEFAULT_ROOT)
+    ap.add_argument("--max-mb", type=float, default=DEFAULT_MAX_BYTES / (1 << 20))
+    ap.add_argument("--evict", action="store_true", help="trim to 90 %% of --max-mb now")
+    ap.add_argument("--clear", action="store_true", help="delete every entry")
+    args = ap.parse_args()
+
+    cache = GoldenCache(args.root, int(args.max_mb * (1 << 20)))
+    if args.clear:
+        print(f"removed {cache.clear()} entries")
+    elif args.evict:
+        print(f"removed {cache.evict()} entries")
+    st = cache.stats()
+    print(f"{args.root}: {st['entries']} entries, {st['bytes'] / (1 << 20):.1f} of {st['max_bytes'] / (1 << 20):.0f} MB, "
+          f"oldest used {st['oldest_s'] / 3600:.1f} h ago")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Bulk NumPy codec for the hex formats used across the project.
+
+Formats:
+  weights  space-separated two-digit hex bytes (conv1_weight.txt ...), int8
+  hex32    one 32-bit word per line for $readmemh (input_32bit.hex, res.hex,
+           dcache.hex ...); byte 0 is the low byte of the word by default
+  hex8     one byte per line
+  bin      raw bytes, optionally memory-mapped on read
+
+'xx' nibbles (uninitialized / don't-care bytes in dcache dumps and res.hex)
+decode to 0 with a cleared valid mask when dont_care is set, and are an
+error otherwise; they encode back from the mask.
+
+Usage:
+  python hex_codec.py -i ../dcache.hex --from hex32 -o dcache.bin --to bin
+  python hex_codec.py -i dcache.bin --from bin -o dcache8.hex --to hex8
+"""
+
+from __future__ import annotations
+import argparse
+import re
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+_BAD = 255
+_DONT_CARE = 16
+_NIBBLE = np.full(256, _BAD, dtype=np.uint8)
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _NIBBLE[_c] = _i
+    _NIBBLE[ord(chr(_c).upper())] = _i
+_NIBBLE[ord("x")] = _NIBBLE[ord("X")] = _DONT_CARE
+_HEX_CHARS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+_X = ord("x")
+
+
+def _decode_fixed(lines, width: int, byteorder: str, pad: str):
+    """(rows, width/2) bytes and valid mask from equal-width hex lines; short lines are padded on the left."""
+    if set(map(len, lines)) - {width}:
+        lines = [ln.rjust(width, pad) for ln in lines]
+        if set(map(len, lines)) - {width}:
+            raise ValueError(f"hex line longer than {width} characters")
+    buf = np.frombuffer("".join(lines).encode("ascii"), dtype=np.uint8).reshape(-1, width)
+    nib = _NIBBLE[buf]
+    if (nib == _BAD).any():
+        raise ValueError("non-hex character in hex data")
+    hi, lo = nib[:, 0::2], nib[:, 1::2]
+    valid = (hi != _DONT_CARE) & (lo != _DONT_CARE)
+    data = ((hi & 0xF) << 4) | (lo & 0xF)
+    if byteorder == "little":
+        data, valid = data[:, ::-1], valid[:, ::-1]
+    return data.ravel(), valid.ravel()
+
+
+def _require_valid(valid: np.ndarray):
+    if not valid.all():
+        raise ValueError(f"'x' in hex data at byte {int(np.argmin(valid))} (decode with dont_care=True to allow it)")
+
+
+def _hex_chars(data: np.ndarray, valid: Optional[np.ndarray]) -> np.ndarray:
+    """(n, 2) ASCII codes of the bytes in data, 'xx' where valid is False."""
+    chars = np.empty((data.size, 2), dtype=np.uint8)
+    chars[:, 0] = _HEX_CHARS[data >> 4]
+    chars[:, 1] = _HEX_CHARS[data & 0xF]
+    if valid is not None:
+        chars[~np.asarray(valid, dtype=bool).ravel()] = _X
+    return chars
+
+
+def _join_rows(rows: np.ndarray, sep: Optional[int] = None) -> str:
+    """Join (rows, k, 2) character groups into text lines, groups separated by sep."""
+    n, k, _ = rows.shape
+    if n == 0:
+        return ""
+    if sep is None:
+        out = np.empty((n, 2 * k + 1), dtype=np.uint8)
+        out[:, :-1] = rows.reshape(n, 2 * k)
+    else:
+        out = np.empty((n, k, 3), dtype=np.uint8)
+        out[:, :, :2] = rows
+        out[:, :, 2] = sep
+        out = out.reshape(n, 3 * k)
+    out[:, -1] = ord("\n")
+    return out.tobytes().decode("ascii")
+
+
+def _as_u8(data) -> np.ndarray:
+    """Flat uint8 view of data; int8 keeps its two's complement bits, wider ints wrap."""
+    data = np.asarray(data)
+    if data.dtype.itemsize == 1:
+        return np.ascontiguousarray(data.reshape(-1)).view(np.uint8)
+    return data.astype(np.uint8).reshape(-1)
+
+
+def decode_weights(text: str) -> np.ndarray:
+    """Space-separated hex bytes -> int8 array (two's complement)."""
+    try:
+        data = bytes.fromhex(text)
+    except ValueError:
+        data = bytes(int(tok, 16) & 0xFF for tok in text.split())
+    return np.frombuffer(data, dtype=np.int8).copy()
+
+
+def encode_weights(data, per_line: int = 10) -> str:
+    """int8/uint8 array -> space-separated hex bytes, per_line to a line."""
+    data = _as_u8(data)
+    full = data.size // per_line * per_line
+    text = _join_rows(_hex_chars(data[:full], None).reshape(-1, per_line, 2), ord(" "))
+    if full < data.size:
+        text += _join_rows(_hex_chars(data[full:], None).reshape(1, -1, 2), ord(" "))
+    return text
+
+
+def decode_hex32(text: str, byteorder: str = "little", dont_care: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """32-bit-per-line hex -> uint8 bytes (and the valid mask if dont_care).
+
+    Lines shorter than 8 digits are padded at the high end, with 0 or, when
+    dont_care is set, with 'x'.
+    """
+    lines = text.split()
+    data, valid = _decode_fixed(lines, 8, byteorder, "x" if dont_care else "0")
+    if dont_care:
+        return data, valid
+    _require_valid(valid)
+    return data
+
+
+def encode_hex32(data, byteorder: str = "little", valid=None) -> str:
+    """uint8 bytes -> one 32-bit word per line; a trailing partial word gets a short line."""
+    data = _as_u8(data)
+    chars = _hex_chars(data, valid)
+    full = data.size // 4 * 4
+    words = chars[:full].reshape(-1, 4, 2)
+    tail = chars[full:].reshape(1, -1, 2)
+    if byteorder == "little":
+        words, tail = words[:, ::-1], tail[:, ::-1]
+    text = _join_rows(np.ascontiguousarray(words))
+    if full < data.size:
+        text += _join_rows(np.ascontiguousarray(tail))
+    return text
+
+
+def decode_hex8(text: str, dont_care: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """One hex byte per line -> uint8 bytes (and the valid mask if dont_care)."""
+    data, valid = _decode_fixed(text.split(), 2, "big", "0")
+    if dont_care:
+        return data, valid
+    _require_valid(valid)
+    return data
+
+
+def encode_hex8(data, valid=None) -> str:
+    """uint8 bytes -> one hex byte per line."""
+    data = _as_u8(data)
+    return _join_rows(_hex_chars(data, valid).reshape(-1, 1, 2))
+
+
+def decode_hex_tokens(text: str) -> np.ndarray:
+    """Whitespace-separated hex tokens of any even length, read left to right (big endian) -> uint8 bytes."""
+    try:
+        data = bytes.fromhex(text)
+    except ValueError:
+        toks = (re.sub(r"[^0-9A-Fa-f]", "", tok) for tok in text.split())
+        data = bytes.fromhex("".join(tok.zfill(len(tok) + len(tok) % 2) for tok in toks))
+    return np.frombuffer(data, dtype=np.uint8).copy()
+
+
+def read_bin(path, mmap: bool = True) -> np.ndarray:
+    """Raw bytes of path as uint8, memory-mapped read-only unless mmap is False."""
+    if mmap:
+        return np.memmap(path, dtype=np.uint8, mode="r")
+    return np.fromfile(path, dtype=np.uint8)
+
+
+def write_bin(path, data) -> None:
+    _as_u8(data).tofile(path)
+
+
+_DECODERS = {
+    "hex32": lambda p: decode_hex32(Path(p).read_text(), dont_care=True),
+    "hex8": lambda p: decode_hex8(Path(p).read_text(), dont_care=True),
+    "weights": lambda p: (decode_weights(Path(p).read_text()), None),
+    "bin": lambda p: (read_bin(p), None),
+}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert between the project's hex formats and raw binary")
+    ap.add_argument("-i", "--input", type=Path, required=True)
+    ap.add_argument("-o", "--output", type=Path, required=True)
+    ap.add_argument("--from", dest="src", choices=sorted(_DECODERS), default="hex32")
+    ap.add_argument("--to", dest="dst", choices=sorted(_DECODERS), default="bin")
+    args = ap.parse_args()
+
+    data, valid = _DECODERS[args.src](args.input)
+    if args.dst == "bin":
+        write_bin(args.output, data)
+    elif args.dst == "hex32":
+        args.output.write_text(encode_hex32(data, valid=valid))
+    elif args.dst == "hex8":
+        args.output.write_text(encode_hex8(data, valid=valid))
+    else:
+        args.output.write_text(encode_weights(data))
+    print(f"Bytes: {data.size} -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Opt-in per-layer profiling of QuantizedCNN (either backend).
+
+With a Profiler attached (model.profiler = prof, or `with profiling(model)`),
+forward() and forward_layers() run the layers one at a time through the
+backend's *_acc kernels and record, for conv1, conv2, fc1 and fc2:
+
+  time_s      wall time of the layer (accumulate + clamp/truncate)
+  macs        multiply-accumulates
+  bytes_in    input activations read; bytes_w weights + used biases read;
+  bytes_out   outputs written
+  acc_min/max raw int32 accumulator range
+  sat_low     accumulators below 0 (zeroed by the relu clamp)
+  sat_high    accumulators above 2**23-1 (clamped)
+  wrapped     clamped accumulators above 255, whose `& 0xFF` truncation
+              changes the value
+
+Records add up over every call (a batch, or many batches). Extra hooks,
+hook(layer, acc, out), see each layer's raw accumulators and outputs.
+Without a profiler the models take their usual path; the only cost is one
+attribute check per call.
+
+Usage:
+  python layer_profile.py -i input_32bit.hex
+  python layer_profile.py -i vectors.hex --count 10000 --backend torch --json prof.json --csv prof.csv
+"""
+
+from __future__ import annotations
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+ACC_MAX = 2**23 - 1
+LAYERS = ("conv1", "conv2", "fc1", "fc2")
+
+
+@dataclass
+class LayerRecord:
+    layer: str
+    calls: int = 0
+    images: int = 0
+    time_s: float = 0.0
+    macs: int = 0
+    bytes_in: int = 0
+    bytes_w: int = 0
+    bytes_out: int = 0
+    acc_min: Optional[int] = None
+    acc_max: Optional[int] = None
+    sat_low: int = 0
+    sat_high: int = 0
+    wrapped: int = 0
+
+    def add_acc(self, acc: np.ndarray):
+        lo, hi = int(acc.min()), int(acc.max())
+        self.acc_min = lo if self.acc_min is None else min(self.acc_min, lo)
+        self.acc_max = hi if self.acc_max is None else max(self.acc_max, hi)
+        self.sat_low += int(np.count_nonzero(acc < 0))
+        self.sat_high += int(np.count_nonzero(acc > ACC_MAX))
+        self.wrapped += int(np.count_nonzero(acc > 255))
+
+
+def _nbytes(B, t) -> int:
+    return int(B.to_numpy(t).nbytes)
+
+
+def _weight_bytes(B, w, b) -> int:
+    # the kernels only read bias[:Cout] (conv2 has 3 biases for 1 output channel)
+    return _nbytes(B, w) + _nbytes(B, b[:w.shape[0]])
+
+
+class Profiler:
+    def __init__(self, hooks: Optional[List[Callable]] = None):
+        self.hooks = list(hooks or [])
+        self.records: Dict[str, LayerRecord] = {name: LayerRecord(name) for name in LAYERS}
+
+    def reset(self):
+        self.records = {name: LayerRecord(name) for name in LAYERS}
+
+    def _layer(self, B, name, fn, x, weights, macs_per_out):
+        t0 = time.perf_counter()
+        acc = fn()
+        out = B.acc_to_u8(acc)
+        dt = time.perf_counter() - t0
+        a = B.to_numpy(acc)
+        r = self.records[name]
+        r.calls += 1
+        r.images += a.shape[0]
+        r.time_s += dt
+        r.macs += a.size * macs_per_out
+        r.bytes_in += _nbytes(B, x)
+        r.bytes_w += _weight_bytes(B, *weights)
+        r.bytes_out += _nbytes(B, out)
+        r.add_acc(a)
+        for hook in self.hooks:
+            hook(name, a, B.to_numpy(out))
+        return acc, out
+
+    def forward_layers(self, model, x, trace: bool = False):
+        """Profiled equivalent of model.forward_layers(x, trace), with the backend taken from the model's module."""
+        B = sys.modules[type(model).__module__]
+        w1, b1, w2, b2 = model.q_conv1_w, model.q_conv1_b, model.q_conv2_w, model.q_conv2_b
+        acc1, conv1 = self._layer(B, "conv1", lambda: B.conv2d_acc(x, w1, b1), x, (w1, b1), int(np.prod(w1.shape[1:])))
+        acc2, conv2 = self._layer(B, "conv2", lambda: B.conv3d_acc(conv1, w2, b2), conv1, (w2, b2), int(np.prod(w2.shape[1:])))
+        flat = conv2.reshape(conv2.shape[0], -1)
+        acc3, fc1 = self._layer(B, "fc1", lambda: B.linear_acc(flat, model.q_fc1_w, model.q_fc1_b), flat,
+                                (model.q_fc1_w, model.q_fc1_b), model.q_fc1_w.shape[1])
+        acc4, fc2 = self._layer(B, "fc2", lambda: B.linear_acc(fc1, model.q_fc2_w, model.q_fc2_b), fc1,
+                                (model.q_fc2_w, model.q_fc2_b), model.q_fc2_w.shape[1])
+        clamped = B.from_numpy(np.clip(B.to_numpy(acc2), 0, ACC_MAX).astype(np.uint32))
+        layers = {"conv1": conv1, "conv2_acc": clamped, "conv2": conv2, "fc1": fc1, "fc2": fc2}
+        if trace:
+            layers.update(conv1_pre=acc1, conv2_pre=acc2, fc1_pre=acc3, fc2_pre=acc4)
+        return layers
+
+    # export
+
+    def rows(self) -> List[Dict]:
+        return [asdict(r) for r in self.records.values()]
+
+    def to_json(self) -> str:
+        return json.dumps({"layers": self.rows()}, indent=2)
+
+    def to_csv(self) -> str:
+        buf = io.StringIO()
+        w = csv.DictWriter(buf, fieldnames=[f.name for f in fields(LayerRecord)])
+        w.writeheader()
+        w.writerows(self.rows())
+        return buf.getvalue()
+
+
+@contextmanager
+def profiling(model, profiler: Optional[Profiler] = None):
+    """Attach a profiler to model for the duration of the block (load_model() models are shared)."""
+    prof = profiler or Profiler()
+    old = getattr(model, "profiler", None)
+    model.profiler = prof
+    try:
+        yield prof
+    finally:
+        model.profiler = old
+
+
+def main():
+    from backend import BACKENDS, get_backend
+    from batch_run import iter_chunks, iter_images
+    from perf_model import model as perf_model
+
+    ap = argparse.ArgumentParser(description="Per-layer time, MAC, byte and accumulator profile of the golden model")
+    ap.add_argument("-i", "--input", type=Path, nargs="+", required=True, help="32-bit/line hex files, 60 lines per image")
+    ap.add_argument("--count", type=int, default=None)
+    ap.add_argument("--chunk", type=int, default=1024)
+    ap.add_argument("--backend", choices=sorted(BACKENDS), default=None)
+    ap.add_argument("--json", type=Path, default=None)
+    ap.add_argument("--csv", type=Path, default=None)
+    args = ap.parse_args()
+
+    B = get_backend(args.backend)
+    model = B.load_model()
+    with profiling(model) as prof:
+        for _, _, x in iter_chunks(iter_images(args.input, 0, args.count), args.chunk):
+            model.forward_layers(B.from_numpy(x))
+
+    hw = {st.name: st.cycles for st in perf_model()}
+    print(f"{'layer':6} {'images':>7} {'ms':>8} {'us/img':>7} {'MACs/img':>9} {'B in/w/out per img':>20} "
+          f"{'acc min':>9} {'acc max':>9} {'<0':>9} {'>2^23-1':>8} {'wrapped':>9} {'hw cyc/img':>10}")
+    for r in prof.records.values():
+        n = max(1, r.images)
+        io_ = f"{r.bytes_in // n}/{r.bytes_w // r.calls if r.calls else 0}/{r.bytes_out // n}"
+        print(f"{r.layer:6} {r.images:7d} {r.time_s * 1e3:8.2f} {r.time_s * 1e6 / n:7.2f} {r.macs // n:9d} {io_:>20} "
+              f"{r.acc_min if r.acc_min is not None else '-':>9} {r.acc_max if r.acc_max is not None else '-':>9} "
+              f"{r.sat_low:9d} {r.sat_high:8d} {r.wrapped:9d} {hw[r.layer]:10d}")
+    if args.json:
+        args.json.write_text(prof.to_json() + "\n")
+    if args.csv:
+        args.csv.write_text(prof.to_csv())
+
+
+if __name__ == "__main__":
+    main()
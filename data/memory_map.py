@@ -0,0 +1,81 @@
+"""
+d_cache memory map: where each layer's data lives, in byte offsets from the
+start of d_cache (0x600000 in write_npu.S), and how to index it.
+
+A map is a JSON file of the form
+
+  {"golden_base": 2000,
+   "regions": [{"name": "conv1", "base": 2000, "shape": [10, 14, 13], "elem_bytes": 1}, ...],
+   "weights": [{"name": "conv1", "base": 240, "shape": [10, 3, 3], "layout": "..."}, ...]}
+
+golden_base is the d_cache byte offset of the first line of the golden image
+(res.hex starts at the conv1 result base). Elements are stored in row-major
+order of shape; multi-byte elements are little endian. regions are the layer
+results the checker compares; weights (optional, written by
+weight_placement.py) are the packed weight blocks, with a free-form layout
+note saying which weight goes where.
+"""
+
+from __future__ import annotations
+import json
+from dataclasses import asdict, dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Region:
+    name: str
+    base: int
+    shape: Tuple[int, ...]
+    elem_bytes: int = 1
+    layout: str = ""
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * self.elem_bytes
+
+
+@dataclass(frozen=True)
+class MemoryMap:
+    golden_base: int
+    regions: Tuple[Region, ...]
+    weights: Tuple[Region, ...] = ()
+
+    def region(self, name: str) -> Region:
+        for r in self.regions:
+            if r.name == name:
+                return r
+        raise KeyError(name)
+
+    def to_json(self) -> str:
+        return json.dumps({"golden_base": self.golden_base,
+                           "regions": [asdict(r) for r in self.regions],
+                           "weights": [asdict(r) for r in self.weights]}, indent=2)
+
+
+# layer results as write_npu.S stores them and cal_result.py dumps them
+DEFAULT_MAP = MemoryMap(
+    golden_base=2000,
+    regions=(
+        Region("conv1", 2000, (10, 14, 13), 1),
+        Region("conv2", 4000, (1, 12, 11), 4),  # raw 24-bit accumulators, one word each
+        Region("fc1", 4600, (10,), 1),
+        Region("fc2", 4700, (1,), 1),
+    ),
+)
+
+
+def load_map(path=None) -> MemoryMap:
+    if path is None:
+        return DEFAULT_MAP
+    with open(path, "r") as f:
+        obj = json.load(f)
+    return MemoryMap(int(obj.get("golden_base", 0)), _regions(obj["regions"]), _regions(obj.get("weights", [])))
+
+
+def _regions(objs) -> Tuple[Region, ...]:
+    regions: List[Region] = [Region(r["name"], int(r["base"]), tuple(r["shape"]), int(r.get("elem_bytes", 1)),
+                                    r.get("layout", "")) for r in objs]
+    return tuple(regions)
@@ -0,0 +1,243 @@
+"""
+Weight-set-batched golden model: evaluates M int8 weight sets (different
+roundings, retrains) on the same images in one pass and reports how far
+they agree.
+
+The input side is prepared once per chunk: the conv1 im2col patches are
+built once and contracted with all M weight sets in a single GEMM over a
+(K, M * Cout) matrix. conv2 is one batched GEMM over the conv1 channels
+(every kernel tap at once, then shifted and summed) and the fc layers are
+batched matrix products over the leading weight-set axis, so a 50-model
+sweep costs one patch extraction plus the arithmetic instead of 50 model
+constructions and 50 patch extractions. Results are bit-exact with
+quant_np for every weight set: like quant_np the contractions run as exact
+float products, in float32 where no sum can reach 2**24 (every layer of
+the current net) and float64 otherwise; --check compares against a
+quant_np run per weight set.
+
+Agreement is measured against a reference weight set (the first one):
+per weight set, the fraction of images whose fc2 output, and whose whole
+layer output, equals the reference's, the mean |fc2 - fc2_ref|, and the
+M x M fc2 agreement matrix.
+
+Weight sets are directories with the four *_weight.txt files; --jitter N
+adds N rounding variants of the first set, each moving a random --flip
+fraction of its weights one step up or down.
+
+Usage:
+  python multi_eval.py -w . other_net retrain_3 -i input_all.hex
+  python multi_eval.py --jitter 49 --flip 0.05 -i vectors/inputs.hex --json agree.json
+  python multi_eval.py --jitter 10 -i input_all.hex --check
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import quant_np as Q
+from weights_io import DATA_DIR, load_weights
+
+LAYERS = ("conv1", "conv2", "fc1", "fc2")
+PARAMS = ("conv1_weight", "conv1_bias", "conv2_weight", "conv2_bias", "fc1_weight", "fc1_bias",
+          "fc2_weight", "fc2_bias")
+
+
+@dataclass
+class WeightStack:
+    """M weight sets stacked on a leading axis, in load_weights() naming."""
+    names: List[str]
+    params: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_weights(cls, names: Sequence[str], sets: Sequence[Dict[str, np.ndarray]]) -> "WeightStack":
+        for name, w in zip(names[1:], sets[1:]):
+            for p in PARAMS:
+                if w[p].shape != sets[0][p].shape:
+                    raise ValueError(f"{name}: {p} is {w[p].shape}, {names[0]} has {sets[0][p].shape}")
+        return cls(list(names), {p: np.stack([w[p] for w in sets]) for p in PARAMS})
+
+    @classmethod
+    def from_dirs(cls, dirs: Sequence[str]) -> "WeightStack":
+        return cls.from_weights([str(d) for d in dirs], [load_weights(str(d)) for d in dirs])
+
+    def with_jitter(self, n: int, flip: float, seed: int = 0) -> "WeightStack":
+        """Append n variants of the first set with a fraction flip of its weights moved by +-1."""
+        base = {p: v[0] for p, v in self.params.items()}
+        names, sets = list(self.names), [{p: v[i] for p, v in self.params.items()} for i in range(len(self))]
+        for i in range(n):
+            rng = np.random.default_rng([seed, i])
+            w = dict(base)
+            for p in PARAMS[::2]:
+                step = rng.choice([-1, 1], base[p].shape) * (rng.random(base[p].shape) < flip)
+                w[p] = np.clip(base[p].astype(np.int16) + step, -128, 127).astype(np.int8)
+            names.append(f"{self.names[0]}~{i}")
+            sets.append(w)
+        return WeightStack.from_weights(names, sets)
+
+    def model(self, i: int) -> Q.QuantizedCNN:
+        return Q.QuantizedCNN(*(self.params[p][i] for p in PARAMS))
+
+
+def exact_float(k: int):
+    """Narrowest float type whose sums of k uint8 x int8 products are exact integers."""
+    return np.float32 if k * 255 * 128 < 2**24 else np.float64
+
+
+def to_i32(acc: np.ndarray) -> np.ndarray:
+    # float32 sums are below 2**24 by construction, float64 ones get quant_np's int32 wrap
+    return acc.astype(np.int32) if acc.dtype == np.float32 else Q._i32(acc)
+
+
+def conv1_patches(x: np.ndarray, k: Sequence[int], dtype=np.float64) -> np.ndarray:
+    """(N, Cin, H, W) -> (N * Hout * Wout, Cin * Kh * Kw) im2col patches, built once per chunk."""
+    n, cin = x.shape[:2]
+    win = sliding_window_view(x, tuple(k), axis=(2, 3))
+    return win.transpose(0, 2, 3, 1, 4, 5).reshape(-1, cin * k[0] * k[1]).astype(dtype)
+
+
+def _linear(x: np.ndarray, w: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # batched (M, N, In) x (M, In, Out) + bias -> int32
+    f = exact_float(w.shape[2])
+    return to_i32(x.astype(f) @ w.transpose(0, 2, 1).astype(f)) + b.astype(np.int32)[:, None]
+
+
+def forward_layers(ws: WeightStack, x: np.ndarray, trace: bool = False) -> Dict[str, np.ndarray]:
+    """forward_layers(x, trace) of every weight set, each result with a leading (M,) axis."""
+    p = ws.params
+    m, (n, _, h, w) = len(ws), x.shape
+    w1 = p["conv1_weight"]
+    c1, kh, kw = w1.shape[1], w1.shape[3], w1.shape[4]
+    if x.shape[1] != 1 or w1.shape[2] != 1 or p["conv2_weight"].shape[1:3] != (1, c1):
+        raise ValueError(f"one input channel and a conv2 over all {c1} conv1 channels (one conv3d output depth) "
+                         f"expected, got images {x.shape[1:]}, conv1 {w1.shape[1:]}, "
+                         f"conv2 {p['conv2_weight'].shape[1:]}")
+    h1, w1o = h - kh + 1, w - kw + 1
+
+    # conv1: one GEMM for all weight sets, (N*P, K) x (K, M*C1), kept channel-last (M, N, H, W, C1)
+    f = exact_float(w1[0, 0].size)
+    acc = to_i32(conv1_patches(x, (kh, kw), f) @ w1.reshape(m * c1, -1).T.astype(f))
+    acc = acc.reshape(n, h1, w1o, m, c1).transpose(3, 0, 1, 2, 4) + p["conv1_bias"].astype(np.int32)[:, None, None, None]
+    conv1_pre = acc
+    conv1 = Q.acc_to_u8(acc)
+
+    # conv2 (the conv3d over all conv1 channels): a batched GEMM over the channels for every
+    # kernel tap, (M, N*H*W, C1) x (M, C1, Kh*Kw), then the taps shifted into place and summed
+    w2 = p["conv2_weight"][:, 0]  # (M, C1, Kh, Kw)
+    kh, kw = w2.shape[2:]
+    h2, w2o = h1 - kh + 1, w1o - kw + 1
+    f = exact_float(w2[0].size)
+    taps = np.matmul(conv1.reshape(m, -1, c1).astype(f), w2.reshape(m, c1, -1).astype(f))
+    taps = taps.reshape(m, n, h1, w1o, kh, kw)
+    acc = np.zeros((m, n, h2, w2o), dtype=f)
+    for i in range(kh):
+        for j in range(kw):
+            acc += taps[:, :, i:i + h2, j:j + w2o, i, j]
+    conv2_pre = to_i32(acc) + p["conv2_bias"][:, :1].astype(np.int32)[:, :, None, None]
+    acc = np.clip(conv2_pre, 0, 2**23-1)
+    conv2 = Q.acc_to_u8(acc)[:, :, None]
+    conv1 = conv1.transpose(0, 1, 4, 2, 3)  # (M, N, C1, H, W), as forward_layers returns it
+
+    fc1_pre = _linear(conv2.reshape(m, n, -1), p["fc1_weight"], p["fc1_bias"])
+    fc1 = Q.acc_to_u8(fc1_pre)
+    fc2_pre = _linear(fc1, p["fc2_weight"], p["fc2_bias"])
+    fc2 = Q.acc_to_u8(fc2_pre)
+    layers = {"conv1": conv1, "conv2_acc": acc.astype(np.uint32)[:, :, None], "conv2": conv2, "fc1": fc1, "fc2": fc2}
+    if trace:
+        layers.update(conv1_pre=conv1_pre.transpose(0, 1, 4, 2, 3), conv2_pre=conv2_pre[:, :, None],
+                      fc1_pre=fc1_pre, fc2_pre=fc2_pre)
+    return layers
+
+
+class Agreement:
+    """Running agreement of every weight set with the reference (index ref) and with each other."""
+
+    def __init__(self, m: int, ref: int = 0):
+        self.ref = ref
+        self.images = 0
+        self.layer_equal = {name: np.zeros(m, dtype=np.int64) for name in LAYERS}
+        self.fc2_abs = np.zeros(m, dtype=np.int64)
+        self.pairs = np.zeros((m, m), dtype=np.int64)
+        self.unanimous = 0
+
+    def add(self, layers: Dict[str, np.ndarray]):
+        m, n = layers["fc2"].shape[:2]
+        for name in LAYERS:
+            out = layers[name].reshape(m, n, -1)
+            self.layer_equal[name] += (out == out[self.ref]).all(axis=2).sum(axis=1)
+        fc2 = layers["fc2"][:, :, 0].astype(np.int32)
+        self.fc2_abs += np.abs(fc2 - fc2[self.ref]).sum(axis=1)
+        for i in range(m):
+            self.pairs[i] += (fc2 == fc2[i]).sum(axis=1)
+        self.unanimous += int((fc2 == fc2[0]).all(axis=0).sum())
+        self.images += n
+
+    def rows(self, names: Sequence[str]) -> List[Dict]:
+        d = max(self.images, 1)
+        return [{"name": name, **{f"{l}_agree": self.layer_equal[l][i] / d for l in LAYERS},
+                 "fc2_mean_abs_diff": self.fc2_abs[i] / d} for i, name in enumerate(names)]
+
+    def to_dict(self, names: Sequence[str]) -> Dict:
+        return {"images": self.images, "reference": names[self.ref], "unanimous": self.unanimous,
+                "models": self.rows(names), "fc2_pair_agree": (self.pairs / max(self.images, 1)).tolist()}
+
+
+def main():
+    from batch_run import iter_chunks, iter_images
+
+    ap = argparse.ArgumentParser(description="Evaluate many int8 weight sets on shared inputs in one batched pass")
+    ap.add_argument("-w", "--weights", nargs="+", default=[DATA_DIR], help="weight directories (the first is the reference)")
+    ap.add_argument("--jitter", type=int, default=0, help="add this many +-1 rounding variants of the first set")
+    ap.add_argument("--flip", type=float, default=0.02, help="fraction of weights a variant moves")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("-i", "--input", type=Path, nargs="+", default=[Path(DATA_DIR) / "input_all.hex"])
+    ap.add_argument("--count", type=int, default=None)
+    ap.add_argument("--chunk", type=int, default=128, help="images per batch (memory grows with chunk x weight sets)")
+    ap.add_argument("--check", action="store_true", help="also run quant_np per weight set and compare")
+    ap.add_argument("--json", type=Path, default=None)
+    args = ap.parse_args()
+
+    ws = WeightStack.from_dirs(args.weights)
+    if args.jitter:
+        ws = ws.with_jitter(args.jitter, args.flip, args.seed)
+    agree = Agreement(len(ws))
+    t_batched = t_single = 0.0
+    mismatches = 0
+    for _, _, x in iter_chunks(iter_images(args.input, 0, args.count), args.chunk):
+        t0 = time.perf_counter()
+        layers = forward_layers(ws, x)
+        t_batched += time.perf_counter() - t0
+        agree.add(layers)
+        if args.check:
+            t0 = time.perf_counter()
+            single = [ws.model(i).forward_layers(x) for i in range(len(ws))]
+            t_single += time.perf_counter() - t0
+            for i, ref in enumerate(single):
+                mismatches += sum(int(np.any(layers[k][i] != ref[k])) for k in ref)
+
+    print(f"{len(ws)} weight sets x {agree.images} images, batched pass {t_batched:.3f} s")
+    if args.check:
+        print(f"per-model quant_np: {t_single:.3f} s ({t_single / max(t_batched, 1e-9):.1f}x), "
+              f"{mismatches} mismatching layer outputs")
+    print(f"all weight sets agree on fc2 for {agree.unanimous} of {agree.images} images (reference {ws.names[0]})")
+    print(f"{'weight set':28} " + " ".join(f"{l:>7}" for l in LAYERS) + f" {'|dfc2|':>7}")
+    for r in agree.rows(ws.names):
+        print(f"{r['name'][-28:]:28} " + " ".join(f"{r[l + '_agree']:7.1%}" for l in LAYERS)
+              + f" {r['fc2_mean_abs_diff']:7.2f}")
+    if args.json:
+        args.json.write_text(json.dumps(agree.to_dict(ws.names), indent=1) + "\n")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,12 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
+import collections
+import functools
+import os
+
+from weights_io import (DATA_DIR, WEIGHT_FILES, BIAS_SIZES, WEIGHT_CACHE, load_hex_weights, load_input,
+                        load_weights)
 
 # Define quantization functions
 def quantize_int8(tensor, is_weight=False):
@@ -39,7 +45,75 @@ def mac_24bit_no_relu(input_patch, weight, bias=None):
     # print("clamped:", acc)
     return acc
 
+# Vectorized conv engine: every output pixel of every image is one row of an
+# im2col patch matrix built from sliding-window views (Tensor.unfold), so a
+# whole N-image batch is one int32 contraction per layer. Windows step by 1
+# exactly like the *_loop reference versions below, which index x[i:i+Kh].
+def acc_to_u8(acc):
+    acc = torch.clamp(acc, 0, 2**23-1) # relu
+    return (acc & 0xFF).to(torch.uint8) # cut to uint8
+
+def conv2d_acc(x, weight, bias=None, stride=1):
+    N, Cin, H, W = x.shape
+    Cout, _, Kh, Kw = weight.shape
+    Hout = (H - Kh) // stride + 1
+    Wout = (W - Kw) // stride + 1
+    win = x.to(torch.int32).unfold(2, Kh, 1).unfold(3, Kw, 1)[:, :, :Hout, :Wout]
+    patches = win.permute(0, 2, 3, 1, 4, 5).reshape(-1, Cin * Kh * Kw)
+    acc = patches @ weight.to(torch.int32).reshape(Cout, -1).T
+    acc = acc.view(N, Hout, Wout, Cout).permute(0, 3, 1, 2)
+    if bias is not None:
+        acc = acc + bias.to(torch.int32).view(1, Cout, 1, 1)
+    return acc # raw int32 accumulators, (N, Cout, Hout, Wout)
+
+def conv3d_acc(x, weight, bias=None, stride=1):
+    N, Cin, H, W = x.shape  # 3D input
+    _, Kd, Kh, Kw = weight.shape  # 3D filter
+    Cout = (Cin - Kd) // stride + 1
+    Hout = (H - Kh) // stride + 1
+    Wout = (W - Kw) // stride + 1
+    win = x.to(torch.int32).unfold(1, Kd, 1).unfold(2, Kh, 1).unfold(3, Kw, 1)
+    win = win[:, :Cout, :Hout, :Wout]  # (N, Cout, Hout, Wout, Kd, Kh, Kw)
+    # output depth co uses weight[co], as in the loop reference
+    acc = torch.einsum('ncijdhw,cdhw->ncij', win, weight[:Cout].to(torch.int32))
+    if bias is not None:
+        acc = acc + bias[:Cout].to(torch.int32).view(1, Cout, 1, 1)
+    return acc # raw int32 accumulators, (N, Cout, Hout, Wout)
+
 def quantized_conv2d(x, weight, bias, stride=1):
+    return acc_to_u8(conv2d_acc(x, weight, bias, stride))
+
+def quantized_conv3d(x, weight, bias, stride=1):
+    return acc_to_u8(conv3d_acc(x, weight, bias, stride))
+
+def quantized_conv3d_debug(x, weight, bias, stride=1):
+    acc = torch.clamp(conv3d_acc(x, weight, bias, stride), 0, 2**23-1)
+    return acc.to(torch.uint32)
+
+# Fused conv1 -> conv2, streamed row by row the way write_npu.S walks the
+# image: a line buffer of Kh input rows feeds conv1, a line buffer of Kh conv1
+# rows feeds conv2, and a conv2 row comes out as soon as its conv1 rows
+# exist. Nothing larger than Kh rows of either layer is kept, so memory grows
+# with the image width only. Stride 1 only, like write_npu.S.
+def stream_conv1_conv2(rows, w1, b1, w2, b2):
+    # rows: iterable of input rows (N, Cin, W); yields raw int32 conv2 rows (N, Cout, W2)
+    in_buf = collections.deque(maxlen=w1.shape[2])
+    c1_buf = collections.deque(maxlen=w2.shape[2])
+    for row in rows:
+        in_buf.append(row)
+        if len(in_buf) < in_buf.maxlen:
+            continue
+        c1_buf.append(quantized_conv2d(torch.stack(tuple(in_buf), 2), w1, b1)[:, :, 0])
+        if len(c1_buf) == c1_buf.maxlen:
+            yield conv3d_acc(torch.stack(tuple(c1_buf), 2), w2, b2)[:, :, 0]
+
+def fused_conv1_conv2_acc(x, w1, b1, w2, b2):
+    # Same result as conv3d_acc(quantized_conv2d(x, w1, b1), w2, b2) for stride 1
+    return torch.stack(list(stream_conv1_conv2(x.unbind(2), w1, b1, w2, b2)), 2)
+
+# Loop reference versions (one mac_24bit call per output pixel), kept to
+# cross-check the vectorized engine bit for bit.
+def quantized_conv2d_loop(x, weight, bias, stride=1):
     N, Cin, H, W = x.shape
     Cout, _, Kh, Kw = weight.shape
     Hout = (H - Kh) // stride + 1
@@ -54,7 +128,7 @@ def quantized_conv2d(x, weight, bias, stride=1):
                     out[n, co, i, j] = val
     return out
 
-def quantized_conv3d(x, weight, bias, stride=1):
+def quantized_conv3d_loop(x, weight, bias, stride=1):
     N, Cin, H, W = x.shape  # 3D input
     _, Kd, Kh, Kw = weight.shape  # 3D filter
     Cout = (Cin - Kd) // stride + 1
@@ -70,7 +144,7 @@ def quantized_conv3d(x, weight, bias, stride=1):
                     out[n, co, i, j] = val
     return out
 
-def quantized_conv3d_debug(x, weight, bias, stride=1):
+def quantized_conv3d_debug_loop(x, weight, bias, stride=1):
     N, Cin, H, W = x.shape  # 3D input
     _, Kd, Kh, Kw = weight.shape  # 3D filter
     Cout = (Cin - Kd) // stride + 1
@@ -86,20 +160,34 @@ def quantized_conv3d_debug(x, weight, bias, stride=1):
                     out[n, co, i, j] = val
     return out
 
+def linear_acc(x, weight, bias=None):
+    acc = x.to(torch.int32) @ weight.to(torch.int32).T  # (N, In) x (In, Out)
+    if bias is not None:
+        acc = acc + bias.to(torch.int32)
+    return acc # raw int32 accumulators, (N, Out)
+
 def quantized_linear(x, weight, bias):
+    return acc_to_u8(linear_acc(x, weight, bias))
+
+def quantized_linear_debug(x, weight, bias):
+    # 24-bit accumulators as mac_24bit_no_relu returns them, for fc debug dumps
+    acc = torch.clamp(linear_acc(x, weight, bias), 0, 2**23-1)
+    return acc.to(torch.uint32)
+
+def quantized_linear_loop(x, weight, bias):
     N, In = x.shape
     Out, _ = weight.shape
     out = torch.zeros((N, Out), dtype=torch.uint8)
     for n in range(N):
         for o in range(Out):
-            if Out==10: print(o)
             val = mac_24bit(x[n:n+1, :].view(1, 1, 1, In), weight[o:o+1].view(1, 1, 1, In), bias[o])
-            # if Out==10: print(val)
             out[n, o] = val
     return out
 
 # Implement the quantized network
 class QuantizedCNN(nn.Module):
+    profiler = None  # layer_profile.Profiler; None keeps the plain path
+
     def __init__(self, q_conv1_w, q_conv1_b, q_conv2_w, q_conv2_b, q_fc1_w, q_fc1_b, q_fc2_w, q_fc2_b):
         super().__init__()
         # Weights passed as arguments are quantized
@@ -112,7 +200,11 @@ class QuantizedCNN(nn.Module):
         self.q_fc2_w = q_fc2_w
         self.q_fc2_b = q_fc2_b
 
-    def forward(self, x):
+    def forward(self, x, fused=False):
+        if fused:
+            return self.forward_fused(x)
+        if self.profiler is not None:
+            return self.profiler.forward_layers(self, x)["fc2"]
         x = quantized_conv2d(x, self.q_conv1_w, self.q_conv1_b)
         #print("Shape of x:", x.shape)
         # x = quantized_relu8(x)
@@ -128,82 +220,51 @@ class QuantizedCNN(nn.Module):
         #print("Shape of x:", x.shape)
         return x
 
-# Load weights from the `.txt` files (assumed to be in 16 hexadecimal format)
-def load_hex_weights(file_path):
-    # Read the file as a string of hex values
-    with open(file_path, 'r') as f:
-        data = f.read().splitlines()
-    
-    # Convert each space-separated hex string to integer
-    weights = []
-    for line in data:
-        for val in line.split():
-            # Handle two's complement for negative numbers in int8 range
-            int_val = int(val, 16)  # Convert hex string to integer
-            if int_val > 127:  # If the value is above 127, it should be a negative number
-                int_val -= 256  # Convert to signed 8-bit integer (two's complement)
-            weights.append(int_val)
-    
-    return np.array(weights, dtype=np.int8)
-
-def load_input(file_path):
-    # Read the file as a string of hex values
-    with open(file_path, 'r') as f:
-        data = f.read().splitlines()
-    # print(data)
-    # Convert each space-separated hex string to integer
-    inputs = []
-    for line in data:
-        # print(line)
-        for i in range(8, 0, -2):
-            val = line[i-2:i]
-            # Handle two's complement for negative numbers in int8 range
-            int_val = int(val, 16)  # Convert hex string to integer
-            # print(int_val)
-            inputs.append(int_val)
-    
-    return np.array(inputs, dtype=np.uint8)
-
-# Use the function to load weights
-conv1_weight = load_hex_weights('./conv1_weight.txt')
-conv2_weight = load_hex_weights('./conv2_weight.txt')
-fc1_weight = load_hex_weights('./fc1_weight.txt')
-fc2_weight = load_hex_weights('./fc2_weight.txt')
-
-# For conv2_weight, reshape the 9x10 matrix to 3x3x10x1
-conv1_weight = conv1_weight.reshape(10, 1, 3, 3)  # Reshaping 9x10 to 3x3x10x1
-print("conv1_weight")
-print(conv1_weight)
-conv2_weight = conv2_weight.reshape(1, 10, 3, 3)  # Reshaping 9x10 to 3x3x10x1
-print("conv2_weight")
-print(conv2_weight)
-fc1_weight = fc1_weight.reshape(10, 132)  # Reshaping 9x10 to 3x3x10x1
-print("fcn1_weight")
-print(fc1_weight)
-fc2_weight = fc2_weight.reshape(1, 10)
-print("fc2_weight")
-print(fc2_weight)
-
-# Bias initialization (zero)
-conv1_bias = np.zeros(10, dtype=np.int8)
-conv2_bias = np.zeros(3, dtype=np.int8)  # 3 output channels
-fc1_bias = np.zeros(10, dtype=np.int8)
-fc2_bias = np.zeros(1, dtype=np.int8)
-
-# Simulating some sample inputs
-np.set_printoptions(threshold=np.inf)
-# Convert to torch tensors
-q_conv1_w = torch.tensor(conv1_weight, dtype=torch.int8)
-q_conv1_b = torch.tensor(conv1_bias, dtype=torch.int8)
-q_conv2_w = torch.tensor(conv2_weight, dtype=torch.int8)
-q_conv2_b = torch.tensor(conv2_bias, dtype=torch.int8)
-q_fc1_w = torch.tensor(fc1_weight, dtype=torch.int8)
-q_fc1_b = torch.tensor(fc1_bias, dtype=torch.int8)
-q_fc2_w = torch.tensor(fc2_weight, dtype=torch.int8)
-q_fc2_b = torch.tensor(fc2_bias, dtype=torch.int8)
-
-# Instantiate the model with the quantized weights
-model = QuantizedCNN(q_conv1_w, q_conv1_b, q_conv2_w, q_conv2_b, q_fc1_w, q_fc1_b, q_fc2_w, q_fc2_b)
+    def forward_layers(self, x, trace=False):
+        # Same pipeline as forward(), keeping every intermediate the d_cache dump holds;
+        # with trace=True also the raw int32 accumulators of every layer (<layer>_pre)
+        if self.profiler is not None:
+            return self.profiler.forward_layers(self, x, trace)
+        conv1_pre = conv2d_acc(x, self.q_conv1_w, self.q_conv1_b)
+        conv1 = acc_to_u8(conv1_pre)
+        conv2_pre = conv3d_acc(conv1, self.q_conv2_w, self.q_conv2_b)
+        acc = torch.clamp(conv2_pre, 0, 2**23-1)
+        conv2 = acc_to_u8(acc)
+        fc1_pre = linear_acc(conv2.view(conv2.size(0), -1), self.q_fc1_w, self.q_fc1_b)
+        fc1 = acc_to_u8(fc1_pre)
+        fc2_pre = linear_acc(fc1, self.q_fc2_w, self.q_fc2_b)
+        fc2 = acc_to_u8(fc2_pre)
+        layers = {"conv1": conv1, "conv2_acc": acc.to(torch.uint32), "conv2": conv2,
+                  "fc1": fc1, "fc2": fc2}
+        if trace:
+            layers.update(conv1_pre=conv1_pre, conv2_pre=conv2_pre, fc1_pre=fc1_pre, fc2_pre=fc2_pre)
+        return layers
+
+    def conv2_rows(self, rows):
+        # Streaming conv1 -> conv2: input rows (N, 1, W) in, uint8 conv2 rows (N, 1, W2) out
+        for acc in stream_conv1_conv2(rows, self.q_conv1_w, self.q_conv1_b, self.q_conv2_w, self.q_conv2_b):
+            yield acc_to_u8(acc)
+
+    def forward_fused(self, x):
+        # forward() without materializing conv1; bit-exact with the unfused path
+        x = torch.stack(list(self.conv2_rows(x.unbind(2))), 2)
+        x = quantized_linear(x.reshape(x.size(0), -1), self.q_fc1_w, self.q_fc1_b)
+        return quantized_linear(x, self.q_fc2_w, self.q_fc2_b)
+
+@functools.lru_cache(maxsize=None)
+def load_model(weight_dir=None, cache=True):
+    # QuantizedCNN built from the weight files in weight_dir (default: this directory)
+    w = load_weights(weight_dir, cache)
+    t = {k: torch.tensor(v, dtype=torch.int8) for k, v in w.items()}
+    return QuantizedCNN(t["conv1_weight"], t["conv1_bias"], t["conv2_weight"], t["conv2_bias"],
+                        t["fc1_weight"], t["fc1_bias"], t["fc2_weight"], t["fc2_bias"])
+
+# Backend interface shared with quant_np.py (see backend.py)
+def from_numpy(a):
+    return torch.from_numpy(np.ascontiguousarray(a))
+
+def to_numpy(t):
+    return t.numpy()
 
 if __name__ == "__main__":
     # sample_input = np.random.randint(0, 255, (5, 1, 16, 15), dtype=np.uint8)  # 5 sample inputs of size 16x15
@@ -211,7 +272,13 @@ if __name__ == "__main__":
     # # Run inference on a sample input
     # x = torch.tensor(sample_input, dtype=torch.uint8)
 
-    input = load_input("./input_32bit.hex")
+    np.set_printoptions(threshold=np.inf)
+    model = load_model()
+    for name in ("q_conv1_w", "q_conv2_w", "q_fc1_w", "q_fc2_w"):
+        print(name)
+        print(getattr(model, name).numpy())
+
+    input = load_input(os.path.join(DATA_DIR, "input_32bit.hex"))
     input = input.reshape(1, 1, 16, 15)
     print("Case input:\n", input)
     x = torch.tensor(input, dtype=torch.uint8)
@@ -0,0 +1,520 @@
+"""
+Transaction-level Python emulator of the npu addra/dina/douta port
+(rtl_4pe/_npu.sv, register map in rtl_2/interface_def.md) and of the host
+program that drives it (write_npu.S).
+
+Npu models the state the host can observe: the FSM states, the image and
+weight circular registers (cir_reg), the conv unit with its relu and 8-bit
+pack register, and the three fc PE accumulators, which are 24 bits wide as in
+the RTL. Every bus write or read is applied as one transaction; internal
+clock cycles are not modelled.
+
+Host is a small RV32I interpreter for the instructions write_npu.S and the
+programs of gen_driver.py use. Loads/stores to 0x6000_0000 go to the 8 KB
+d_cache (cv32e40p splits a misaligned word access into two bus
+transactions, which bus_ops() counts), loads/stores to 0x7000_0000 go to the
+npu. Bus transactions can be recorded and replayed straight into an Npu
+without interpreting the program again.
+
+Usage:
+  python npu_emu.py                                 # input_32bit.hex + weights.hex, check against golden
+  python npu_emu.py -i input_all.hex --count 1 --dump dcache_emu.hex
+  python npu_emu.py --compare ../dcache.hex         # diff the whole d_cache against a simulation dump
+  python npu_emu.py --stream /tmp/npu.fifo          # stand in for npu_stream_tb.sv under cosim.py
+"""
+
+from __future__ import annotations
+import argparse
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import perf_model
+from hex_codec import decode_hex32
+from sram_image import SramImage
+
+DATA_DIR = Path(__file__).resolve().parent
+DCACHE_BASE = 0x6000_0000
+NPU_BASE = 0x7000_0000
+WEIGHT_BASE = 240               # packed weights right after the 16x15 image (write_npu.S)
+M32 = 0xFFFF_FFFF
+
+# addra[14:12]
+SEL_IMG, SEL_CONV_W, SEL_FCN_IN, SEL_CTRL, SEL_DONE, SEL_RESULT = 1, 2, 3, 4, 5, 6
+# control word bits (sel == 4)
+CTRL_TRIGGER, CTRL_NEXT, CTRL_PE_CLEAR, CTRL_IMG_CLEAR, CTRL_W_CLEAR, CTRL_PACK_CLEAR = (1 << i for i in range(6))
+
+S_CONV1, S_CONV2, S_FCN, S_FCN_LAST, S_DONE = "CONV1", "CONV2", "FCN", "FCN_LAST", "DONE"
+_NEXT_STATE = {S_CONV1: S_CONV2, S_CONV2: S_FCN, S_FCN: S_FCN_LAST, S_FCN_LAST: S_DONE, S_DONE: S_CONV1}
+
+
+def _s8(v: int) -> int:
+    return v - 256 if v & 0x80 else v
+
+
+def _s24(v: int) -> int:
+    v &= 0xFF_FFFF
+    return v - (1 << 24) if v & 0x80_0000 else v
+
+
+class Npu:
+    """Bus-visible state of the npu; write()/read() are single bus transactions."""
+
+    def __init__(self, k: int = 3):
+        self.k = k
+        self.reset()
+
+    def reset(self):
+        k = self.k
+        self.state = S_CONV1        # S_IDLE falls through to S_CONV1_LD on the first clock
+        self.img = [[0] * k for _ in range(k)]    # cir_reg: [row][0] is the newest column
+        self.w = [[0] * k for _ in range(k)]
+        self.pack = [0, 0, 0, 0]
+        self.pack_addr = 0
+        self.result = 0             # result_reg, 24-bit signed
+        self.pe = [0, 0, 0]         # pe_unit_fcn accumulators, 24-bit signed
+        self.fcn_in = 0
+        self.pe2_sel = (0, 0)       # PE2 operands hold their S_FCN value in S_FCN_LAST (not assigned there)
+        self.done = 0
+
+    # conv datapath
+    def conv_out(self) -> int:
+        acc = 0
+        for ir, wr in zip(self.img, self.w):
+            for p, q in zip(ir, wr):
+                acc += p * q
+        return _s24(acc)
+
+    def write(self, addr: int, data: int):
+        sel = (addr >> 12) & 7
+        if sel == SEL_IMG:
+            for i, row in enumerate(self.img):
+                row.insert(0, (data >> (8 * i)) & 0xFF)
+                row.pop()
+        elif sel == SEL_CONV_W:
+            for i, row in enumerate(self.w):
+                row.insert(0, _s8((data >> (8 * i)) & 0xFF))
+                row.pop()
+        elif sel == SEL_FCN_IN:
+            self.fcn_in = data & M32
+            if self.state == S_FCN:  # the PE2 operand latch is transparent in S_FCN
+                self.pe2_sel = (_s8((data >> 16) & 0xFF), (data >> 24) & 0xFF)
+        elif sel == SEL_CTRL:
+            self.control(data)
+
+    def control(self, data: int):
+        if data & CTRL_PE_CLEAR:
+            self.pe = [0, 0, 0]
+        if data & CTRL_IMG_CLEAR:
+            self.img = [[0] * self.k for _ in range(self.k)]
+        if data & CTRL_W_CLEAR:
+            self.w = [[0] * self.k for _ in range(self.k)]
+        if data & CTRL_PACK_CLEAR:
+            self.pack = [0, 0, 0, 0]
+            self.pack_addr = 0
+        if data & CTRL_NEXT:
+            self.state = _NEXT_STATE[self.state]
+            if self.state == S_DONE:
+                self.done = 1
+                self.state = S_CONV1
+        elif data & CTRL_TRIGGER:
+            self.trigger()
+
+    def trigger(self):
+        st = self.state
+        if st == S_CONV1:
+            out = self.conv_out()
+            self.result = 0 if out < 0 else out  # relu
+            self.pack[self.pack_addr] = self.result & 0xFF
+            self.pack_addr = (self.pack_addr + 1) & 3
+        elif st == S_CONV2:
+            self.result = self.conv_out()        # no relu, summed over channels by the host
+        elif st == S_FCN:
+            d = self.fcn_in
+            x = (d >> 24) & 0xFF
+            for i in range(3):
+                self.pe[i] = _s24(self.pe[i] + _s8((d >> (8 * i)) & 0xFF) * x)
+        elif st == S_FCN_LAST:
+            d = self.fcn_in
+            self.pe[0] = _s24(self.pe[0] + _s8(d & 0xFF) * ((d >> 16) & 0xFF))
+            self.pe[1] = _s24(self.pe[1] + _s8((d >> 8) & 0xFF) * ((d >> 24) & 0xFF))
+            self.pe[2] = _s24(self.pe[2] + self.pe2_sel[0] * self.pe2_sel[1])
+
+    def read(self, addr: int) -> int:
+        sel = (addr >> 12) & 7
+        if sel == SEL_DONE:
+            return self.done
+        if sel != SEL_RESULT:
+            return 0
+        st = self.state
+        if st == S_CONV1:
+            return self.pack[0] | self.pack[1] << 8 | self.pack[2] << 16 | self.pack[3] << 24
+        if st == S_CONV2:
+            return self.result & M32             # sign extended to 32 bits
+        if st == S_FCN:
+            return sum((0 if v < 0 else v & 0xFF) << (8 * i) for i, v in enumerate(self.pe))
+        if st == S_FCN_LAST:
+            s = _s24(sum(self.pe))
+            return 0 if s < 0 else s & 0xFF
+        return 0
+
+
+class Bus:
+    """d_cache + npu address decode; optionally records every npu transaction."""
+
+    def __init__(self, sram: SramImage, npu: Npu, record: bool = False):
+        self.sram = sram
+        self.mem = sram.buf
+        self.valid = sram.mask  # bytes written or initialized, for 'xx' in dumps
+        self.npu = npu
+        self.trace: Optional[List[Tuple[int, int, int]]] = [] if record else None
+
+    def load(self, addr: int) -> int:
+        if addr >> 28 == NPU_BASE >> 28:
+            v = self.npu.read(addr & 0xFFFF)
+            if self.trace is not None:
+                self.trace.append((0, addr & 0xFFFF, v))
+            return v
+        off = addr - DCACHE_BASE
+        if 0 <= off <= len(self.mem) - 4:
+            return int.from_bytes(self.mem[off:off + 4], "little")
+        return sum(self.mem[o] << (8 * i) for i, o in enumerate(range(off, off + 4)) if 0 <= o < len(self.mem))
+
+    def load_byte(self, addr: int) -> int:
+        off = addr - DCACHE_BASE
+        return self.mem[off] if 0 <= off < len(self.mem) else 0
+
+    def store(self, addr: int, val: int):
+        if addr >> 28 == NPU_BASE >> 28:
+            if self.trace is not None:
+                self.trace.append((1, addr & 0xFFFF, val))
+            self.npu.write(addr & 0xFFFF, val)
+            return
+        off = addr - DCACHE_BASE
+        for i in range(4):
+            if 0 <= off + i < len(self.mem):
+                self.mem[off + i] = (val >> (8 * i)) & 0xFF
+                self.valid[off + i] = 1
+
+
+_REGS = {"zero": 0, "ra": 1, "sp": 2, "gp": 3, "tp": 4, "t0": 5, "t1": 6, "t2": 7, "s0": 8, "fp": 8, "s1": 9,
+         **{f"a{i}": 10 + i for i in range(8)}, **{f"s{i}": 16 + i for i in range(2, 12)},
+         **{f"t{i}": 25 + i for i in range(3, 7)}, **{f"x{i}": i for i in range(32)}}
+_MEM_OPERAND = re.compile(r"(-?\w+)\((\w+)\)")
+_ALU = {"lui", "addi", "li", "add", "srl", "sll", "srli", "slli", "andi", "xori"}
+_BRANCH = {"beqz", "beq", "bnez", "bne"}
+# layer -> label where its code ends in write_npu.S
+LAYER_LABELS = {"conv1": "conv1_chan_done", "conv2": "conv2_chan_done", "fc1": "fcn1_done", "fc2": "stop"}
+
+
+def parse_asm(text: str) -> Tuple[List[Tuple[str, List[str]]], Dict[str, int]]:
+    """Instructions as (mnemonic, operands) and label -> instruction index."""
+    prog, labels = [], {}
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        while ":" in line:
+            label, line = line.split(":", 1)
+            labels[label.strip()] = len(prog)
+            line = line.strip()
+        if not line:
+            continue
+        op, _, rest = line.partition(" ")
+        prog.append((op, [a.strip() for a in rest.split(",")] if rest.strip() else []))
+    return prog, labels
+
+
+class Host:
+    """Pre-decodes an RV32I subset into closures and runs it against a Bus."""
+
+    def __init__(self, asm: str, bus: Bus):
+        self.bus = bus
+        self.r = [0] * 32
+        prog, labels = parse_asm(asm)
+        self.ops = [op for op, _ in prog]
+        self.hits = [0] * len(prog)
+        self.taken = [0] * len(prog)
+        self.mmio = [0] * len(prog)  # loads/stores that went to the npu
+        self.split = [0] * len(prog)  # misaligned d_cache word accesses
+        self.labels = labels
+        self.code = [self._decode(i, op, args, labels) for i, (op, args) in enumerate(prog)]
+
+    def _decode(self, pc: int, op: str, a: List[str], labels: Dict[str, int]) -> Callable[[], int]:
+        r, bus, taken, mmio, split, nxt = self.r, self.bus, self.taken, self.mmio, self.split, pc + 1
+
+        def reg(name):
+            return _REGS[name]
+
+        def imm(s):
+            return int(s, 0)
+
+        if op == "lui":
+            rd, v = reg(a[0]), (imm(a[1]) << 12) & M32
+            def f():
+                r[rd] = v
+                return nxt
+        elif op in ("addi", "li"):
+            rd, rs, v = (reg(a[0]), reg(a[1]), imm(a[2])) if op == "addi" else (reg(a[0]), 0, imm(a[1]))
+            def f():
+                r[rd] = (r[rs] + v) & M32
+                return nxt
+        elif op in ("andi", "xori"):
+            rd, rs, v = reg(a[0]), reg(a[1]), imm(a[2]) & M32
+            if op == "andi":
+                def f():
+                    r[rd] = r[rs] & v
+                    return nxt
+            else:
+                def f():
+                    r[rd] = r[rs] ^ v
+                    return nxt
+        elif op == "add":
+            rd, rs1, rs2 = reg(a[0]), reg(a[1]), reg(a[2])
+            def f():
+                r[rd] = (r[rs1] + r[rs2]) & M32
+                return nxt
+        elif op in ("srl", "sll", "srli", "slli"):
+            rd, rs1 = reg(a[0]), reg(a[1])
+            left = op.startswith("sll")
+            if a[2] in _REGS:           # register shift amount
+                rs2 = reg(a[2])
+                def f():
+                    sh = r[rs2] & 31
+                    r[rd] = ((r[rs1] << sh) & M32) if left else (r[rs1] >> sh)
+                    return nxt
+            else:                       # srl/sll with an immediate assemble as srli/slli
+                sh = imm(a[2]) & 31
+                def f():
+                    r[rd] = ((r[rs1] << sh) & M32) if left else (r[rs1] >> sh)
+                    return nxt
+        elif op == "lw":
+            rd = reg(a[0])
+            off, base = _MEM_OPERAND.fullmatch(a[1]).groups()
+            off, rb = imm(off), reg(base)
+            def f():
+                addr = (r[rb] + off) & M32
+                if addr >> 28 == NPU_BASE >> 28:
+                    mmio[pc] += 1
+                elif addr & 3:
+                    split[pc] += 1
+                r[rd] = bus.load(addr)
+                return nxt
+        elif op == "lbu":
+            rd = reg(a[0])
+            off, base = _MEM_OPERAND.fullmatch(a[1]).groups()
+            off, rb = imm(off), reg(base)
+            def f():
+                r[rd] = bus.load_byte((r[rb] + off) & M32)
+                return nxt
+        elif op == "sw":
+            rs = reg(a[0])
+            off, base = _MEM_OPERAND.fullmatch(a[1]).groups()
+            off, rb = imm(off), reg(base)
+            def f():
+                addr = (r[rb] + off) & M32
+                if addr >> 28 == NPU_BASE >> 28:
+                    mmio[pc] += 1
+                elif addr & 3:
+                    split[pc] += 1
+                bus.store(addr, r[rs])
+                return nxt
+        elif op in _BRANCH:
+            rs1, rs2, target = (reg(a[0]), 0, labels[a[1]]) if op.endswith("z") else (reg(a[0]), reg(a[1]), labels[a[2]])
+            equal = op.startswith("beq")
+            def f():
+                if (r[rs1] == r[rs2]) == equal:
+                    taken[pc] += 1
+                    return target
+                return nxt
+        elif op == "j":
+            target = labels[a[0]]
+            def f():
+                taken[pc] += 1
+                return target
+        else:
+            raise ValueError(f"unsupported instruction: {op} {', '.join(a)}")
+
+        if op not in ("sw", "j") and op not in _BRANCH and reg(a[0]) == 0:  # writes to x0 are dropped
+            g = f
+            def f():
+                out = g()
+                r[0] = 0
+                return out
+        return f
+
+    def run(self, max_steps: int = 50_000_000) -> int:
+        code, hits = self.code, self.hits
+        pc, n, steps = 0, len(code), 0
+        while pc < n and steps < max_steps:
+            hits[pc] += 1
+            pc = code[pc]()
+            steps += 1
+        return steps
+
+    def op_counts(self, start: int = 0, stop: Optional[int] = None) -> Counter:
+        """Executed instructions in [start, stop) by the classes perf_model.py uses."""
+        c = Counter()
+        for pc in range(start, len(self.ops) if stop is None else stop):
+            op, hit, tk, mm = self.ops[pc], self.hits[pc], self.taken[pc], self.mmio[pc]
+            if op in _ALU:
+                c["alu"] += hit
+            elif op in _BRANCH:
+                c["jmp"] += tk
+                c["br"] += hit - tk
+            elif op == "j":
+                c["jmp"] += hit
+            elif op in ("lw", "sw", "lbu"):
+                c[op] += hit - mm
+                c["mmio_" + op] += mm
+        return +c
+
+    def bus_ops(self, start: int = 0, stop: Optional[int] = None) -> Counter:
+        """Data bus transactions in [start, stop): npu accesses, and d_cache accesses with misaligned words counted twice."""
+        stop = len(self.ops) if stop is None else stop
+        c = Counter()
+        for pc in range(start, stop):
+            if self.ops[pc] in ("lw", "sw", "lbu"):
+                c["npu"] += self.mmio[pc]
+                c["dcache"] += self.hits[pc] - self.mmio[pc] + self.split[pc]
+        return c
+
+    def layer_counts(self) -> Dict[str, Counter]:
+        """op_counts() split at the LAYER_LABELS boundaries, the same split perf_model.py uses."""
+        bounds = [0] + [self.labels[lab] for lab in LAYER_LABELS.values()]
+        return {name: self.op_counts(a, b) for name, a, b in zip(LAYER_LABELS, bounds, bounds[1:])}
+
+
+def dcache_image(image: np.ndarray, weights: np.ndarray) -> SramImage:
+    """d_cache contents before the program runs: image at 0, packed weights at WEIGHT_BASE."""
+    sram = SramImage()
+    image = np.asarray(image).ravel()
+    weights = np.asarray(weights).ravel()
+    sram.alloc("image", image.shape, base=0)
+    sram.alloc("weights", weights.shape, base=WEIGHT_BASE)
+    sram.write("image", image)
+    sram.write("weights", weights)
+    end = -(-(WEIGHT_BASE + weights.size) // 4) * 4  # $readmemh initializes whole words
+    sram.valid[:end] = True
+    return sram
+
+
+def run_inference(image: np.ndarray, weights: np.ndarray, asm: str, record: bool = False) -> Tuple[Bus, Host]:
+    bus = Bus(dcache_image(image, weights), Npu(), record)
+    host = Host(asm, bus)
+    host.run()
+    return bus, host
+
+
+def replay(trace: List[Tuple[int, int, int]], npu: Optional[Npu] = None) -> Tuple[Npu, int]:
+    """Feed a recorded npu transaction trace into a fresh Npu; returns it and the number of read mismatches."""
+    npu = npu or Npu()
+    bad = 0
+    for is_write, addr, data in trace:
+        if is_write:
+            npu.write(addr, data)
+        elif npu.read(addr) != data:
+            bad += 1
+    return npu, bad
+
+
+def serve(stream, out=None, idle: int = 2):
+    """Speak the rtl_4pe/npu_stream_tb.sv line protocol on a stream file or pipe, with an Npu as the design."""
+    out = out or sys.stdout
+    npu, ops, start = Npu(), 0, 0
+    with open(stream, "r") as f:
+        for line in f:
+            cmd, addr, data = line[0], int(line[2:6], 16), int(line[7:15], 16)
+            if cmd == "Q":
+                break
+            if cmd == "X":
+                npu.reset()
+            elif cmd == "F":
+                start = ops
+            elif cmd == "W":
+                npu.write(addr, data)
+                ops += 1
+            elif cmd == "R":
+                out.write(f"R {npu.read(addr):08x}\n")
+                ops += 1
+            elif cmd == "E":
+                out.write(f"E {data} {(ops - start) * (2 + idle)}\n")  # cycles as the TB spends them
+                out.flush()
+            else:
+                out.write(f"npu_emu: bad command {cmd}\n")
+    out.flush()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run write_npu.S against the transaction-level npu emulator")
+    ap.add_argument("-i", "--input", type=Path, default=DATA_DIR / "input_32bit.hex", help="image hex, 60 words per frame")
+    ap.add_argument("-w", "--weights", type=Path, default=DATA_DIR / "weights.hex", help="packed weights (weight_placement.py)")
+    ap.add_argument("--asm", type=Path, default=DATA_DIR.parent / "write_npu.S")
+    ap.add_argument("--count", type=int, default=1, help="frames to run")
+    ap.add_argument("--dump", type=Path, default=None, help="write the final d_cache of the last frame as hex32")
+    ap.add_argument("--compare", type=Path, default=None, help="diff the d_cache of the first frame against a dump")
+    ap.add_argument("--no-golden", action="store_true", help="skip the golden model check")
+    ap.add_argument("--backend", default=None, help="golden model backend, numpy or torch (default: $NPU_BACKEND or numpy)")
+    ap.add_argument("--stream", type=Path, default=None,
+                    help="act as rtl_4pe/npu_stream_tb.sv on this stream file or pipe (for cosim.py) instead")
+    ap.add_argument("--idle", type=int, default=2, help="with --stream: idle cycles per transaction")
+    args = ap.parse_args()
+    if args.stream is not None:
+        serve(args.stream, idle=args.idle)
+        return
+
+    asm = args.asm.read_text()
+    frames = decode_hex32(args.input.read_text())
+    frames = frames[: frames.size // 240 * 240].reshape(-1, 240)[: args.count]
+    weights = decode_hex32(args.weights.read_text())
+
+    failed = 0
+    for n, img in enumerate(frames):
+        t = time.perf_counter()
+        bus, host = run_inference(img, weights, asm, record=True)
+        dt = time.perf_counter() - t
+        c = host.op_counts()
+        mmio = c["mmio_lw"] + c["mmio_sw"]
+        print(f"frame {n}: {sum(host.hits)} instructions, {mmio} npu ops, {c['lw'] + c['sw'] + c['lbu']} d_cache ops "
+              f"({host.bus_ops()['dcache']} bus transactions) in {dt * 1e3:.1f} ms; fc2 = {bus.mem[4700]}")
+        if "conv2_relu" in host.labels:  # write_npu.S only; gen_driver.py programs have no perf_model layout
+            relu = host.labels["conv2_relu"] + 1  # beqz taken for conv2 sums >= 0
+            predicted = {st.name: +st.ops for st in perf_model.model(conv2_positive=host.taken[relu] / max(1, host.hits[relu]))}
+            off = [name for name, cnt in host.layer_counts().items() if cnt != predicted[name]]
+            print(f"  perf_model.py: {'same instruction mix' if not off else 'differs in ' + ', '.join(off)}")
+        t = time.perf_counter()
+        _, bad = replay(bus.trace)
+        dt = time.perf_counter() - t
+        print(f"  replayed {len(bus.trace)} npu transactions in {dt * 1e3:.1f} ms "
+              f"({len(bus.trace) / dt / 1e6:.2f} M ops/s), {bad} read mismatches")
+
+        data, valid = bus.sram.data, bus.sram.valid
+        if not args.no_golden:
+            from backend import get_backend
+            from cal_result import res_hex_lines
+            from check import compare, format_mismatch
+            B = get_backend(args.backend)
+            layers = {k: B.to_numpy(v) for k, v in B.load_model().forward_layers(B.from_numpy(img.reshape(1, 1, 16, 15))).items()}
+            golden = decode_hex32("\n".join(res_hex_lines(layers["conv1"][0], layers["conv2_acc"][0],
+                                                          layers["fc1"][0], layers["fc2"][0])), dont_care=True)
+            mism = compare(golden, (data, valid))
+            failed += bool(mism)
+            print(f"  golden: {'all right' if not mism else f'{len(mism)} mismatching words'}")
+            for m in mism[:10]:
+                print("    " + format_mismatch(m))
+        if args.compare is not None and n == 0:
+            ref, ref_valid = decode_hex32(args.compare.read_text(), dont_care=True)
+            size = min(ref.size, data.size)
+            diff = ref_valid[:size] & (~valid[:size] | (ref[:size] != data[:size]))
+            words = np.unique(np.flatnonzero(diff) // 4)
+            print(f"  {args.compare}: {words.size} differing words" + (f", first at line {words[0]}" if words.size else ""))
+        if args.dump is not None:
+            bus.sram.write_hex32(args.dump)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
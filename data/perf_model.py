@@ -0,0 +1,256 @@
+"""
+Cycle-approximate performance model of the NPU and its host driver.
+
+Counts, per layer, the instructions write_npu.S executes (ALU, branches,
+d_cache loads/stores, MMIO loads/stores to the npu port), the triggers the
+npu FSM sees, PE-busy cycles and the cycles the host would have to wait for
+a result, all from the network shape and the number of fc PEs. The
+per-iteration instruction mixes below are taken from the loop bodies of
+write_npu.S; trip counts follow the layer shapes. Layers are split at the
+write_npu.S labels conv1_chan_done, conv2_chan_done, fcn1_done and stop.
+The conv2 relu branch depends on the data; --conv2-positive sets the
+fraction of conv2 sums that skip the zeroing.
+
+fc layers follow rtl_4pe/_npu.sv: in S_FCN one 32-bit fcn_in write carries
+one input byte and one weight byte per PE, so a pass computes
+min(NUM_PE, bus_bytes - 1) neurons; remaining neurons run in S_FCN_LAST,
+where the PEs split the inputs of one neuron, min(NUM_PE, bus_bytes // 2)
+per write, and pe_sum adds them up.
+
+Usage:
+  python perf_model.py
+  python perf_model.py --num-pe 4 --img 32 30 --clock-mhz 100 --cost mmio_sw=6
+"""
+
+from __future__ import annotations
+import argparse
+import json
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List
+
+# instruction classes counted by the model
+OP_CLASSES = ("alu", "br", "jmp", "lw", "sw", "mmio_lw", "mmio_sw")
+
+
+def ops(n: int = 1, **kw) -> Counter:
+    """Instruction mix of one loop body, repeated n times."""
+    return Counter({k: v * n for k, v in kw.items()})
+
+
+@dataclass
+class Shape:
+    img_h: int = 16
+    img_w: int = 15
+    k: int = 3
+    conv1_out: int = 10
+    fc1_out: int = 10
+    fc2_out: int = 1
+
+    @property
+    def conv1_hw(self):
+        return self.img_h - self.k + 1, self.img_w - self.k + 1
+
+    @property
+    def conv2_hw(self):
+        h, w = self.conv1_hw
+        return h - self.k + 1, w - self.k + 1
+
+    @property
+    def fc1_in(self) -> int:
+        h, w = self.conv2_hw
+        return h * w
+
+
+@dataclass
+class CostModel:
+    # cycles per instruction class on cv32e40p behind the AXI crossbar
+    alu: int = 1
+    br: int = 1        # conditional branch, not taken
+    jmp: int = 3       # taken branch / jump
+    lw: int = 4        # d_cache SRAM load
+    sw: int = 3
+    mmio_lw: int = 4   # npu port read
+    mmio_sw: int = 3
+    npu_latency: int = 4  # trigger write -> result readable (host_trigger, pe_ready, conv_out, result_reg)
+
+    def cycles(self, c: Counter) -> int:
+        return sum(getattr(self, k) * c.get(k, 0) for k in OP_CLASSES)
+
+
+@dataclass
+class LayerStats:
+    name: str
+    ops: Counter = field(default_factory=Counter)
+    triggers: int = 0
+    pe_busy: int = 0      # PE-cycles doing MACs
+    macs: int = 0
+    reads: int = 0        # result reads following a trigger
+    read_gap: int = 0     # host cycles between the last trigger and a read
+    stall: int = 0
+    cycles: int = 0
+
+    def to_dict(self) -> Dict:
+        d = asdict(self)
+        d["ops"] = {k: self.ops.get(k, 0) for k in OP_CLASSES}
+        d["mmio"] = self.ops["mmio_lw"] + self.ops["mmio_sw"]
+        return d
+
+
+# loop bodies shared by the layers
+W_LOAD = ops(br=1, lw=1, mmio_sw=1, alu=2, jmp=1)                   # one conv weight word
+COL_LOAD = ops(br=1, alu=12, lw=3, mmio_sw=1, jmp=1)                # 3 pixels of a column -> in_img
+FC_FULL_IN = ops(br=1, alu=10, lw=2, mmio_sw=2, jmp=1)              # one input x NUM_PE weights + trigger
+FC_LAST_IN = ops(br=1, alu=14, lw=3, mmio_sw=2, jmp=1)              # two inputs x two weights + trigger
+
+
+def conv1_stats(s: Shape, cost: CostModel) -> LayerStats:
+    st = LayerStats("conv1")
+    h1, w1 = s.conv1_hw
+    reads_per_row = w1 // 4
+    c = ops(alu=11) + ops(s.conv1_out, br=1, alu=5, mmio_sw=1) + ops(jmp=1)
+    c += ops(s.conv1_out * s.k, **W_LOAD) + ops(s.conv1_out, jmp=1)
+    rows = s.conv1_out * h1
+    c += ops(rows, br=1, alu=5, mmio_sw=2) + ops(s.conv1_out, jmp=1)
+    c += ops(rows * (s.k - 1), **COL_LOAD) + ops(rows, jmp=1)
+    c += ops(rows, alu=4, mmio_sw=1)
+    c += ops(rows * w1, br=1, alu=15, lw=3, mmio_sw=2)
+    c += ops(rows * (w1 - reads_per_row), br=1, jmp=1)
+    c += ops(rows * reads_per_row, jmp=1) + ops(rows * reads_per_row, alu=5, mmio_lw=1, sw=1, mmio_sw=1, jmp=1)
+    c += ops(rows, jmp=1) + ops(rows, alu=3, mmio_lw=1, sw=1, jmp=1)
+    c += ops(s.conv1_out, alu=1, jmp=1)
+    st.ops = c
+    st.triggers = rows * w1
+    st.macs = st.triggers * s.k * s.k
+    st.pe_busy = st.triggers  # one k x k window per cycle in conv_unit
+    st.reads = rows * (reads_per_row + 1)
+    st.read_gap = cost.alu + cost.jmp + cost.alu  # addi, beqz (taken), lui
+    return st
+
+
+def conv2_stats(s: Shape, cost: CostModel, positive: float = 0.5) -> LayerStats:
+    st = LayerStats("conv2")
+    h2, w2 = s.conv2_hw
+    cin = s.conv1_out
+    c = ops(alu=5, mmio_sw=1)                                   # next_state, conv1 result base
+    c += ops(cin, br=1, alu=6, mmio_sw=1) + ops(jmp=1)
+    c += ops(cin * s.k, **W_LOAD) + ops(cin, jmp=1) + ops(cin, alu=1)
+    rows = cin * h2
+    c += ops(rows, br=1, alu=3, mmio_sw=1) + ops(cin, jmp=1)
+    c += ops(rows * (s.k - 1), **COL_LOAD) + ops(rows, jmp=1) + ops(rows, alu=1)
+    outs = rows * w2
+    per_chan = h2 * w2
+    c += ops(outs, br=1, alu=16, lw=3, mmio_sw=2, mmio_lw=1)
+    c += ops(per_chan, jmp=1)                                   # first channel: store only
+    c += ops(per_chan * (cin - 1), br=1, lw=1, alu=2)           # later channels: add previous sum
+    c += ops(per_chan * (cin - 2), br=1)                        # not the last channel
+    pos = round(per_chan * positive)
+    c += ops(per_chan, jmp=1, alu=1)                            # last channel: relu
+    c += ops(pos, jmp=1) + ops(per_chan - pos, br=1, alu=1)     # negative sums are zeroed with a lui
+    c += ops(outs, sw=1, alu=1, jmp=1)
+    c += ops(rows, jmp=1) + ops(rows, alu=1, jmp=1) + ops(cin, alu=2, jmp=1)
+    st.ops = c
+    st.triggers = outs
+    st.macs = outs * s.k * s.k
+    st.pe_busy = outs
+    st.reads = outs
+    st.read_gap = cost.alu  # lui right after the trigger
+    return st
+
+
+def fc_stats(name: str, n_in: int, n_out: int, num_pe: int, bus_bytes: int, cost: CostModel,
+             setup: Counter, enter_last: Counter, tail: Counter) -> LayerStats:
+    """setup runs once, enter_last before and tail after each neuron computed in S_FCN_LAST."""
+    st = LayerStats(name)
+    lanes = max(1, min(num_pe, bus_bytes - 1))
+    lanes_last = max(1, min(num_pe, bus_bytes // 2))
+    passes, rest = divmod(n_out, lanes)
+    last_iters = -(-n_in // lanes_last)
+
+    c = setup.copy()
+    if passes:
+        c += ops(passes, br=1, alu=4) + ops(jmp=1)
+        c += ops(passes * n_in, **FC_FULL_IN) + ops(passes, jmp=1)
+        c += ops(passes, alu=5, mmio_lw=1, sw=1, mmio_sw=1, jmp=1)
+    for _ in range(rest):
+        c += enter_last
+        c += ops(last_iters, **FC_LAST_IN) + ops(jmp=1)
+        c += tail
+    st.ops = c
+    st.triggers = passes * n_in + rest * last_iters
+    st.macs = n_in * n_out
+    st.pe_busy = st.triggers * num_pe  # every PE is clocked with pe_ready on a trigger
+    st.reads = passes + rest
+    st.read_gap = cost.alu + cost.jmp + cost.jmp + cost.alu  # addi, j, beqz (taken), lui
+    return st
+
+
+def model(shape: Shape = Shape(), num_pe: int = 3, cost: CostModel = CostModel(), bus_bytes: int = 4,
+          conv2_positive: float = 0.5) -> List[LayerStats]:
+    layers = [
+        conv1_stats(shape, cost),
+        conv2_stats(shape, cost, conv2_positive),
+        # fc1: next_state + pe clear + bases; S_FCN_LAST entered with a next_state write
+        fc_stats("fc1", shape.fc1_in, shape.fc1_out, num_pe, bus_bytes, cost,
+                 ops(alu=11, mmio_sw=2), ops(alu=6, mmio_sw=1), ops(alu=2, mmio_lw=1, sw=1)),
+        # fc2 stays in S_FCN_LAST; its setup is the pe clear after fc1
+        fc_stats("fc2", shape.fc1_out, shape.fc2_out, num_pe, bus_bytes, cost,
+                 ops(alu=4, mmio_sw=1), ops(), ops(alu=5, mmio_lw=1, sw=1)),
+    ]
+    for st in layers:
+        st.stall = st.reads * max(0, cost.npu_latency - st.read_gap)
+        st.cycles = cost.cycles(st.ops) + st.stall
+    return layers
+
+
+def summary(layers: List[LayerStats], num_pe: int, k: int, clock_mhz: float) -> Dict:
+    cycles = sum(st.cycles for st in layers)
+    conv_busy = sum(st.pe_busy for st in layers if st.name.startswith("conv"))
+    fc_busy = sum(st.pe_busy for st in layers if st.name.startswith("fc"))
+    macs = sum(st.macs for st in layers)
+    mac_units = k * k + num_pe
+    return {
+        "cycles": cycles,
+        "inferences_per_s": clock_mhz * 1e6 / cycles if cycles else 0.0,
+        "mmio": sum(st.ops["mmio_lw"] + st.ops["mmio_sw"] for st in layers),
+        "conv_unit_util": conv_busy / cycles if cycles else 0.0,
+        "fc_pe_util": fc_busy / (cycles * num_pe) if cycles else 0.0,
+        "mac_util": macs / (cycles * mac_units) if cycles else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Predict cycles per inference of the NPU + write_npu.S host loop")
+    ap.add_argument("--num-pe", type=int, default=3, help="fc PEs (NUM_PE)")
+    ap.add_argument("--img", type=int, nargs=2, default=(16, 15), metavar=("H", "W"))
+    ap.add_argument("--conv1-out", type=int, default=10)
+    ap.add_argument("--fc1-out", type=int, default=10)
+    ap.add_argument("--bus-bytes", type=int, default=4)
+    ap.add_argument("--clock-mhz", type=float, default=50.0)
+    ap.add_argument("--conv2-positive", type=float, default=0.5, help="fraction of conv2 sums that are >= 0")
+    ap.add_argument("--cost", nargs="*", default=[], metavar="CLASS=CYCLES", help="override CostModel fields")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    cost = CostModel(**{k: int(v) for k, v in (kv.split("=") for kv in args.cost)})
+    shape = Shape(img_h=args.img[0], img_w=args.img[1], conv1_out=args.conv1_out, fc1_out=args.fc1_out)
+    layers = model(shape, args.num_pe, cost, args.bus_bytes, args.conv2_positive)
+    total = summary(layers, args.num_pe, shape.k, args.clock_mhz)
+
+    if args.json:
+        print(json.dumps({"layers": [st.to_dict() for st in layers], "total": total}, indent=2))
+        return
+    print(f"{'layer':6} {'instr':>8} {'mmio':>7} {'d$ ld/st':>10} {'trig':>6} {'pe busy':>8} {'stall':>6} {'cycles':>8}")
+    for st in layers:
+        instr = sum(st.ops.values())
+        mmio = st.ops["mmio_lw"] + st.ops["mmio_sw"]
+        print(f"{st.name:6} {instr:8d} {mmio:7d} {st.ops['lw']:5d}/{st.ops['sw']:<4d} {st.triggers:6d} "
+              f"{st.pe_busy:8d} {st.stall:6d} {st.cycles:8d}")
+    print(f"cycles/inference: {total['cycles']}  ({total['inferences_per_s']:.1f} inf/s at {args.clock_mhz} MHz)")
+    print(f"MMIO transactions: {total['mmio']}")
+    print(f"conv unit util: {total['conv_unit_util']:.1%}  fc PE util: {total['fc_pe_util']:.1%}  "
+          f"MAC util: {total['mac_util']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+NumPy implementation of the golden model, bit-exact with the torch one in
+network_structure.py and without importing torch. Function names, arguments
+and results mirror network_structure.py, with np.ndarray in place of
+torch.Tensor; backend.py switches between the two.
+
+Products are uint8 x int8 and sums stay far below 2**53, so contractions run
+as float64 BLAS products and are converted back exactly; the int64 -> int32
+cast keeps torch's int32 wrap-around for (unrealistically) huge layers.
+"""
+
+import collections
+import functools
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from weights_io import load_weights
+
+def _i32(acc):
+    # exact float64 sums -> int32 with the same wrap-around as torch int32 arithmetic
+    return np.rint(acc).astype(np.int64).astype(np.int32)
+
+def quantize_int8(a, is_weight=False):
+    if is_weight:
+        return np.clip(np.round(a), -128, 127).astype(np.int8)
+    else:
+        return np.clip(np.round(a), 0, 255).astype(np.uint8)
+
+def mac_24bit(input_patch, weight, bias=None):
+    return acc_to_u8(_mac_acc(input_patch, weight, bias))
+
+def mac_24bit_no_relu(input_patch, weight, bias=None):
+    return np.clip(_mac_acc(input_patch, weight, bias), 0, 2**23-1)
+
+def _mac_acc(input_patch, weight, bias=None):
+    acc = np.sum(input_patch.astype(np.int32) * weight.astype(np.int32), axis=(1, 2, 3), dtype=np.int32)
+    if bias is not None:
+        acc = acc + np.int32(bias)
+    return acc
+
+def acc_to_u8(acc):
+    acc = np.clip(acc, 0, 2**23-1) # relu
+    return (acc & 0xFF).astype(np.uint8) # cut to uint8
+
+def conv2d_acc(x, weight, bias=None, stride=1):
+    N, Cin, H, W = x.shape
+    Cout, _, Kh, Kw = weight.shape
+    Hout = (H - Kh) // stride + 1
+    Wout = (W - Kw) // stride + 1
+    win = sliding_window_view(x, (Kh, Kw), axis=(2, 3))[:, :, :Hout, :Wout]
+    patches = win.transpose(0, 2, 3, 1, 4, 5).reshape(-1, Cin * Kh * Kw).astype(np.float64)
+    acc = _i32(patches @ weight.reshape(Cout, -1).T.astype(np.float64))
+    acc = acc.reshape(N, Hout, Wout, Cout).transpose(0, 3, 1, 2)
+    if bias is not None:
+        acc = acc + bias.astype(np.int32).reshape(1, Cout, 1, 1)
+    return acc # raw int32 accumulators, (N, Cout, Hout, Wout)
+
+def conv3d_acc(x, weight, bias=None, stride=1):
+    N, Cin, H, W = x.shape  # 3D input
+    _, Kd, Kh, Kw = weight.shape  # 3D filter
+    Cout = (Cin - Kd) // stride + 1
+    Hout = (H - Kh) // stride + 1
+    Wout = (W - Kw) // stride + 1
+    win = sliding_window_view(x, (Kd, Kh, Kw), axis=(1, 2, 3))[:, :Cout, :Hout, :Wout]
+    # output depth co uses weight[co], as in network_structure.conv3d_acc
+    acc = _i32(np.einsum('ncijdhw,cdhw->ncij', win.astype(np.float64), weight[:Cout].astype(np.float64)))
+    if bias is not None:
+        acc = acc + bias[:Cout].astype(np.int32).reshape(1, Cout, 1, 1)
+    return acc # raw int32 accumulators, (N, Cout, Hout, Wout)
+
+def quantized_conv2d(x, weight, bias, stride=1):
+    return acc_to_u8(conv2d_acc(x, weight, bias, stride))
+
+def quantized_conv3d(x, weight, bias, stride=1):
+    return acc_to_u8(conv3d_acc(x, weight, bias, stride))
+
+def quantized_conv3d_debug(x, weight, bias, stride=1):
+    acc = np.clip(conv3d_acc(x, weight, bias, stride), 0, 2**23-1)
+    return acc.astype(np.uint32)
+
+# Fused conv1 -> conv2 with two Kh-row line buffers, see network_structure.stream_conv1_conv2
+def stream_conv1_conv2(rows, w1, b1, w2, b2):
+    in_buf = collections.deque(maxlen=w1.shape[2])
+    c1_buf = collections.deque(maxlen=w2.shape[2])
+    for row in rows:
+        in_buf.append(row)
+        if len(in_buf) < in_buf.maxlen:
+            continue
+        c1_buf.append(quantized_conv2d(np.stack(in_buf, 2), w1, b1)[:, :, 0])
+        if len(c1_buf) == c1_buf.maxlen:
+            yield conv3d_acc(np.stack(c1_buf, 2), w2, b2)[:, :, 0]
+
+def fused_conv1_conv2_acc(x, w1, b1, w2, b2):
+    return np.stack(list(stream_conv1_conv2(np.moveaxis(x, 2, 0), w1, b1, w2, b2)), 2)
+
+def linear_acc(x, weight, bias=None):
+    acc = _i32(x.astype(np.float64) @ weight.T.astype(np.float64))  # (N, In) x (In, Out)
+    if bias is not None:
+        acc = acc + bias.astype(np.int32)
+    return acc # raw int32 accumulators, (N, Out)
+
+def quantized_linear(x, weight, bias):
+    return acc_to_u8(linear_acc(x, weight, bias))
+
+def quantized_linear_debug(x, weight, bias):
+    acc = np.clip(linear_acc(x, weight, bias), 0, 2**23-1)
+    return acc.astype(np.uint32)
+
+class QuantizedCNN:
+    profiler = None  # layer_profile.Profiler; None keeps the plain path
+
+    def __init__(self, q_conv1_w, q_conv1_b, q_conv2_w, q_conv2_b, q_fc1_w, q_fc1_b, q_fc2_w, q_fc2_b):
+        self.q_conv1_w = q_conv1_w
+        self.q_conv1_b = q_conv1_b
+        self.q_conv2_w = q_conv2_w
+        self.q_conv2_b = q_conv2_b
+        self.q_fc1_w = q_fc1_w
+        self.q_fc1_b = q_fc1_b
+        self.q_fc2_w = q_fc2_w
+        self.q_fc2_b = q_fc2_b
+
+    def __call__(self, x, fused=False):
+        return self.forward(x, fused)
+
+    def forward(self, x, fused=False):
+        if fused:
+            return self.forward_fused(x)
+        if self.profiler is not None:
+            return self.profiler.forward_layers(self, x)["fc2"]
+        x = quantized_conv2d(x, self.q_conv1_w, self.q_conv1_b)
+        x = quantized_conv3d(x, self.q_conv2_w, self.q_conv2_b)
+        x = x.reshape(x.shape[0], -1)  # Flatten for fully connected layers
+        x = quantized_linear(x, self.q_fc1_w, self.q_fc1_b)
+        return quantized_linear(x, self.q_fc2_w, self.q_fc2_b)
+
+    def forward_layers(self, x, trace=False):
+        if self.profiler is not None:
+            return self.profiler.forward_layers(self, x, trace)
+        conv1_pre = conv2d_acc(x, self.q_conv1_w, self.q_conv1_b)
+        conv1 = acc_to_u8(conv1_pre)
+        conv2_pre = conv3d_acc(conv1, self.q_conv2_w, self.q_conv2_b)
+        acc = np.clip(conv2_pre, 0, 2**23-1)
+        conv2 = acc_to_u8(acc)
+        fc1_pre = linear_acc(conv2.reshape(conv2.shape[0], -1), self.q_fc1_w, self.q_fc1_b)
+        fc1 = acc_to_u8(fc1_pre)
+        fc2_pre = linear_acc(fc1, self.q_fc2_w, self.q_fc2_b)
+        fc2 = acc_to_u8(fc2_pre)
+        layers = {"conv1": conv1, "conv2_acc": acc.astype(np.uint32), "conv2": conv2,
+                  "fc1": fc1, "fc2": fc2}
+        if trace:  # raw int32 accumulators, before relu / clamp / & 0xFF
+            layers.update(conv1_pre=conv1_pre, conv2_pre=conv2_pre, fc1_pre=fc1_pre, fc2_pre=fc2_pre)
+        return layers
+
+    def conv2_rows(self, rows):
+        for acc in stream_conv1_conv2(rows, self.q_conv1_w, self.q_conv1_b, self.q_conv2_w, self.q_conv2_b):
+            yield acc_to_u8(acc)
+
+    def forward_fused(self, x):
+        x = np.stack(list(self.conv2_rows(np.moveaxis(x, 2, 0))), 2)
+        x = quantized_linear(x.reshape(x.shape[0], -1), self.q_fc1_w, self.q_fc1_b)
+        return quantized_linear(x, self.q_fc2_w, self.q_fc2_b)
+
+@functools.lru_cache(maxsize=None)
+def load_model(weight_dir=None, cache=True):
+    w = load_weights(weight_dir, cache)
+    return QuantizedCNN(w["conv1_weight"], w["conv1_bias"], w["conv2_weight"], w["conv2_bias"],
+                        w["fc1_weight"], w["fc1_bias"], w["fc2_weight"], w["fc2_bias"])
+
+# Backend interface shared with network_structure.py (see backend.py)
+def from_numpy(a):
+    return np.asarray(a)
+
+def to_numpy(a):
+    return np.asarray(a)
@@ -0,0 +1,212 @@
+"""
+Zero-weight skipping golden model and weight sparsity report.
+
+SparseCNN precomputes, for every output channel / neuron, the indices and
+values of its nonzero weights and computes each accumulator from those
+only, so no MAC with a zero weight is executed. It wraps a quant_np model
+and its forward_layers() is bit-exact with the dense one (the CLI checks
+this on the given images).
+
+The report says per layer what zero skipping would save:
+  macs    MACs per image, dense vs. with zero-weight MACs skipped
+  loads   host writes of the weight block as weight_placement.py packs it
+          (one kernel column per conv write; one input for `lanes` neurons
+          per S_FCN write; `lanes_last` inputs per S_FCN_LAST write)
+  skip    of those, writes whose weight bytes are all zero, i.e. what a
+          zero-skipping PE (or a host that skips them) saves
+  stream  bus words of a compressed weight stream: a 1-bit nonzero mask per
+          weight followed by the nonzero bytes, what sparse weight loading
+          would move instead of the dense block
+
+Usage:
+  python sparse_model.py
+  python sparse_model.py -i input_all.hex --num-pe 4 --json sparsity.json
+"""
+
+from __future__ import annotations
+import argparse
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import quant_np as Q
+from weight_placement import Block, fc_lanes, place
+from weights_io import DATA_DIR, load_weights
+
+
+class SparseRows:
+    """Nonzero (index, value) lists of each row of a (rows, K) weight matrix."""
+
+    def __init__(self, w: np.ndarray):
+        w = np.asarray(w).reshape(w.shape[0], -1)
+        self.k = w.shape[1]
+        self.idx = [np.flatnonzero(row) for row in w]
+        self.val = [row[i].astype(np.int64) for row, i in zip(w, self.idx)]
+
+    @property
+    def nnz(self) -> np.ndarray:
+        return np.array([i.size for i in self.idx])
+
+    def apply(self, p: np.ndarray, row: Optional[int] = None) -> np.ndarray:
+        """(M, K) patches -> (M, rows) int32 accumulators, or (M,) for a single row."""
+        rows = range(len(self.idx)) if row is None else (row,)
+        acc = np.zeros((p.shape[0], len(rows)), dtype=np.int64)
+        for j, r in enumerate(rows):
+            if self.idx[r].size:
+                acc[:, j] = p[:, self.idx[r]].astype(np.int64) @ self.val[r]
+        acc = acc.astype(np.int32)  # int32 wrap-around, as Q._i32
+        return acc if row is None else acc[:, 0]
+
+
+class SparseCNN:
+    def __init__(self, model: Q.QuantizedCNN):
+        self.m = model
+        self.conv1 = SparseRows(model.q_conv1_w)
+        self.conv2 = SparseRows(model.q_conv2_w)  # one row per output depth of the conv3d
+        self.fc1 = SparseRows(model.q_fc1_w)
+        self.fc2 = SparseRows(model.q_fc2_w)
+
+    def conv2d_acc(self, x: np.ndarray) -> np.ndarray:
+        n, cin, h, w = x.shape
+        cout, _, kh, kw = self.m.q_conv1_w.shape
+        ho, wo = h - kh + 1, w - kw + 1
+        win = sliding_window_view(x, (kh, kw), axis=(2, 3))
+        patches = win.transpose(0, 2, 3, 1, 4, 5).reshape(-1, cin * kh * kw)
+        acc = self.conv1.apply(patches).reshape(n, ho, wo, cout).transpose(0, 3, 1, 2)
+        return acc + self.m.q_conv1_b.astype(np.int32).reshape(1, cout, 1, 1)
+
+    def conv3d_acc(self, x: np.ndarray) -> np.ndarray:
+        n, cin, h, w = x.shape
+        _, kd, kh, kw = self.m.q_conv2_w.shape
+        cout, ho, wo = cin - kd + 1, h - kh + 1, w - kw + 1
+        win = sliding_window_view(x, (kd, kh, kw), axis=(1, 2, 3))[:, :cout]
+        acc = np.stack([self.conv2.apply(win[:, co].reshape(-1, kd * kh * kw), co).reshape(n, ho, wo)
+                        for co in range(cout)], 1)
+        return acc + self.m.q_conv2_b[:cout].astype(np.int32).reshape(1, cout, 1, 1)
+
+    def forward_layers(self, x: np.ndarray, trace: bool = False) -> Dict[str, np.ndarray]:
+        """Same result as QuantizedCNN.forward_layers, computed from the nonzero weights only."""
+        conv1_pre = self.conv2d_acc(x)
+        conv1 = Q.acc_to_u8(conv1_pre)
+        conv2_pre = self.conv3d_acc(conv1)
+        acc = np.clip(conv2_pre, 0, 2**23-1)
+        conv2 = Q.acc_to_u8(acc)
+        fc1_pre = self.fc1.apply(conv2.reshape(conv2.shape[0], -1)) + self.m.q_fc1_b.astype(np.int32)
+        fc1 = Q.acc_to_u8(fc1_pre)
+        fc2_pre = self.fc2.apply(fc1) + self.m.q_fc2_b.astype(np.int32)
+        fc2 = Q.acc_to_u8(fc2_pre)
+        layers = {"conv1": conv1, "conv2_acc": acc.astype(np.uint32), "conv2": conv2, "fc1": fc1, "fc2": fc2}
+        if trace:
+            layers.update(conv1_pre=conv1_pre, conv2_pre=conv2_pre, fc1_pre=fc1_pre, fc2_pre=fc2_pre)
+        return layers
+
+    def forward(self, x: np.ndarray) -> np.ndarray:
+        return self.forward_layers(x)["fc2"]
+
+    def macs(self, img_hw: Tuple[int, int] = (16, 15)) -> Dict[str, Tuple[int, int]]:
+        """(dense, nonzero) MACs per image of each layer."""
+        kh, kw = self.m.q_conv1_w.shape[2:]
+        h1, w1 = img_hw[0] - kh + 1, img_hw[1] - kw + 1
+        kh, kw = self.m.q_conv2_w.shape[2:]
+        h2, w2 = h1 - kh + 1, w1 - kw + 1
+        out = {}
+        for name, rows, positions in (("conv1", self.conv1, h1 * w1), ("conv2", self.conv2, h2 * w2),
+                                      ("fc1", self.fc1, 1), ("fc2", self.fc2, 1)):
+            if name == "conv2":  # conv3d: only the output depths the input channels produce
+                nnz = rows.nnz[:self.m.q_conv1_w.shape[0] - self.m.q_conv2_w.shape[1] + 1]
+            else:
+                nnz = rows.nnz
+            out[name] = (nnz.size * rows.k * positions, int(nnz.sum()) * positions)
+        return out
+
+
+@dataclass
+class BlockSparsity:
+    name: str
+    weights: int
+    zeros: int
+    loads: int
+    skip: int
+    stream: int
+
+
+def block_writes(b: Block, lanes_last: int) -> np.ndarray:
+    """(loads, bytes per write) weight bytes of each host write of a packed block."""
+    if b.name.endswith(".last"):
+        return b.data.reshape(-1, lanes_last)   # lanes_last inputs of one neuron
+    return b.data.reshape(-1, b.shape[-1])      # conv: one kernel column; fc .full: one input, lanes neurons
+
+
+def block_sparsity(b: Block, lanes_last: int, bus_bytes: int) -> BlockSparsity:
+    writes = block_writes(b, lanes_last)
+    if writes.shape[0] != b.loads:
+        raise ValueError(f"{b.name}: {writes.shape[0]} writes, weight_placement counts {b.loads}")
+    nnz = int(np.count_nonzero(b.data))
+    stream = -(-(-(-b.data.size // 8) + nnz) // bus_bytes)  # mask bytes + nonzero bytes, in bus words
+    return BlockSparsity(b.name, int(b.data.size), int(b.data.size) - nnz, b.loads,
+                         int(np.count_nonzero(~writes.any(axis=1))), stream)
+
+
+def report(weights: Dict[str, np.ndarray], num_pe: int = 3, bus_bytes: int = 4,
+           img_hw: Tuple[int, int] = (16, 15)) -> Dict:
+    model = Q.QuantizedCNN(*(weights[f"{n}_{k}"] for n in ("conv1", "conv2", "fc1", "fc2") for k in ("weight", "bias")))
+    sparse = SparseCNN(model)
+    _, blocks, _ = place(weights, img_hw, num_pe, bus_bytes)
+    lanes_last = fc_lanes(num_pe, bus_bytes)[1]
+    layers = []
+    for name, (dense, nz) in sparse.macs(img_hw).items():
+        bs = [block_sparsity(b, lanes_last, bus_bytes) for b in blocks if b.name.split(".")[0] == name]
+        layers.append({"layer": name, "macs": dense, "macs_nonzero": nz, "mac_saving": 1 - nz / dense if dense else 0.0,
+                       "blocks": [asdict(s) for s in bs]})
+    return {"num_pe": num_pe, "bus_bytes": bus_bytes, "layers": layers}
+
+
+def main():
+    from batch_run import iter_chunks, iter_images
+
+    ap = argparse.ArgumentParser(description="Zero-weight skipping model: bit-exactness check and sparsity report")
+    ap.add_argument("-i", "--input", type=Path, nargs="+", default=[Path(DATA_DIR) / "input_32bit.hex"],
+                    help="images to check the sparse model on")
+    ap.add_argument("--count", type=int, default=None)
+    ap.add_argument("--weight-dir", default=None)
+    ap.add_argument("--num-pe", type=int, default=3)
+    ap.add_argument("--bus-bytes", type=int, default=4)
+    ap.add_argument("--json", type=Path, default=None)
+    args = ap.parse_args()
+
+    weights = load_weights(args.weight_dir)
+    model = Q.load_model(args.weight_dir)
+    sparse = SparseCNN(model)
+    images = mismatches = 0
+    for _, _, x in iter_chunks(iter_images(args.input, 0, args.count), 2048):
+        dense, sp = model.forward_layers(x, trace=True), sparse.forward_layers(x, trace=True)
+        bad = np.zeros(x.shape[0], dtype=bool)
+        for k in dense:
+            bad |= (dense[k] != sp[k]).reshape(x.shape[0], -1).any(axis=1)
+        images += x.shape[0]
+        mismatches += int(bad.sum())
+    print(f"sparse vs dense: {images} images, {mismatches} mismatches")
+
+    rep = report(weights, args.num_pe, args.bus_bytes)
+    print(f"{'layer':6} {'MACs':>7} {'nonzero':>8} {'saved':>6}")
+    for l in rep["layers"]:
+        print(f"{l['layer']:6} {l['macs']:7d} {l['macs_nonzero']:8d} {l['mac_saving']:6.1%}")
+    print(f"{'block':10} {'weights':>7} {'zeros':>6} {'loads':>6} {'skip':>6} {'stream':>6}  (bus words)")
+    rows: List[Dict] = [b for l in rep["layers"] for b in l["blocks"]]
+    for b in rows:
+        print(f"{b['name']:10} {b['weights']:7d} {b['zeros']:6d} {b['loads']:6d} {b['skip']:6d} {b['stream']:6d}")
+    loads = sum(b["loads"] for b in rows)
+    print(f"{'total':10} {sum(b['weights'] for b in rows):7d} {sum(b['zeros'] for b in rows):6d} {loads:6d} "
+          f"{sum(b['skip'] for b in rows):6d} {sum(b['stream'] for b in rows):6d}")
+    if args.json:
+        args.json.write_text(json.dumps(rep, indent=1) + "\n")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
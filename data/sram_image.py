@@ -0,0 +1,142 @@
+"""
+Typed d_cache image: a bytearray the size of RA1SHD_2048x32M8 (2048 x 32-bit
+words) plus a per-byte valid mask, with named regions and zero-copy NumPy
+views of them.
+
+Bytes that were never written are invalid and export as 'xx', like the
+uninitialized words of a simulation dump. Regions are memory_map.Region
+entries; allocating one checks it against the SRAM size and the regions
+already placed.
+
+Usage:
+  img = SramImage.from_map(DEFAULT_MAP)
+  img.write("conv1", conv1)                # copies and marks the bytes valid
+  img.view("conv2")[:] = acc               # zero-copy, shape (1, 12, 11), '<u4'
+  text = img.to_hex32(2000)                # $readmemh lines from byte 2000 on
+  img.write_bin("dcache.bin")
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from hex_codec import decode_hex32, encode_hex32, read_bin, write_bin
+from memory_map import MemoryMap, Region
+
+SRAM_WORDS = 2048       # RA1SHD_2048x32M8
+SRAM_WORD_BYTES = 4
+DCACHE_SIZE = SRAM_WORDS * SRAM_WORD_BYTES
+
+
+class SramImage:
+    def __init__(self, size: int = DCACHE_SIZE):
+        self.buf = bytearray(size)
+        self.mask = bytearray(size)
+        self.data = np.frombuffer(self.buf, dtype=np.uint8)  # views share memory with buf / mask
+        self.valid = np.frombuffer(self.mask, dtype=bool)
+        self.regions: Dict[str, Region] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.buf)
+
+    @classmethod
+    def from_map(cls, mem_map: MemoryMap, size: int = DCACHE_SIZE) -> "SramImage":
+        """Empty image with the weight blocks and result regions of mem_map allocated."""
+        img = cls(size)
+        for r in mem_map.weights + mem_map.regions:
+            img.add(r)
+        return img
+
+    def add(self, region: Region) -> Region:
+        end = region.base + region.nbytes
+        if region.base < 0 or end > self.size:
+            raise ValueError(f"region {region.name} [{region.base}, {end}) outside the {self.size}-byte SRAM")
+        if region.name in self.regions:
+            raise ValueError(f"region {region.name} already allocated")
+        for r in self.regions.values():
+            if region.base < r.base + r.nbytes and r.base < end:
+                raise ValueError(f"region {region.name} [{region.base}, {end}) overlaps {r.name}")
+        self.regions[region.name] = region
+        return region
+
+    def alloc(self, name: str, shape: Tuple[int, ...], elem_bytes: int = 1, base: Optional[int] = None,
+              align: int = SRAM_WORD_BYTES) -> Region:
+        """Add a region at base, or at the first aligned gap after the regions already placed."""
+        nbytes = int(np.prod(shape)) * elem_bytes
+        if base is None:
+            base = 0
+            for r in sorted(self.regions.values(), key=lambda r: r.base):
+                if base + nbytes <= r.base:
+                    break
+                base = max(base, -(-(r.base + r.nbytes) // align) * align)
+        return self.add(Region(name, base, tuple(shape), elem_bytes))
+
+    def region(self, name: str) -> Region:
+        return self.regions[name]
+
+    def view(self, name: str, mark_valid: bool = True) -> np.ndarray:
+        """Writable view of a region, shaped and typed by it (little-endian for multi-byte elements)."""
+        r = self.regions[name]
+        if mark_valid:
+            self.valid[r.base:r.base + r.nbytes] = True
+        dtype = np.uint8 if r.elem_bytes == 1 else np.dtype(f"<u{r.elem_bytes}")
+        return self.data[r.base:r.base + r.nbytes].view(dtype).reshape(r.shape)
+
+    def write(self, name: str, values) -> None:
+        """Store values into a region; int8 keeps its bit pattern, wider elements are stored little endian."""
+        values = np.asarray(values)
+        view = self.view(name)
+        view[...] = values.reshape(view.shape).astype(view.dtype, copy=False)
+
+    def write_bytes(self, offset: int, data) -> None:
+        data = np.asarray(data)
+        data = data.reshape(-1).view(np.uint8) if data.dtype.itemsize == 1 else data.astype(np.uint8).reshape(-1)
+        self.data[offset:offset + data.size] = data
+        self.valid[offset:offset + data.size] = True
+
+    def clear(self) -> None:
+        self.data[:] = 0
+        self.valid[:] = False
+
+    def diff(self, other: "SramImage", start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Byte offsets where self is valid and other is invalid or holds a different value."""
+        stop = min(self.size, other.size) if stop is None else stop
+        a, av = self.data[start:stop], self.valid[start:stop]
+        b, bv = other.data[start:stop], other.valid[start:stop]
+        return np.flatnonzero(av & (~bv | (a != b))) + start
+
+    # $readmemh / raw binary
+
+    def to_hex32(self, start: int = 0, stop: Optional[int] = None) -> str:
+        """32-bit $readmemh lines of [start, stop); a trailing partial word gets a short line."""
+        stop = self.size if stop is None else stop
+        return encode_hex32(self.data[start:stop], valid=self.valid[start:stop])
+
+    def write_hex32(self, path, start: int = 0, stop: Optional[int] = None) -> None:
+        Path(path).write_text(self.to_hex32(start, stop))
+
+    def write_bin(self, path, start: int = 0, stop: Optional[int] = None) -> None:
+        write_bin(path, self.data[start:stop])
+
+    @classmethod
+    def from_hex32(cls, text: str, offset: int = 0, size: int = DCACHE_SIZE) -> "SramImage":
+        """Image from $readmemh text loaded at byte offset; 'xx' bytes stay invalid."""
+        data, valid = decode_hex32(text, dont_care=True)
+        img = cls(size)
+        n = min(data.size, size - offset)
+        img.data[offset:offset + n] = data[:n]
+        img.valid[offset:offset + n] = valid[:n]
+        return img
+
+    @classmethod
+    def read_hex32(cls, path, offset: int = 0, size: int = DCACHE_SIZE) -> "SramImage":
+        return cls.from_hex32(Path(path).read_text(), offset, size)
+
+    @classmethod
+    def read_bin(cls, path, offset: int = 0, size: int = DCACHE_SIZE) -> "SramImage":
+        img = cls(size)
+        img.write_bytes(offset, read_bin(path)[:size - offset])
+        return img
@@ -0,0 +1,292 @@
+"""
+SRAM-aware tiling planner for conv1/conv2 on images larger than 16x15.
+
+write_npu.S keeps the whole image, every conv1 map and the conv2 sums in the
+8 KB d_cache at once, which only works for the 16x15 frame. For an H x W
+image, C1 conv1 channels and a given SRAM capacity, plan() picks the conv2
+output tile (tile_h rows x tile_w columns) and the buffer policy with the
+lowest cost (see below):
+
+  image   each tile needs its conv2 rows/columns plus a 2*(k-1) halo of
+          image pixels. Tiles are processed top to bottom inside each band
+          of columns and keep the bottom 2*(k-1) image rows of the tile
+          above in SRAM (one copy per tile), so inside a band every image
+          row is loaded once; only the column halo shared by neighbouring
+          bands is loaded twice.
+  conv1   computed per tile over the tile plus a (k-1) halo, so the halo
+          columns/rows of neighbouring tiles are recomputed (the npu has no
+          way to keep them) but never stored outside the SRAM.
+  weights either resident (loaded once) or streamed one kernel at a time
+          (loaded again for every tile). The npu reloads the C1 conv1 and
+          C1 conv2 kernels for every tile either way.
+  conv2   the int32 sums of a tile are written out once.
+
+Plans are ranked by one cost in bus bytes: the external traffic, the halo
+rows copied inside the SRAM, KERNEL*KERNEL bytes per npu kernel load and one
+byte per conv1 output read back from the npu (so recomputed halo counts),
+then by the number of tiles. run_tiled() executes a plan through an
+SramImage of the given capacity with the golden kernels (quant_np) and
+counts the bytes it actually moves; main() checks the result is bit-exact
+with the untiled conv1/conv2 and that the counts match the plan.
+
+Usage:
+  python tiling.py --image 64 64                         # plan + golden check with a random image
+  python tiling.py --image 480 640 --channels 10 --sram 8192 --reserve 0
+  python tiling.py --image 128 96 --all 10               # the 10 best plans
+"""
+
+from __future__ import annotations
+import argparse
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+import quant_np as Q
+from memory_map import load_map
+from sram_image import DCACHE_SIZE, SramImage
+from weight_placement import SPILL
+from weights_io import DATA_DIR
+
+KERNEL = 3
+ACC_BYTES = 4           # conv2 sums are stored as words, like write_npu.S does
+KERNEL_LOAD_BYTES = KERNEL * KERNEL  # bytes written to the npu per kernel load
+
+
+def _align(n: int, a: int = 4) -> int:
+    return -(-n // a) * a
+
+
+@dataclass
+class Tile:
+    row: int            # first conv2 output row / column of the tile
+    col: int
+    rows: int
+    cols: int
+    carry: int = 0      # image rows kept from the tile above (same column band)
+
+
+@dataclass
+class Plan:
+    image: Tuple[int, int]
+    channels: int
+    sram: int
+    reserve: int
+    tile_h: int
+    tile_w: int
+    weights_resident: bool
+    footprint: int = 0
+    traffic: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def out_hw(self) -> Tuple[int, int]:
+        h, w = self.image
+        return h - 2 * (KERNEL - 1), w - 2 * (KERNEL - 1)
+
+    def tiles(self) -> Iterator[Tile]:
+        """Tiles in processing order: columns of full-height bands, top to bottom inside each."""
+        h2, w2 = self.out_hw
+        halo = 2 * (KERNEL - 1)
+        for c in range(0, w2, self.tile_w):
+            for r in range(0, h2, self.tile_h):
+                carry = halo if r else 0  # every tile of the band has the same columns
+                yield Tile(r, c, min(self.tile_h, h2 - r), min(self.tile_w, w2 - c), carry)
+
+    @property
+    def cost(self) -> int:
+        t = self.traffic
+        return (t["image_in"] + t["weights_in"] + t["conv2_out"] + t["sram_copy"]
+                + KERNEL_LOAD_BYTES * t["kernel_loads"] + t["conv1_outputs"])
+
+    def key(self) -> Tuple[int, int, bool]:
+        return self.cost, self.traffic["tiles"], not self.weights_resident
+
+
+def conv_weight_bytes(channels: int, k: int = KERNEL) -> int:
+    """conv1 (channels kernels of 1 input channel) + conv2 (channels kernels into 1 output)."""
+    return 2 * channels * k * k
+
+
+def buffers(tile_h: int, tile_w: int, channels: int, weights: int, weights_resident: bool) -> Dict[str, int]:
+    """Word-aligned SRAM buffer sizes of one tile, in allocation order."""
+    halo = KERNEL - 1
+    return {"weights": _align(weights if weights_resident else KERNEL * KERNEL),
+            "image": _align((tile_h + 2 * halo) * (tile_w + 2 * halo)),
+            "conv1": _align(channels * (tile_h + halo) * (tile_w + halo)),
+            "conv2": tile_h * tile_w * ACC_BYTES}
+
+
+def evaluate(plan: Plan) -> Plan:
+    """Fill in the footprint and traffic of a plan (bytes per image)."""
+    h, w = plan.image
+    c1 = plan.channels
+    halo = KERNEL - 1
+    wbytes = conv_weight_bytes(c1)
+    plan.footprint = _align(plan.reserve) + sum(buffers(plan.tile_h, plan.tile_w, c1, wbytes,
+                                                        plan.weights_resident).values())
+    t = dict(image_in=0, sram_copy=0, weights_in=wbytes if plan.weights_resident else 0, conv2_out=0,
+             kernel_loads=0, conv1_outputs=0, tiles=0)
+    for tile in plan.tiles():
+        cols_in = tile.cols + 2 * halo
+        t["image_in"] += (tile.rows + 2 * halo - tile.carry) * cols_in
+        t["sram_copy"] += tile.carry * cols_in
+        t["weights_in"] += 0 if plan.weights_resident else wbytes
+        t["conv2_out"] += tile.rows * tile.cols * ACC_BYTES
+        t["kernel_loads"] += 2 * c1
+        t["conv1_outputs"] += c1 * (tile.rows + halo) * (tile.cols + halo)
+        t["tiles"] += 1
+    t["image_reload"] = t["image_in"] - h * w
+    t["conv1_recompute"] = t["conv1_outputs"] - c1 * (h - halo) * (w - halo)
+    plan.traffic = t
+    return plan
+
+
+def candidates(h: int, w: int, channels: int, sram: int = DCACHE_SIZE, reserve: int = 0) -> Iterator[Plan]:
+    """Every tile size and weight policy that fits in sram bytes next to reserve."""
+    h2, w2 = h - 2 * (KERNEL - 1), w - 2 * (KERNEL - 1)
+    if h2 < 1 or w2 < 1:
+        raise ValueError(f"a {h}x{w} image is smaller than two {KERNEL}x{KERNEL} convolutions need")
+    wbytes = conv_weight_bytes(channels)
+    budget = sram - _align(reserve)
+    for resident in (True, False):
+        for tw in range(w2, 0, -1):
+            # the tallest tile that fits (the footprint grows with the height); shorter ones only add halo
+            lo, hi = 0, h2
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if sum(buffers(mid, tw, channels, wbytes, resident).values()) <= budget:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            if lo:
+                yield evaluate(Plan((h, w), channels, sram, reserve, lo, tw, resident))
+
+
+def plan(h: int, w: int, channels: int, sram: int = DCACHE_SIZE, reserve: int = 0) -> Plan:
+    best = min(candidates(h, w, channels, sram, reserve), key=Plan.key, default=None)
+    if best is None:
+        raise ValueError(f"no tiling of a {h}x{w} image with {channels} channels fits {sram - reserve} bytes")
+    return best
+
+
+def run_tiled(x: np.ndarray, w1: np.ndarray, w2: np.ndarray, p: Plan,
+              b1: Optional[np.ndarray] = None, b2: Optional[np.ndarray] = None
+              ) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+    """Execute plan p on one (H, W) uint8 image inside an SramImage of p.sram bytes.
+
+    Returns the assembled conv1 maps (C1, H-2, W-2), the clamped conv2 sums
+    (1, H-4, W-4) as uint32, and the bytes actually moved."""
+    h, w = p.image
+    c1 = p.channels
+    halo = KERNEL - 1
+    sram = SramImage(p.sram)
+    if p.reserve:
+        sram.alloc("reserve", (p.reserve,))
+    wbytes = conv_weight_bytes(c1)
+    size = buffers(p.tile_h, p.tile_w, c1, wbytes, p.weights_resident)
+    sram.alloc("weights", (size["weights"],))
+    img_buf = sram.alloc("image", (size["image"],))
+    c1_buf = sram.alloc("conv1", (size["conv1"],))
+    c2_buf = sram.alloc("conv2", (p.tile_h * p.tile_w,), ACC_BYTES)
+    kernels = np.concatenate([w1.reshape(-1).view(np.uint8), w2.reshape(-1).view(np.uint8)])
+    moved = dict(image_in=0, sram_copy=0, weights_in=0, conv2_out=0, kernel_loads=0, conv1_outputs=0, tiles=0)
+    if p.weights_resident:
+        sram.write_bytes(sram.region("weights").base, kernels)
+        moved["weights_in"] += kernels.size
+
+    conv1 = np.zeros((c1, h - halo, w - halo), dtype=np.uint8)
+    conv2 = np.zeros((1, h - 2 * halo, w - 2 * halo), dtype=np.uint32)
+    data = sram.data
+    for tile in p.tiles():
+        rows_in, cols_in = tile.rows + 2 * halo, tile.cols + 2 * halo
+        img = data[img_buf.base:img_buf.base + rows_in * cols_in].reshape(rows_in, cols_in)
+        if tile.carry:
+            prev = data[img_buf.base:img_buf.base + (p.tile_h + 2 * halo) * cols_in].reshape(-1, cols_in)
+            img[:tile.carry] = prev[p.tile_h:p.tile_h + tile.carry].copy()  # bottom halo of the band above
+            moved["sram_copy"] += tile.carry * cols_in
+        img[tile.carry:] = x[tile.row + tile.carry:tile.row + rows_in, tile.col:tile.col + cols_in]
+        moved["image_in"] += (rows_in - tile.carry) * cols_in
+        if not p.weights_resident:
+            moved["weights_in"] += kernels.size  # one kernel at a time through the 12-byte buffer
+        moved["kernel_loads"] += 2 * c1
+
+        ch, cw = tile.rows + halo, tile.cols + halo
+        c1_tile = data[c1_buf.base:c1_buf.base + c1 * ch * cw].reshape(1, c1, ch, cw)
+        c1_tile[...] = Q.quantized_conv2d(img[None, None], w1, b1)
+        moved["conv1_outputs"] += c1_tile.size
+        acc = data[c2_buf.base:c2_buf.base + tile.rows * tile.cols * ACC_BYTES].view("<u4").reshape(
+            1, 1, tile.rows, tile.cols)
+        acc[...] = np.clip(Q.conv3d_acc(c1_tile, w2, b2), 0, 2**23 - 1)
+
+        conv1[:, tile.row:tile.row + ch, tile.col:tile.col + cw] = c1_tile[0]
+        conv2[:, tile.row:tile.row + tile.rows, tile.col:tile.col + tile.cols] = acc[0]
+        moved["conv2_out"] += acc.nbytes
+        moved["tiles"] += 1
+    return conv1, conv2, moved
+
+
+def default_reserve(map_path=None) -> int:
+    """d_cache bytes the fc layers keep: their weight blocks and results (weights_map.json)."""
+    m = load_map(map_path or f"{DATA_DIR}/weights_map.json")
+    fc_w = sum(r.nbytes for r in m.weights if r.name.startswith("fc"))
+    fc_out = sum(_align(r.nbytes + SPILL) for r in m.regions if r.name.startswith("fc"))
+    return _align(fc_w) + fc_out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Plan conv1/conv2 tiles for an image that does not fit the d_cache")
+    ap.add_argument("--image", type=int, nargs=2, metavar=("H", "W"), default=(64, 64))
+    ap.add_argument("--channels", type=int, default=None, help="conv1 channels (default: the current weights)")
+    ap.add_argument("--sram", type=int, default=DCACHE_SIZE, help="SRAM bytes")
+    ap.add_argument("--reserve", type=int, default=None, help="bytes kept for the fc layers (default: weights_map.json)")
+    ap.add_argument("--all", type=int, default=0, metavar="N", help="also list the N best plans")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--no-check", action="store_true", help="skip the golden run of the plan")
+    args = ap.parse_args()
+
+    model = Q.load_model()
+    c1 = args.channels or model.q_conv1_w.shape[0]
+    reserve = default_reserve() if args.reserve is None else args.reserve
+    h, w = args.image
+    p = plan(h, w, c1, args.sram, reserve)
+    t = p.traffic
+    untiled = h * w + c1 * (h - 2) * (w - 2) + (h - 4) * (w - 4) * ACC_BYTES + conv_weight_bytes(c1)
+    print(f"{h}x{w} image, {c1} channels, {args.sram} B SRAM with {reserve} B reserved "
+          f"(untiled conv1/conv2 would need {untiled} B)")
+    print(f"tile {p.tile_h}x{p.tile_w} conv2 outputs, {t['tiles']} tiles, weights "
+          f"{'resident' if p.weights_resident else 'streamed'}, {p.footprint} B in use")
+    print(f"  image in     {t['image_in']:9d} B  ({t['image_reload']} B reloaded column halo, {t['sram_copy']} B carried in SRAM)")
+    print(f"  weights in   {t['weights_in']:9d} B")
+    print(f"  conv2 out    {t['conv2_out']:9d} B")
+    print(f"  npu kernels  {t['kernel_loads']:9d} loads")
+    print(f"  conv1 outs   {t['conv1_outputs']:9d}    ({t['conv1_recompute']} recomputed halo)")
+    print(f"  cost         {p.cost:9d} B")
+    if args.all:
+        print(f"{'tile':>9} {'weights':>9} {'tiles':>6} {'cost':>13} {'kernels':>8} {'conv1 redo':>10} {'footprint':>9}")
+        for q in sorted(candidates(h, w, c1, args.sram, reserve), key=Plan.key)[:args.all]:
+            print(f"{q.tile_h:4d}x{q.tile_w:<4d} {'resident' if q.weights_resident else 'streamed':>9} "
+                  f"{q.traffic['tiles']:6d} {q.cost:13d} {q.traffic['kernel_loads']:8d} "
+                  f"{q.traffic['conv1_recompute']:10d} {q.footprint:9d}")
+    if args.no_check:
+        return
+
+    rng = np.random.default_rng(args.seed)
+    x = rng.integers(0, 256, (h, w), dtype=np.uint8)
+    if c1 == model.q_conv1_w.shape[0]:
+        w1, b1, w2, b2 = model.q_conv1_w, model.q_conv1_b, model.q_conv2_w, model.q_conv2_b
+    else:
+        w1 = rng.integers(-128, 128, (c1, 1, KERNEL, KERNEL), dtype=np.int8)
+        w2 = rng.integers(-128, 128, (1, c1, KERNEL, KERNEL), dtype=np.int8)
+        b1 = b2 = None
+    conv1, conv2, moved = run_tiled(x, w1, w2, p, b1, b2)
+    ref1 = Q.quantized_conv2d(x[None, None], w1, b1)[0]
+    ref2 = np.clip(Q.conv3d_acc(ref1[None], w2, b2), 0, 2**23 - 1)[0].astype(np.uint32)
+    same = np.array_equal(conv1, ref1) and np.array_equal(conv2, ref2)
+    counted = {k: moved[k] for k in moved if moved[k] != t[k]}
+    print(f"golden: tiled conv1/conv2 {'bit-exact with' if same else 'DIFFER from'} the untiled run; "
+          f"moved bytes {'match the plan' if not counted else f'differ: {counted}'}")
+    raise SystemExit(0 if same and not counted else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Binary per-layer trace store: the input, the raw int32 accumulator and the
+uint8 output of every layer for each image, from one forward pass.
+
+File layout (<path>):
+
+  header   HEADER_BYTES, b"NTR2", then a little-endian uint32 record count,
+           uint32 stride, uint64 offset of the trailer and the JSON field
+           list [[name, dtype, shape], ...], zero padded
+  records  one fixed-stride record per image, fields in header order:
+             input      (1, 16, 15) uint8
+             conv1_pre  (10, 14, 13) int32    conv1  (10, 14, 13) uint8
+             conv2_pre  (1, 12, 11) int32     conv2  (1, 12, 11) uint8
+             fc1_pre    (10,) int32           fc1    (10,) uint8
+             fc2_pre    (1,) int32            fc2    (1,) uint8
+  trailer  JSON {"sources": [file, ...]}, the source files the index
+           refers to, as long as it needs to be
+
+and its offset index (<path>.idx, a .npy structured array): per record the
+byte offset, the source file / frame it came from and an 8-byte digest of
+the input, for lookups by image. Both are memory-mapped on read, so opening
+a store with millions of records costs nothing and a record is one page
+fault away.
+
+Usage:
+  python trace_store.py write -i input_32bit.hex -o trace.ntr
+  python trace_store.py write -i vectors.hex --count 100000 -o /scratch/vec.ntr --chunk 4096
+  python trace_store.py show trace.ntr 17 --layer conv2_pre
+  python trace_store.py show trace.ntr 17 --res res_17.hex
+  python trace_store.py find trace.ntr -i input_32bit.hex
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backend import BACKENDS, get_backend
+from batch_run import IMG_SHAPE, iter_chunks, iter_images
+
+MAGIC = b"NTR2"
+HEADER_BYTES = 4096
+LAYERS = ("conv1", "conv2", "fc1", "fc2")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("source", "<u4"), ("frame", "<u4"), ("digest", "V8")])
+
+
+def record_fields(model) -> List[Tuple[str, str, Tuple[int, ...]]]:
+    """(name, dtype, shape) of every record field, with the shapes taken from the model."""
+    cin, h, w = IMG_SHAPE
+    k1, k2 = model.q_conv1_w.shape[2:], model.q_conv2_w.shape[2:]
+    c1 = model.q_conv1_w.shape[0]
+    h1, w1 = h - k1[0] + 1, w - k1[1] + 1
+    h2, w2 = h1 - k2[0] + 1, w1 - k2[1] + 1
+    shapes = {"conv1": (c1, h1, w1), "conv2": (1, h2, w2),
+              "fc1": (model.q_fc1_w.shape[0],), "fc2": (model.q_fc2_w.shape[0],)}
+    fields = [("input", "u1", (cin, h, w))]
+    for name in LAYERS:
+        fields += [(f"{name}_pre", "<i4", shapes[name]), (name, "u1", shapes[name])]
+    return fields
+
+
+def record_dtype(fields) -> np.dtype:
+    return np.dtype([(name, dt, tuple(shape)) for name, dt, shape in fields])
+
+
+def digest(img: np.ndarray) -> bytes:
+    return hashlib.blake2b(np.ascontiguousarray(img, dtype=np.uint8).tobytes(), digest_size=8).digest()
+
+
+class TraceWriter:
+    """Append records batch by batch; the count in the header is written on close."""
+
+    def __init__(self, path, fields):
+        self.path = Path(path)
+        self.fields = [(n, d, tuple(s)) for n, d, s in fields]
+        self.dtype = record_dtype(self.fields)
+        self.sources: List[str] = []
+        self._source_ids: Dict[str, int] = {}
+        self.count = 0
+        self.index: List[np.ndarray] = []
+        self._meta = json.dumps({"fields": self.fields}).encode()
+        if len(self._meta) + 20 > HEADER_BYTES:  # checked before any record is written
+            raise ValueError(f"trace header needs {len(self._meta) + 20} bytes, more than {HEADER_BYTES}")
+        self.f = open(self.path, "wb")
+        self.f.write(self._header(0).ljust(HEADER_BYTES, b"\0"))
+
+    def _header(self, trailer: int) -> bytes:
+        return MAGIC + struct.pack("<IIQ", self.count, self.dtype.itemsize, trailer) + self._meta
+
+    def append(self, layers: Dict[str, np.ndarray], x: np.ndarray, sources: Optional[List[Tuple[str, int]]] = None):
+        """Add one batch: x (N, 1, 16, 15) and forward_layers(x, trace=True) as numpy arrays."""
+        n = x.shape[0]
+        rec = np.zeros(n, dtype=self.dtype)
+        rec["input"] = x
+        for name, _, _ in self.fields[1:]:
+            rec[name] = layers[name]
+        idx = np.zeros(n, dtype=INDEX_DTYPE)
+        idx["offset"] = HEADER_BYTES + (self.count + np.arange(n, dtype=np.uint64)) * self.dtype.itemsize
+        for k in range(n):
+            src, frame = sources[k] if sources else ("", self.count + k)
+            sid = self._source_ids.get(src)
+            if sid is None:
+                sid = self._source_ids[src] = len(self.sources)
+                self.sources.append(src)
+            idx[k]["source"] = sid
+            idx[k]["frame"] = frame
+            idx[k]["digest"] = np.void(digest(x[k]))
+        self.f.write(rec.tobytes())
+        self.index.append(idx)
+        self.count += n
+
+    def close(self):
+        trailer = HEADER_BYTES + self.count * self.dtype.itemsize
+        self.f.write(json.dumps({"sources": self.sources}).encode())
+        self.f.seek(0)
+        self.f.write(self._header(trailer))
+        self.f.close()
+        index = np.concatenate(self.index) if self.index else np.zeros(0, dtype=INDEX_DTYPE)
+        with open(f"{self.path}.idx", "wb") as f:
+            np.save(f, index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TraceStore:
+    """Read side: records and index memory-mapped, record i as a numpy void with named fields."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            head = f.read(HEADER_BYTES)
+            if head[:4] != MAGIC:
+                raise ValueError(f"{self.path}: not a trace store")
+            self.count, stride, trailer = struct.unpack_from("<IIQ", head, 4)
+            meta = json.loads(head[20:].rstrip(b"\0"))
+            f.seek(trailer)
+            meta.update(json.loads(f.read()))
+        self.fields = [(n, d, tuple(s)) for n, d, s in meta["fields"]]
+        self.sources: List[str] = meta["sources"]
+        self.dtype = record_dtype(self.fields)
+        if self.dtype.itemsize != stride:
+            raise ValueError(f"{self.path}: stride {stride} does not match its fields ({self.dtype.itemsize})")
+        if self.count:
+            self.records = np.memmap(self.path, dtype=self.dtype, mode="r", offset=HEADER_BYTES, shape=(self.count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)  # np.memmap refuses an empty map
+        self.index = np.load(f"{self.path}.idx", mmap_mode="r")
+        self._by_digest: Optional[Dict[bytes, int]] = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    def layer(self, name: str) -> np.ndarray:
+        """(count, ...) view of one field over all records."""
+        return self.records[name]
+
+    def source(self, i: int) -> Tuple[str, int]:
+        e = self.index[i]
+        return self.sources[int(e["source"])], int(e["frame"])
+
+    def find(self, img: np.ndarray) -> Optional[int]:
+        """Record index of the first record whose input is img, or None."""
+        if self._by_digest is None:
+            d = self.index["digest"]
+            self._by_digest = {}
+            for i in range(len(d) - 1, -1, -1):
+                self._by_digest[bytes(d[i])] = i
+        i = self._by_digest.get(digest(img))
+        if i is not None and np.array_equal(self.records[i]["input"], img.reshape(self.records[i]["input"].shape)):
+            return i
+        return None
+
+    def __iter__(self) -> Iterator:
+        return iter(self.records)
+
+
+def write(paths: List[Path], out: Path, chunk: int = 2048, skip: int = 0, count: Optional[int] = None,
+          backend: Optional[str] = None) -> int:
+    """Trace every image of the hex files into out; returns the number of records."""
+    B = get_backend(backend)
+    model = B.load_model()
+    with TraceWriter(out, record_fields(model)) as w:
+        for _, sources, x in iter_chunks(iter_images(paths, skip, count), chunk):
+            layers = {k: B.to_numpy(v) for k, v in model.forward_layers(B.from_numpy(x), trace=True).items()}
+            w.append(layers, x, sources)
+        return w.count
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-layer accumulator/output trace store")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    wp = sub.add_parser("write", help="trace the images of hex files")
+    wp.add_argument("-i", "--input", type=Path, nargs="+", required=True, help="32-bit/line hex files, 60 lines per image")
+    wp.add_argument("-o", "--output", type=Path, required=True)
+    wp.add_argument("--skip", type=int, default=0)
+    wp.add_argument("--count", type=int, default=None)
+    wp.add_argument("--chunk", type=int, default=2048)
+    wp.add_argument("--backend", choices=sorted(BACKENDS), default=None)
+    sp = sub.add_parser("show", help="print one record")
+    sp.add_argument("store", type=Path)
+    sp.add_argument("index", type=int)
+    sp.add_argument("--layer", default=None, help="print only this field")
+    sp.add_argument("--res", type=Path, default=None, help="also write the record as res.hex")
+    fp = sub.add_parser("find", help="look up the records of the images in hex files")
+    fp.add_argument("store", type=Path)
+    fp.add_argument("-i", "--input", type=Path, nargs="+", required=True)
+    args = ap.parse_args()
+
+    if args.cmd == "write":
+        n = write(args.input, args.output, args.chunk, args.skip, args.count, args.backend)
+        store = TraceStore(args.output)
+        print(f"Records: {n} x {store.dtype.itemsize} B")
+        print(f"Saved: {args.output} (+ .idx)")
+        return
+
+    store = TraceStore(args.store)
+    if args.cmd == "show":
+        rec = store[args.index]
+        src, frame = store.source(args.index)
+        print(f"record {args.index} of {len(store)}: {src or '-'} frame {frame}")
+        np.set_printoptions(linewidth=160, threshold=100000)
+        for name, _, shape in store.fields:
+            if args.layer in (None, name):
+                print(f"{name} {shape}:\n{rec[name]}")
+        if args.res:
+            from cal_result import res_hex_lines
+            acc2 = np.clip(rec["conv2_pre"], 0, 2**23 - 1).astype(np.uint32)
+            args.res.write_text("\n".join(res_hex_lines(rec["conv1"], acc2, rec["fc1"], rec["fc2"])) + "\n")
+            print(f"Saved: {args.res}")
+    else:
+        for src, frame, img in iter_images(args.input):
+            i = store.find(img)
+            print(f"{src}:{frame} -> {'not found' if i is None else i}")
+
+
+if __name__ == "__main__":
+    main()
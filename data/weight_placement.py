@@ -1,50 +1,157 @@
-from network_structure import *
+"""
+Weight placement compiler: packs the quantized weights into the d_cache
+image the host program loads (weights.hex) and writes the address map of
+every weight block and layer result (memory_map.py format), for a given
+network and number of fc PEs.
 
-if __name__ == "__main__":
+Packing follows the npu port (rtl_4pe/_npu.sv):
+  conv  kernels (one per output channel of conv1, one per input channel of
+        conv2) are stored column by column. The host sends a kernel column
+        as one bus word with k weight bytes and loads words k bytes apart, so
+        nothing is padded.
+  fc    neurons go in groups of lanes = min(NUM_PE, bus_bytes - 1). In S_FCN
+        a write carries one input and one weight per PE, so for each group
+        and input the group's weights are lanes consecutive bytes. Leftover
+        neurons run in S_FCN_LAST, where the PEs split the inputs of one
+        neuron, min(NUM_PE, bus_bytes // 2) per write. Their weight rows are
+        stored as they are, zero padded to a whole number of writes.
+
+The image sits at byte 0 and the weights follow it. Layer results keep the
+write_npu.S addresses (memory_map.DEFAULT_MAP) when they fit and are packed
+after the weights otherwise.
+
+Usage:
+  python weight_placement.py                       # weights.hex + weights_map.json for the current net
+  python weight_placement.py --num-pe 2 --weight-dir other_net -o build/weights.hex --map build/map.json
+"""
+
+from __future__ import annotations
+import argparse
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from hex_codec import encode_hex32
+from memory_map import DEFAULT_MAP, MemoryMap, Region
+from sram_image import DCACHE_SIZE
+from weights_io import DATA_DIR, load_weights
+
+SPILL = 3               # a byte result stored with sw may write up to 3 bytes past its end
+
+
+def fc_lanes(num_pe: int, bus_bytes: int) -> Tuple[int, int]:
+    """Neurons per S_FCN write and inputs per S_FCN_LAST write."""
+    return max(1, min(num_pe, bus_bytes - 1)), max(1, min(num_pe, bus_bytes // 2))
+
+
+@dataclass
+class Block:
+    name: str
+    base: int               # d_cache byte offset
+    data: np.ndarray        # packed int8 weights
+    shape: Tuple[int, ...]  # of data, in packing order
+    loads: int              # bus words the host loads for the block
+    layout: str
+
+    def region(self) -> Region:
+        return Region(self.name, self.base, self.shape, 1, self.layout)
+
+
+def pack_conv(name: str, w: np.ndarray, base: int, bus_bytes: int) -> Block:
+    """w: (Cout, Cin, k, k); kernels in [Cout][Cin] order, each as [col][row]."""
+    cout, cin, k, _ = w.shape
+    if k > bus_bytes:
+        raise ValueError(f"{name}: a {k}x{k} kernel column does not fit a {bus_bytes}-byte bus word")
+    data = w.reshape(cout * cin, k, k).transpose(0, 2, 1)
+    return Block(name, base, data.ravel(), data.shape, cout * cin * k,
+                 f"[kernel][col][row] = w[kernel // {cin}, kernel % {cin}, row, col]")
 
-    hex_list = []
-    for chan in range(10):
-        for row in range(3):
-            for col in range(3):
-                val = conv1_weight[chan, 0, col, row]
-                # np.int8转无符号8位整数
-                val = int(val) & 0xFF
-                hex_str = format(val, '02X')
-                hex_list.append(hex_str)
-    for chan in range(10):
-        for row in range(3):
-            for col in range(3):
-                val = conv2_weight[0, chan, col, row]
-                # np.int8转无符号8位整数
-                val = int(val) & 0xFF
-                hex_str = format(val, '02X')
-                hex_list.append(hex_str)
-    for chan in range(3):                     ### fc1 1-9 chan
-        for row in range(132):
-            for i in range(3):
-                val = fc1_weight[chan*3+i, row]
-                # np.int8转无符号8位整数
-                val = int(val) & 0xFF
-                hex_str = format(val, '02X')
-                hex_list.append(hex_str)
-    for row in range(132):                  ## fc1 last chan
-        val = fc1_weight[9, row]
-        # np.int8转无符号8位整数
-        val = int(val) & 0xFF
-        hex_str = format(val, '02X')
-        hex_list.append(hex_str)
-    for row in range(10):
-        val = fc2_weight[0, row]
-        # np.int8转无符号8位整数
-        val = int(val) & 0xFF
-        hex_str = format(val, '02X')
-        hex_list.append(hex_str)
-    # print(hex_list)
-
-    with open("weights.hex", "w") as f:
-        for i in range(0, len(hex_list), 4):
-            group = hex_list[i:i+4]
-            group = group[::-1]  # 逆序
-            line = ''.join(group)
-            f.write(line + '\n')
-    
+
+def pack_fc(name: str, w: np.ndarray, base: int, num_pe: int, bus_bytes: int) -> List[Block]:
+    """w: (n_out, n_in); full S_FCN groups first, then the S_FCN_LAST rows."""
+    n_out, n_in = w.shape
+    lanes, lanes_last = fc_lanes(num_pe, bus_bytes)
+    passes, rest = divmod(n_out, lanes)
+    blocks = []
+    if passes:
+        data = w[:passes * lanes].reshape(passes, lanes, n_in).transpose(0, 2, 1)
+        blocks.append(Block(f"{name}.full", base, data.ravel(), data.shape, passes * n_in,
+                            f"[group][in][lane] = w[group * {lanes} + lane, in]"))
+        base += data.size
+    if rest:
+        width = -(-n_in // lanes_last) * lanes_last
+        data = np.zeros((rest, width), dtype=w.dtype)
+        data[:, :n_in] = w[passes * lanes:]
+        first = f"{passes * lanes} + neuron" if passes else "neuron"
+        blocks.append(Block(f"{name}.last", base, data.ravel(), data.shape, rest * width // lanes_last,
+                            f"[neuron][in] = w[{first}, in], {lanes_last} inputs per write"))
+    return blocks
+
+
+def place(weights: Dict[str, np.ndarray], img_hw: Tuple[int, int] = (16, 15), num_pe: int = 3,
+          bus_bytes: int = 4) -> Tuple[np.ndarray, List[Block], MemoryMap]:
+    """Packed weight bytes (from the first weight block on), the blocks and the full address map."""
+    conv1, conv2 = weights["conv1_weight"], weights["conv2_weight"]
+    fc1, fc2 = weights["fc1_weight"], weights["fc2_weight"]
+
+    base = img_hw[0] * img_hw[1]
+    blocks = [pack_conv("conv1", conv1, base, bus_bytes)]
+    blocks.append(pack_conv("conv2", conv2, blocks[-1].base + blocks[-1].data.size, bus_bytes))
+    for name, w in (("fc1", fc1), ("fc2", fc2)):
+        blocks += pack_fc(name, w, blocks[-1].base + blocks[-1].data.size, num_pe, bus_bytes)
+    packed = np.concatenate([b.data for b in blocks]).astype(np.int8)
+    end = blocks[-1].base + blocks[-1].data.size
+
+    # result shapes: conv1 per output channel, conv2 summed over its input channels
+    k1, k2 = conv1.shape[-1], conv2.shape[-1]
+    h1, w1 = img_hw[0] - k1 + 1, img_hw[1] - k1 + 1
+    h2, w2 = h1 - k2 + 1, w1 - k2 + 1
+    shapes = {"conv1": (conv1.shape[0], h1, w1), "conv2": (conv2.shape[0], h2, w2),
+              "fc1": (fc1.shape[0],), "fc2": (fc2.shape[0],)}
+    if conv2.shape[1] != conv1.shape[0] or fc1.shape[1] != conv2.shape[0] * h2 * w2 or fc2.shape[1] != fc1.shape[0]:
+        raise ValueError(f"layer shapes do not chain for a {img_hw[0]}x{img_hw[1]} image: conv1 {conv1.shape}, "
+                         f"conv2 {conv2.shape}, fc1 {fc1.shape}, fc2 {fc2.shape}")
+    regions, cursor = [], end + SPILL
+    for r in DEFAULT_MAP.regions:
+        region = Region(r.name, r.base, shapes[r.name], r.elem_bytes)
+        if r.base < cursor:
+            region = Region(r.name, -(-cursor // 4) * 4, shapes[r.name], r.elem_bytes)
+        regions.append(region)
+        cursor = region.base + region.nbytes + (SPILL if region.elem_bytes == 1 else 0)
+    if cursor > DCACHE_SIZE:
+        raise ValueError(f"image, weights and results need {cursor} bytes, d_cache has {DCACHE_SIZE}")
+    mem_map = MemoryMap(regions[0].base, tuple(regions), tuple(b.region() for b in blocks))
+    return packed, blocks, mem_map
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pack the weights into weights.hex and write the d_cache address map")
+    ap.add_argument("--weight-dir", default=None, help="directory with the *_weight.txt files")
+    ap.add_argument("--num-pe", type=int, default=3, help="fc PEs (the RTL instantiates K_H = 3)")
+    ap.add_argument("--bus-bytes", type=int, default=4)
+    ap.add_argument("--img", type=int, nargs=2, default=(16, 15), metavar=("H", "W"))
+    ap.add_argument("-o", "--output", default=os.path.join(DATA_DIR, "weights.hex"))
+    ap.add_argument("--map", default=os.path.join(DATA_DIR, "weights_map.json"))
+    args = ap.parse_args()
+
+    weights = load_weights(args.weight_dir)
+    packed, blocks, mem_map = place(weights, tuple(args.img), args.num_pe, args.bus_bytes)
+
+    # 4 bytes per line, 逆序 (little endian)
+    with open(args.output, "w") as f:
+        f.write(encode_hex32(packed))
+    with open(args.map, "w") as f:
+        f.write(mem_map.to_json() + "\n")
+
+    print(f"{'block':10} {'base':>6} {'bytes':>6} {'loads':>6}  layout")
+    for b in blocks:
+        print(f"{b.name:10} {b.base:6d} {b.data.size:6d} {b.loads:6d}  {b.layout}")
+    print(f"{packed.size} bytes in {-(-packed.size // 4)} words, {sum(b.loads for b in blocks)} host loads")
+    for r in mem_map.regions:
+        print(f"result {r.name:6} at {r.base:5d}, {r.nbytes} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Weight and input file loading shared by the golden model backends
+(network_structure.py for torch, quant_np.py for NumPy). Only NumPy is
+imported here.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from hex_codec import decode_hex32, decode_weights
+
+# Load weights from the `.txt` files (assumed to be in 16 hexadecimal format)
+def load_hex_weights(file_path):
+    # Space-separated hex bytes, two's complement int8
+    with open(file_path, 'r') as f:
+        return decode_weights(f.read())
+
+def load_input(file_path):
+    # 32-bit words per line, first pixel in the low byte
+    with open(file_path, 'r') as f:
+        return decode_hex32(f.read())
+
+# Weight files and the shapes the network uses them in, relative to the weight directory
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+WEIGHT_FILES = {
+    "conv1_weight": ("conv1_weight.txt", (10, 1, 3, 3)),
+    "conv2_weight": ("conv2_weight.txt", (1, 10, 3, 3)),
+    "fc1_weight": ("fc1_weight.txt", (10, 132)),
+    "fc2_weight": ("fc2_weight.txt", (1, 10)),
+}
+# Bias initialization (zero)
+BIAS_SIZES = {"conv1_bias": 10, "conv2_bias": 3, "fc1_bias": 10, "fc2_bias": 1}
+WEIGHT_CACHE = ".weights_cache.npz"
+
+def _file_key(path, old=None):
+    # (size, mtime_ns, sha256); the hash is only recomputed when size/mtime changed
+    st = os.stat(path)
+    if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+        return old
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return [st.st_size, st.st_mtime_ns, digest]
+
+def _read_weight_cache(cache_path):
+    try:
+        with np.load(cache_path, allow_pickle=False) as npz:
+            return json.loads(str(npz["key"])), {k: npz[k] for k in npz.files if k != "key"}
+    except (OSError, ValueError, KeyError):
+        return {}, {}
+
+def load_weights(weight_dir=None, cache=True):
+    # Parsed int8 weights (reshaped) and zero biases as numpy arrays. The parse
+    # result is kept in a binary sidecar next to the weight files, keyed by each
+    # file's size/mtime/sha256, so repeat loads skip hex parsing.
+    weight_dir = weight_dir or DATA_DIR
+    cache_path = os.path.join(weight_dir, WEIGHT_CACHE)
+    old_key, arrays, key = {}, {}, {}
+    if cache:
+        old_key, arrays = _read_weight_cache(cache_path)
+        key = {name: _file_key(os.path.join(weight_dir, fname), old_key.get(name))
+               for name, (fname, _) in WEIGHT_FILES.items()}
+
+    weights = {}
+    for name, (fname, shape) in WEIGHT_FILES.items():
+        if name in arrays and key[name][2] == old_key.get(name, [None] * 3)[2]:
+            weights[name] = arrays[name].reshape(shape)
+        else:
+            weights[name] = load_hex_weights(os.path.join(weight_dir, fname)).reshape(shape)
+    for name, size in BIAS_SIZES.items():
+        weights[name] = np.zeros(size, dtype=np.int8)
+
+    if cache and key != old_key:
+        tmp = f"{cache_path}.{os.getpid()}.tmp.npz"  # per process: workers may write it at once
+        try:
+            np.savez(tmp, key=np.array(json.dumps(key)), **{k: weights[k] for k in WEIGHT_FILES})
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass  # read-only weight directory: just parse again next time
+    return weights
@@ -23,7 +23,7 @@ from __future__ import annotations
 import argparse
 import re
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List
 
 
 HEX_RE = re.compile(r"[0-9A-Fa-f]+")
@@ -52,54 +52,39 @@ def split_overflow(line: str) -> List[str]:
     return out
 
 
-def fill_to_32bit(lines: List[str]) -> List[str]:
+def iter_fill_to_32bit(lines: Iterable[str]) -> Iterator[str]:
     """
-    主逻辑：对每一行补齐到 8 个十六进制字符，借位来自下一行（右端）。
-    会就地消费后续行的低位字符；若最后仍不足，则在当前行右侧补 0。
+    流式版本：逐行读入、逐行产出，语义与原先的逐行借位完全一致。
+    只保留当前待补齐的一行（不超过 8 字符）作为进位缓冲，
+    每个输入字符只处理一次，O(n) 时间、常数内存。
     """
-    # 先把每行都处理成不超过 8 字符（>8 的分拆为多行，尽量不丢信息）
-    normalized: List[str] = []
+    cur = ""
     for s in lines:
         if not s:
             continue
-        for chunk in split_overflow(s):
-            normalized.append(chunk)
-
-    i = 0
-    while i < len(normalized):
-        cur = normalized[i]
-        if len(cur) == 8:
-            i += 1
-            continue
-
-        # 借位填充（借来的数字应放到高位，原行在低位）
-        need = 8 - len(cur)
-        j = i + 1
-        while need > 0 and j < len(normalized):
-            nxt = normalized[j]
-            if not nxt:
-                # 删除空行
-                normalized.pop(j)
+        # >8 的行先分拆为多行，尽量不丢信息
+        for nxt in split_overflow(s):
+            if not cur:
+                cur = nxt
                 continue
-            take = min(need, len(nxt))
-            # 从下一行的右端（低位）截取 take 个字符，放到当前行高位
-            cur = nxt[-take:] + cur
+            # 借位填充（借来的数字应放到高位，原行在低位）
+            take = min(8 - len(cur), len(nxt))
+            cur = nxt[len(nxt) - take :] + cur
             nxt = nxt[: len(nxt) - take]
-            normalized[i] = cur
-            if nxt:
-                normalized[j] = nxt
-            else:
-                normalized.pop(j)  # 删除已被取空的行
-            need = 8 - len(cur)
-
-        # 文件末尾仍不足，高位补 0
-        if len(cur) < 8:
-            cur = ("0" * (8 - len(cur))) + cur
-            normalized[i] = cur
+            if len(cur) == 8:
+                yield cur
+                cur = nxt  # 被借剩下的部分成为新的当前行；取空则删除
+    # 文件末尾仍不足，高位补 0
+    if cur:
+        yield ("0" * (8 - len(cur))) + cur
 
-        i += 1
 
-    return normalized
+def fill_to_32bit(lines: List[str]) -> List[str]:
+    """
+    主逻辑：对每一行补齐到 8 个十六进制字符，借位来自下一行（右端）。
+    会消费后续行的低位字符；若最后仍不足，则在当前行高位补 0。
+    """
+    return list(iter_fill_to_32bit(lines))
 
 
 def main():
@@ -110,20 +95,25 @@ def main():
     )
     args = ap.parse_args()
 
-    text = args.input.read_text(encoding="utf-8", errors="ignore")
-    raw_lines = [normalize_hex(ln) for ln in text.splitlines()]
-    # 过滤空行
-    raw_lines = [ln for ln in raw_lines if ln]
+    out_path = args.output or args.input.with_name(args.input.stem + "_filled.hex")
+    counts = {"in": 0, "out": 0}
 
-    filled = fill_to_32bit(raw_lines)
+    def raw_lines():
+        with args.input.open("r", encoding="utf-8", errors="ignore") as f:
+            for ln in f:
+                ln = normalize_hex(ln)
+                # 过滤空行
+                if ln:
+                    counts["in"] += 1
+                    yield ln
 
-    out_path = args.output or args.input.with_name(args.input.stem + "_filled.hex")
     with out_path.open("w", encoding="utf-8") as f:
-        for ln in filled:
+        for ln in iter_fill_to_32bit(raw_lines()):
             f.write(ln.upper() + "\n")
+            counts["out"] += 1
 
-    print(f"Input lines: {len(raw_lines)}")
-    print(f"Output lines: {len(filled)}")
+    print(f"Input lines: {counts['in']}")
+    print(f"Output lines: {counts['out']}")
     print(f"Saved: {out_path}")
 
 
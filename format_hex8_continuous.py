@@ -1,26 +1,13 @@
-import re
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / "data"))
+from hex_codec import decode_hex_tokens, encode_hex32  # noqa: E402
+
 def parse_hex_bytes(text: str):
-    bytes_out = []
-    for line in text.splitlines():
-        # 拆分空白分隔的 token（可能是“8位字节”或“32位连写”）
-        for tok in line.strip().split():
-            # 去掉非十六进制字符
-            tok = re.sub(r'[^0-9A-Fa-f]', '', tok)
-            if not tok:
-                continue
-            # 若是奇数个字符，前补 0
-            if len(tok) % 2 == 1:
-                tok = '0' + tok
-            # 按两位切成字节（左到右）
-            for i in range(0, len(tok), 2):
-                try:
-                    b = int(tok[i:i+2], 16)
-                    bytes_out.append(b)
-                except ValueError:
-                    pass
-    return bytes_out
+    # 拆分空白分隔的 token（可能是“8位字节”或“32位连写”），去掉非十六进制字符，
+    # 奇数个字符前补 0，再按两位切成字节（左到右）
+    return decode_hex_tokens(text)
 
 def main():
     in_path = Path(r"c:\Users\hutao\MySpace\coding\NPU\dcache_init.hex")
@@ -30,9 +17,7 @@ def main():
     data = parse_hex_bytes(text)
 
     with out_path.open("w", encoding="utf-8") as f:
-        for i in range(0, len(data), 4):
-            line = ''.join(f"{b:02X}" for b in data[i:i+4])  # 删掉空格，连续
-            f.write(line + "\n")
+        f.write(encode_hex32(data, byteorder="big"))  # 删掉空格，连续
 
     print(f"Done. bytes={len(data)}, lines={(len(data)+3)//4}")
     print(f"Output: {out_path}")
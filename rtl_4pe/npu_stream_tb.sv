@@ -0,0 +1,94 @@
+// npu_stream_tb.sv - streaming TB for npu (_npu.sv), driven by data/cosim.py
+//
+// Compiled once, it keeps running and reads bus transactions from the file or
+// named pipe given by +stream=<path>, one fixed-width line each:
+//   X 0000 00000000   reset the npu
+//   F 0000 <frame>    a frame starts
+//   W <addr> <data>   bus write (hex)
+//   R <addr> 00000000 bus read, printed as "R <data>"
+//   E 0000 <frame>    the frame ends, printed as "E <frame> <cycles>"
+//   Q 0000 00000000   finish
+// Every transaction holds the port for one cycle, followed by +idle=<n>
+// (default 2) idle cycles, like the host's MMIO accesses.
+`timescale 1ns/1ps
+
+module npu_stream_tb;
+    logic        clk;
+    logic        rst_ni;
+    logic        ena;
+    logic        wea;
+    logic [15:0] addra;
+    logic [31:0] dina;
+    logic [31:0] douta;
+
+    npu dut (
+        .clk(clk),
+        .rst_ni(rst_ni),
+        .ena(ena),
+        .wea(wea),
+        .addra(addra),
+        .dina(dina),
+        .douta(douta)
+    );
+
+    initial begin
+        clk = 0;
+        forever #5 clk = ~clk;
+    end
+
+    integer fd, n, idle, cycles, start;
+    reg [8*1024-1:0] path;
+    reg [7:0]  cmd;
+    reg [15:0] a;
+    reg [31:0] d;
+
+    always @(posedge clk) cycles <= cycles + 1;
+
+    task automatic access(input logic w, input logic [15:0] ad, input logic [31:0] dt);
+        @(negedge clk);
+        ena = 1'b1; wea = w; addra = ad; dina = dt;
+        @(negedge clk);
+        ena = 1'b0; wea = 1'b0;
+        repeat (idle) @(negedge clk);
+    endtask
+
+    initial begin
+        ena = 0; wea = 0; addra = 0; dina = 0; rst_ni = 1; cycles = 0; start = 0;
+        if (!$value$plusargs("idle=%d", idle)) idle = 2;
+        if (!$value$plusargs("stream=%s", path)) begin
+            $display("npu_stream_tb: no +stream=<path>");
+            $finish;
+        end
+        fd = $fopen(path, "r");
+        if (fd == 0) begin
+            $display("npu_stream_tb: cannot open %0s", path);
+            $finish;
+        end
+        forever begin
+            n = $fscanf(fd, "%c %h %h\n", cmd, a, d);
+            if (n != 3 || cmd == "Q") begin
+                $fflush();
+                $finish;
+            end
+            case (cmd)
+                "X": begin
+                    @(negedge clk); rst_ni = 0;
+                    repeat (2) @(negedge clk);
+                    rst_ni = 1;
+                    repeat (idle + 1) @(negedge clk);
+                end
+                "F": start = cycles;
+                "W": access(1'b1, a, d);
+                "R": begin
+                    access(1'b0, a, 32'd0);
+                    $display("R %08h", douta);
+                end
+                "E": begin
+                    $display("E %0d %0d", d, cycles - start);
+                    $fflush();
+                end
+                default: $display("npu_stream_tb: bad command %c", cmd);
+            endcase
+        end
+    end
+endmodule